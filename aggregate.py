@@ -0,0 +1,122 @@
+"""
+Aggregation script that derives the visualization datasets from the rollup store.
+Rollups are updated by `runner.py` as each date is processed, so the commands
+below only sum precomputed daily partial sums and never rescan raw speeds.
+
+Examples:
+    python aggregate.py backfill
+    python aggregate.py chart-speeds --start-date 2024-12-03 --end-date 2025-01-04 \
+        --output data/chart-speeds/control_speeds.parquet
+    python aggregate.py map-speeds --mdb-id mdb-513 --routes M50,M102 \
+        --control 2024-12-03 2025-01-04 --treatment 2025-01-05 2025-02-06
+    python aggregate.py percentiles --start-date 2025-01-05 --end-date 2025-02-06 \
+        --by route_id,prev_stop_id,stop_id,weekday,rush_hour --output data/segment-percentiles.parquet
+    python aggregate.py dashboard-cache
+    python aggregate.py route-catalog
+    python aggregate.py segment-hours
+"""
+import argparse
+import os
+from src.dashboard_data import (CONTROL_PERIOD, DASHBOARD_STORE_DIR, ROUTE_DATA, SEGMENT_HOURS_FILE,
+                                TREATMENT_PERIOD, DashboardData)
+from src.route_catalog import build_route_store
+from src.rollups import (ROLLUPS_DIR, rebuild_rollups, segment_percentiles, write_chart_speeds,
+                         write_segment_hours)
+from src.raw_speeds import RAW_SPEEDS_DIR
+from src.segment_cube import SegmentSpeedCube
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Aggregate bus speeds from the rollup store')
+    parser.add_argument('--rollup-dir', default=ROLLUPS_DIR, help='Rollup store directory')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backfill = subparsers.add_parser('backfill', help='Rebuild rollups from the raw speeds dataset')
+    backfill.add_argument('--raw-dir', default=RAW_SPEEDS_DIR, help='Raw speeds dataset directory')
+
+    chart = subparsers.add_parser('chart-speeds', help='Write hourly route speeds for a period')
+    chart.add_argument('--start-date', required=True, help='Start date (YYYY-MM-DD)')
+    chart.add_argument('--end-date', required=True, help='End date (YYYY-MM-DD)')
+    chart.add_argument('--output', required=True, help='Output parquet path')
+    chart.add_argument('--routes', help='Comma-separated list of route IDs (default: all)')
+
+    map_speeds = subparsers.add_parser('map-speeds', help='Write segment speed differences between two periods')
+    map_speeds.add_argument('--mdb-id', required=True, help='Mobility Database ID used in file names (e.g. mdb-513)')
+    map_speeds.add_argument('--routes', required=True, help='Comma-separated list of route IDs')
+    map_speeds.add_argument('--control', nargs=2, required=True, metavar=('START', 'END'),
+                            help='Control period (YYYY-MM-DD YYYY-MM-DD)')
+    map_speeds.add_argument('--treatment', nargs=2, required=True, metavar=('START', 'END'),
+                            help='Treatment period (YYYY-MM-DD YYYY-MM-DD)')
+    map_speeds.add_argument('--output-dir', default='data/map-speeds', help='Output directory')
+
+    percentiles = subparsers.add_parser('percentiles', help='Write segment speed percentiles for a period')
+    percentiles.add_argument('--start-date', required=True, help='Start date (YYYY-MM-DD)')
+    percentiles.add_argument('--end-date', required=True, help='End date (YYYY-MM-DD)')
+    percentiles.add_argument('--output', required=True, help='Output parquet path')
+    percentiles.add_argument('--routes', help='Comma-separated list of route IDs (default: all)')
+    percentiles.add_argument('--by', help='Comma-separated grouping columns '
+                             '(default: route_id,prev_stop_id,stop_id,weekday,hour)')
+
+    dashboard = subparsers.add_parser('dashboard-cache',
+                                      help='Build the dashboard map geometry caches so the app starts without geopandas')
+    dashboard.add_argument('--routes', help='Comma-separated list of route IDs (default: all dashboard routes)')
+
+    catalog = subparsers.add_parser('route-catalog',
+                                    help='Build the route catalog and single-file map speed and geometry stores')
+    catalog.add_argument('--output-dir', default='data/dashboard', help='Output directory')
+
+    segment_hours = subparsers.add_parser('segment-hours',
+                                          help='Write the segment-hour store used by the dashboard drill-down')
+    segment_hours.add_argument('--control', nargs=2, default=list(CONTROL_PERIOD), metavar=('START', 'END'),
+                               help='Control period (default: %(default)s)')
+    segment_hours.add_argument('--treatment', nargs=2, default=list(TREATMENT_PERIOD), metavar=('START', 'END'),
+                               help='Treatment period (default: %(default)s)')
+    segment_hours.add_argument('--routes', help='Comma-separated list of route IDs (default: all)')
+    segment_hours.add_argument('--output', default=os.path.join(DASHBOARD_STORE_DIR, SEGMENT_HOURS_FILE),
+                               help='Output parquet path')
+
+    args = parser.parse_args()
+
+    if args.command == 'backfill':
+        count = rebuild_rollups(args.raw_dir, args.rollup_dir)
+        print(f"Rolled up {count} partitions from {args.raw_dir}")
+    elif args.command == 'chart-speeds':
+        route_ids = args.routes.split(',') if args.routes else None
+        speeds = write_chart_speeds(args.start_date, args.end_date, args.output,
+                                    route_ids, args.rollup_dir)
+        print(f"Wrote {len(speeds)} hourly speed records to {args.output}")
+    elif args.command == 'map-speeds':
+        route_ids = args.routes.split(',')
+        cube = SegmentSpeedCube.from_rollups(route_ids, args.rollup_dir)
+        speeds_diff = cube.speed_diff(tuple(args.control), tuple(args.treatment))
+        os.makedirs(args.output_dir, exist_ok=True)
+        for route_id in route_ids:
+            output_file = os.path.join(args.output_dir, f'{args.mdb_id}_{route_id}_speed_diff.parquet')
+            route_speeds_diff = speeds_diff[speeds_diff['route_id'] == route_id]
+            route_speeds_diff.to_parquet(output_file, index=False)
+            print(f"Wrote {len(route_speeds_diff)} segment speed differences to {output_file}")
+    elif args.command == 'percentiles':
+        route_ids = args.routes.split(',') if args.routes else None
+        by = args.by.split(',') if args.by else None
+        result = segment_percentiles(args.start_date, args.end_date, route_ids, by,
+                                     base_dir=args.rollup_dir)
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        result.to_parquet(args.output, index=False)
+        print(f"Wrote {len(result)} segment percentile records to {args.output}")
+    elif args.command == 'dashboard-cache':
+        route_ids = args.routes.split(',') if args.routes else [info['id'] for info in ROUTE_DATA.values()]
+        DashboardData().preload(route_ids)
+        print(f"Built dashboard caches for {len(route_ids)} routes")
+    elif args.command == 'route-catalog':
+        routes = build_route_store(args.output_dir, rollup_dir=args.rollup_dir)
+        print(f"Wrote catalog of {len(routes)} routes ({int(routes['has_map'].sum())} with maps) "
+              f"to {args.output_dir}")
+    elif args.command == 'segment-hours':
+        route_ids = args.routes.split(',') if args.routes else None
+        store = write_segment_hours(tuple(args.control), tuple(args.treatment), args.output,
+                                    route_ids, args.rollup_dir)
+        print(f"Wrote {len(store)} segment-hour records to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Load test of the dashboard data service.
+
+Starts the service in-process on a free port (or targets `--url`), then runs N
+concurrent clients that replay the requests of dashboard sessions (route list,
+chart arrays, map versions, speed differences and geometry over the featured
+routes, weekdays and rush periods). Reports throughput and p50/p90/p99 latency
+for cold and warm passes, with and without conditional GETs.
+
+Examples:
+    python -m benchmarks.data_service --clients 16 --requests 2000
+    python -m benchmarks.data_service --url http://127.0.0.1:8600 --clients 64
+"""
+import argparse
+import http.client
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from src.dashboard_app import RUSH_HOURS
+from src.dashboard_data import FEATURED_ROUTES
+from src.data_service import make_server
+
+
+def session_paths(route_ids: List[str]) -> List[str]:
+    """Request paths of dashboard sessions over every route, weekday and rush period."""
+    paths = ["/routes", "/version"]
+    for route_id, weekday in itertools.product(route_ids, range(7)):
+        paths += [f"/routes/{route_id}/hourly/{weekday}", f"/routes/{route_id}/version",
+                  f"/routes/{route_id}/geometry"]
+        paths += [f"/routes/{route_id}/speed-diff/{weekday}/{rush_hour}" for rush_hour in RUSH_HOURS.values()]
+    return paths
+
+
+def run_clients(url: str, paths: List[str], clients: int, requests: int, conditional: bool) -> Dict[str, float]:
+    """
+    Issue `requests` GETs spread over `clients` threads, each on its own keep-alive connection.
+
+    :return: Throughput and latency percentiles in milliseconds.
+    """
+    target = urlsplit(url)
+    counter = itertools.count()
+    latencies = np.zeros(requests)
+    statuses = {}
+    lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout=30)
+        etags = {}
+        while True:
+            i = next(counter)
+            if i >= requests:
+                break
+            path = paths[i % len(paths)]
+            headers = {"Accept-Encoding": "gzip"}
+            if conditional and etags.get(path):
+                headers["If-None-Match"] = etags[path]
+            started = time.perf_counter()
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            latencies[i] = time.perf_counter() - started
+            etags[path] = response.getheader("ETag")
+            with lock:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+        connection.close()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        for future in [executor.submit(client) for _ in range(clients)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    p50, p90, p99 = np.percentile(latencies * 1000, [50, 90, 99])
+    return {
+        "clients": clients,
+        "requests": requests,
+        "requests_per_s": round(requests / elapsed, 1),
+        "p50_ms": round(p50, 3),
+        "p90_ms": round(p90, 3),
+        "p99_ms": round(p99, 3),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Load test the dashboard data service')
+    parser.add_argument('--url', help='Service to test (default: start one in-process)')
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per pass')
+    parser.add_argument('--routes', help='Comma-separated list of route IDs (default: featured routes)')
+    args = parser.parse_args(argv)
+
+    server = None
+    url = args.url
+    if url is None:
+        server = make_server(port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    route_ids = args.routes.split(',') if args.routes else list(FEATURED_ROUTES.values())
+    paths = session_paths(route_ids)
+    try:
+        results = {
+            # The first pass builds every response; later passes are served from the LRU
+            "cold": run_clients(url, paths, args.clients, len(paths), conditional=False),
+            "warm": run_clients(url, paths, args.clients, args.requests, conditional=False),
+            "warm_conditional": run_clients(url, paths, args.clients, args.requests, conditional=True),
+        }
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    print(json.dumps(results, indent=2))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+Benchmarks of the speed processing pipeline on synthetic data.
+
+A feed and a day of vehicle positions are generated with `benchmarks.synthetic`
+(deterministic for a given scale and seed), then each stage is run on them:
+
+    feed           api.parse_zipped_gtfs of the feed zip              (rows: stop_times)
+    segments       GTFS_shape_processor.process_shapes                (stop_times -> segments)
+    prep_buses     BusSpeedCalculator.prep_buses                      (pings -> pings with shape)
+    projection     prep_full_strings + add_position_on_route          (pings)
+    trip_speeds    BusSpeedCalculator.create_trip_speeds              (pings -> segment speeds)
+    process_date   SpeedCalculator.process_date from LocalStorage,    (pings -> segment speeds)
+                   including the raw speeds and rollup writes
+
+Each stage runs `--repeat` times and reports its best wall time and rows per
+second, then runs once more under tracemalloc for its peak traced memory.
+`compare` checks results against a baseline file and exits with status 1 when
+a stage's throughput dropped or its peak memory grew by more than the threshold,
+and with status 2 without comparing when the two were run at different scales
+or configurations.
+
+Examples:
+    python -m benchmarks.pipeline run --scale small --output results.json
+    python -m benchmarks.pipeline compare benchmarks/baseline.json results.json
+    python -m benchmarks.pipeline run --stages trip_speeds,process_date --compare benchmarks/baseline.json
+"""
+import os
+
+# Progress bars would dominate the output of short runs
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, List, Optional, Tuple
+
+from benchmarks.synthetic import (SCALES, generate_feed, generate_vehicle_positions, write_feed,
+                                  write_vehicle_positions)
+from src.api import parse_zipped_gtfs
+from src.gtfs_segments import GTFS_shape_processor
+from src.metrics import configure_metrics
+from src.speed_calculator import SpeedCalculator
+from src.speeds import BusSpeedCalculator
+from src.storage import LocalStorage
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+BENCHMARK_DATE = "2025-01-15"
+FEED_ID = "synthetic"
+STAGES = ["feed", "segments", "prep_buses", "projection", "trip_speeds", "process_date"]
+REGRESSION_THRESHOLD = 0.2
+
+
+def measure(build: Callable[[], object], repeat: int) -> Tuple[object, float, float]:
+    """
+    Run `build` `repeat` times, then once more with allocation tracing.
+
+    :return: (last result, best wall time in seconds, peak traced memory in MB).
+    """
+    best = float("inf")
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = build()
+            best = min(best, time.perf_counter() - started)
+
+        tracemalloc.start()
+        try:
+            build()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    return result, best, peak / 2 ** 20
+
+
+def _stage_result(rows_in: int, rows_out: int, seconds: float, peak_mb: float) -> dict:
+    return {
+        "rows_in": rows_in,
+        "rows_out": rows_out,
+        "seconds": round(seconds, 4),
+        "rows_per_s": round(rows_in / seconds, 1) if seconds > 0 else None,
+        "peak_mb": round(peak_mb, 1),
+    }
+
+
+def run_benchmarks(scale: str = "small", stages: Optional[List[str]] = None, repeat: int = 3,
+                   seed: int = 0, work_dir: Optional[str] = None) -> dict:
+    """
+    Generate synthetic data at a scale and benchmark the selected stages on it.
+
+    :param scale: Preset in `benchmarks.synthetic.SCALES`.
+    :param stages: Stages to run (default: all, in pipeline order).
+    :param repeat: Timed runs per stage.
+    :param seed: Random seed of the synthetic data.
+    :param work_dir: (Optional) Directory for the generated data and outputs (default: a temporary one).
+    :return: Results with the configuration and one entry per stage.
+    """
+    stages = stages or STAGES
+    config = dict(SCALES[scale], seed=seed, date=BENCHMARK_DATE)
+    with contextlib.ExitStack() as stack:
+        if work_dir is None:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        # Stage metrics stay on, as in production, but out of the pipeline's log
+        configure_metrics(os.path.join(work_dir, "metrics.jsonl"))
+
+        gtfs = generate_feed(config["routes"], config["trips_per_day"], seed=seed)
+        feed_path = write_feed(gtfs, os.path.join(work_dir, "gtfs.zip"))
+        positions = generate_vehicle_positions(gtfs, BENCHMARK_DATE, config["ping_interval"], seed=seed)
+        vehicles_dir = os.path.join(work_dir, "vehicles")
+        write_vehicle_positions(positions, vehicles_dir, BENCHMARK_DATE)
+        route_list = sorted(gtfs["routes.txt"]["route_id"])
+        n_stop_times, n_pings = len(gtfs["stop_times.txt"]), len(positions)
+
+        gtfs_dict = parse_zipped_gtfs(feed_path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            segments = GTFS_shape_processor(feed_path).process_shapes()
+        calculator = BusSpeedCalculator(positions, gtfs_dict, segments)
+        buses = calculator.prep_buses() if "projection" in stages else None
+
+        def process_date():
+            output = tempfile.mkdtemp(dir=work_dir)
+            speed_calculator = SpeedCalculator(
+                bucket="", prefix="", storage=LocalStorage(vehicles_dir), feed_id=FEED_ID, gtfs_dict=gtfs_dict, segment_df=segments,
+                output_dir=os.path.join(output, "raw-speeds"), rollup_dir=os.path.join(output, "rollups"),
+                manifest_dir=os.path.join(output, "manifest"),
+            )
+            speed_calculator.logger.setLevel(logging.WARNING)
+            return speed_calculator.process_date(BENCHMARK_DATE, route_list)
+
+        runs = {
+            "feed": (lambda: parse_zipped_gtfs(feed_path), n_stop_times, lambda out: len(out["stop_times.txt"])),
+            "segments": (lambda: GTFS_shape_processor(feed_path).process_shapes(), n_stop_times, len),
+            "prep_buses": (calculator.prep_buses, n_pings, len),
+            "projection": (lambda: calculator.add_position_on_route(buses.copy(), calculator.prep_full_strings()),
+                           n_pings, len),
+            "trip_speeds": (calculator.create_trip_speeds, n_pings, len),
+            "process_date": (process_date, n_pings, lambda out: 0 if out is None else len(out)),
+        }
+
+        results = {}
+        for stage in stages:
+            build, rows_in, rows_out = runs[stage]
+            output, seconds, peak_mb = measure(build, repeat)
+            results[stage] = _stage_result(rows_in, rows_out(output), seconds, peak_mb)
+            print(f"{stage:<14}{results[stage]['seconds']:>10.3f} s{results[stage]['rows_per_s'] or 0:>14,.0f} rows/s"
+                  f"{results[stage]['peak_mb']:>10.1f} MB", file=sys.stderr)
+
+    return {
+        "scale": scale,
+        "config": config,
+        "repeat": repeat,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "stages": results,
+    }
+
+
+def compare_results(baseline: dict, current: dict, threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """
+    Compare benchmark results stage by stage.
+
+    :param threshold: Relative drop in rows per second, or growth in peak memory, that counts as a regression.
+    :return: One message per regression; empty if there are none.
+    :raises ValueError: If the results were run at another scale or configuration, whose
+                        throughput and memory are not comparable.
+    """
+    if (baseline.get("scale"), baseline.get("config")) != (current.get("scale"), current.get("config")):
+        raise ValueError(f"the baseline was run with scale {baseline.get('scale')} {baseline.get('config')}, "
+                         f"the current results with scale {current.get('scale')} {current.get('config')}")
+
+    regressions = []
+    print(f"{'stage':<14}{'baseline rows/s':>16}{'current rows/s':>16}{'change':>9}"
+          f"{'baseline MB':>13}{'current MB':>12}{'change':>9}")
+    for stage, base in baseline["stages"].items():
+        if stage not in current["stages"]:
+            continue
+        now = current["stages"][stage]
+        speed_change = now["rows_per_s"] / base["rows_per_s"] - 1 if base["rows_per_s"] else 0.0
+        memory_change = now["peak_mb"] / base["peak_mb"] - 1 if base["peak_mb"] else 0.0
+        print(f"{stage:<14}{base['rows_per_s']:>16,.0f}{now['rows_per_s']:>16,.0f}{speed_change:>+9.1%}"
+              f"{base['peak_mb']:>13.1f}{now['peak_mb']:>12.1f}{memory_change:>+9.1%}")
+        if speed_change < -threshold:
+            regressions.append(f"{stage}: throughput {speed_change:+.1%} "
+                               f"({base['rows_per_s']:,.0f} -> {now['rows_per_s']:,.0f} rows/s)")
+        if memory_change > threshold:
+            regressions.append(f"{stage}: peak memory {memory_change:+.1%} "
+                               f"({base['peak_mb']:.1f} -> {now['peak_mb']:.1f} MB)")
+    return regressions
+
+
+def _compare(baseline: dict, current: dict, threshold: float) -> int:
+    """Print the comparison and its regressions; returns the exit status."""
+    try:
+        regressions = compare_results(baseline, current, threshold)
+    except ValueError as e:
+        print(f"Cannot compare: {e}. Run with the baseline's --scale and --seed, "
+              f"or write a baseline for this configuration with --output.", file=sys.stderr)
+        return 2
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    if not regressions:
+        print("No regressions")
+    return 1 if regressions else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the speed pipeline on synthetic data')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='Run the benchmarks')
+    run.add_argument('--scale', choices=SCALES, default='small', help='Synthetic data scale')
+    run.add_argument('--stages', help=f'Comma-separated stages (default: {",".join(STAGES)})')
+    run.add_argument('--repeat', type=int, default=3, help='Timed runs per stage')
+    run.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic data')
+    run.add_argument('--output', help='Write results to this JSON file (e.g. benchmarks/baseline.json)')
+    run.add_argument('--compare', metavar='BASELINE', nargs='?', const=BASELINE_PATH,
+                     help='Compare the results against a baseline file (default: benchmarks/baseline.json)')
+    run.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='Regression threshold')
+
+    compare = subparsers.add_parser('compare', help='Compare two result files')
+    compare.add_argument('baseline', help='Baseline results JSON')
+    compare.add_argument('current', help='Current results JSON')
+    compare.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                         help='Relative throughput drop or memory growth that counts as a regression')
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        return _compare(baseline, current, args.threshold)
+
+    stages = args.stages.split(',') if args.stages else None
+    unknown = set(stages or []) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+    results = run_benchmarks(args.scale, stages, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Wrote results to {args.output}")
+    else:
+        print(json.dumps(results, indent=2))
+    if args.compare:
+        with open(args.compare) as f:
+            return _compare(json.load(f), results, args.threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Replay benchmark of the streaming speed calculator on synthetic data.
+
+A day of synthetic vehicle positions (see `benchmarks.synthetic`) is replayed
+as a feed, one batch per `--batch-seconds` of ping timestamps, through
+`StreamingSpeedCalculator` as fast as it can consume it. Reported:
+
+    pings/s          sustained throughput over the whole replay
+    latency          wall time from a batch arriving to its speeds being emitted (p50/p95/p99/max)
+    staleness        feed seconds between a stop crossing and the batch that emitted it
+    agreement        with --check, how closely the emitted speeds match the batch
+                     BusSpeedCalculator on the same day
+
+Examples:
+    python -m benchmarks.streaming --scale small
+    python -m benchmarks.streaming --scale medium --batch-seconds 10 --check --output streaming.json
+"""
+import os
+
+# Progress bars would dominate the output of short runs
+os.environ.setdefault("TQDM_DISABLE", "1")
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import SCALES, generate_feed, generate_vehicle_positions, write_feed
+from src.api import parse_zipped_gtfs
+from src.gtfs_segments import GTFS_shape_processor
+from src.metrics import configure_metrics
+from src.speeds import BusSpeedCalculator
+from src.streaming import TRIP_TTL, StreamingSpeedCalculator, replay_batches
+
+BENCHMARK_DATE = "2025-01-15"
+
+
+def _percentiles(values: np.ndarray, scale: float = 1.0) -> dict:
+    if not len(values):
+        return {}
+    return {name: round(float(np.percentile(values, q)) * scale, 3)
+            for name, q in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100))}
+
+
+def run_replay(scale: str = "small", batch_seconds: float = 30.0, ttl: float = TRIP_TTL,
+               seed: int = 0, check: bool = False) -> dict:
+    """
+    Replay a synthetic day through the streaming calculator.
+
+    :param scale: Preset in `benchmarks.synthetic.SCALES`.
+    :param batch_seconds: Seconds of ping timestamps per replayed batch.
+    :param ttl: Trip eviction TTL in feed seconds.
+    :param seed: Random seed of the synthetic data.
+    :param check: Also run the batch calculator and compare speeds per trip and segment.
+    :return: Results with the configuration, throughput, latency and staleness.
+    """
+    config = dict(SCALES[scale], seed=seed, date=BENCHMARK_DATE, batch_seconds=batch_seconds, ttl=ttl)
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure_metrics(os.path.join(work_dir, "metrics.jsonl"))
+        gtfs = generate_feed(config["routes"], config["trips_per_day"], seed=seed)
+        feed_path = write_feed(gtfs, os.path.join(work_dir, "gtfs.zip"))
+        positions = generate_vehicle_positions(gtfs, BENCHMARK_DATE, config["ping_interval"], seed=seed)
+        gtfs_dict = parse_zipped_gtfs(feed_path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            segments = GTFS_shape_processor(feed_path).process_shapes()
+
+    calculator = StreamingSpeedCalculator(gtfs_dict, segments, ttl=ttl)
+    batches = list(replay_batches(positions, batch_seconds))
+    latencies, staleness, emitted = [], [], []
+    for batch in batches:
+        started = time.perf_counter()
+        speeds = calculator.process(batch)
+        latencies.append(time.perf_counter() - started)
+        if len(speeds):
+            crossed = speeds["interpolated_time"].astype("int64").to_numpy() / 1e9
+            staleness.append(batch["timestamp"].max() - crossed)
+            emitted.append(speeds)
+    total = sum(latencies)
+
+    results = {
+        "scale": scale,
+        "config": config,
+        "pings": len(positions),
+        "batches": len(batches),
+        "seconds": round(total, 4),
+        "pings_per_s": round(len(positions) / total, 1) if total > 0 else None,
+        "latency_ms": _percentiles(np.array(latencies), 1000),
+        "staleness_s": _percentiles(np.concatenate(staleness) if staleness else np.array([])),
+        "stats": dict(calculator.stats, active_trips=len(calculator.trips)),
+    }
+    if check:
+        streamed = pd.concat(emitted, ignore_index=True) if emitted else pd.DataFrame()
+        with contextlib.redirect_stdout(io.StringIO()):
+            batch_speeds = BusSpeedCalculator(positions, gtfs_dict, segments).create_trip_speeds()
+        matched = streamed.merge(batch_speeds, on=["unique_trip_id", "stop_id"], suffixes=("", "_batch"))
+        difference = (matched["speed_mph"] - matched["speed_mph_batch"]).abs()
+        results["agreement"] = {
+            "streamed": len(streamed),
+            "batch": len(batch_speeds),
+            "matched": len(matched),
+            "abs_diff_mph": _percentiles(difference.to_numpy()),
+        }
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Replay benchmark of the streaming speed calculator')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='Synthetic data scale')
+    parser.add_argument('--batch-seconds', type=float, default=30.0, help='Seconds of pings per replayed batch')
+    parser.add_argument('--ttl', type=float, default=TRIP_TTL, help='Trip eviction TTL in feed seconds')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the synthetic data')
+    parser.add_argument('--check', action='store_true', help='Compare the speeds with the batch calculator')
+    parser.add_argument('--output', help='Write results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = run_replay(args.scale, args.batch_seconds, args.ttl, args.seed, args.check)
+    latency = results["latency_ms"]
+    print(f"{results['pings']:,} pings in {results['batches']:,} batches: {results['pings_per_s']:,.0f} pings/s, "
+          f"latency p50 {latency['p50']:.2f} ms p99 {latency['p99']:.2f} ms max {latency['max']:.2f} ms",
+          file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Wrote results to {args.output}")
+    else:
+        print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+"""
+Deterministic synthetic GTFS feeds and matching GTFS-rt vehicle positions.
+
+The pipeline can then be benchmarked offline, without AWS credentials or the
+Mobility Database. A feed is a set of routes, each with one shape per direction
+(a meandering street path, or a near-closed loop for loop routes), stops along
+the shapes and a day of scheduled trips. Vehicle positions follow the schedule
+with per-segment delays, dwell at stops, GPS noise and pings every
+`ping_interval` seconds. They use the column names of the normalized parquet in
+`norm/bus-mta-vp/vehicles/`, so they can be fed straight into
+`BusSpeedCalculator`.
+
+The same arguments and seed always give the same feed and positions.
+
+Examples:
+    python -m benchmarks.synthetic --output-dir data/synthetic --routes 8 --trips-per-day 300
+    python -m benchmarks.synthetic --output-dir data/synthetic --start-date 2025-01-13 --end-date 2025-01-17
+    python -m benchmarks.synthetic --output-dir data/synthetic --protobuf
+"""
+import argparse
+import io
+import os
+import zipfile
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Synthetic routes are laid out around midtown Manhattan
+ORIGIN_LAT, ORIGIN_LON = 40.754, -73.984
+METERS_PER_DEGREE_LAT = 110_540.0
+METERS_PER_DEGREE_LON = 111_320.0 * np.cos(np.radians(ORIGIN_LAT))
+FEET_PER_METER = 3.28084
+
+SHAPE_POINT_SPACING = 40.0   # meters between shape points
+STOP_SPACING = 250.0         # meters between stops
+DWELL_SECONDS = 20.0
+SERVICE_START = 5 * 3600     # first departure (seconds after midnight)
+SERVICE_END = 23 * 3600      # last departure
+FEED_SERVICE_ID = "SYN-Weekday"
+
+SCALES = {
+    # routes, trips per route per day, ping interval (s)
+    "tiny": dict(routes=2, trips_per_day=20, ping_interval=30),
+    "small": dict(routes=4, trips_per_day=100, ping_interval=30),
+    "medium": dict(routes=12, trips_per_day=250, ping_interval=30),
+    "large": dict(routes=40, trips_per_day=400, ping_interval=30),
+}
+
+
+def _to_degrees(x: np.ndarray, y: np.ndarray):
+    """Local east/north meters around the origin to (lat, lon)."""
+    return ORIGIN_LAT + y / METERS_PER_DEGREE_LAT, ORIGIN_LON + x / METERS_PER_DEGREE_LON
+
+
+def _street_path(rng: np.random.Generator, length: float) -> np.ndarray:
+    """Meandering path of the given length in meters, as (n, 2) x/y points."""
+    n = int(length / SHAPE_POINT_SPACING) + 1
+    heading = rng.uniform(0, 2 * np.pi) + np.cumsum(rng.normal(0, 0.08, n - 1))
+    steps = SHAPE_POINT_SPACING * np.column_stack([np.cos(heading), np.sin(heading)])
+    start = rng.uniform(-3000, 3000, 2)
+    return np.vstack([start, start + np.cumsum(steps, axis=0)])
+
+
+def _loop_path(rng: np.random.Generator, length: float) -> np.ndarray:
+    """Near-closed loop of the given length in meters; its ends almost touch."""
+    radius = length / (2 * np.pi * 0.95)
+    n = int(length / SHAPE_POINT_SPACING) + 1
+    angle = rng.uniform(0, 2 * np.pi) + np.linspace(0, 2 * np.pi * 0.95, n)
+    wobble = 1 + 0.1 * np.sin(3 * angle + rng.uniform(0, 2 * np.pi))
+    center = rng.uniform(-3000, 3000, 2)
+    return center + radius * wobble[:, None] * np.column_stack([np.cos(angle), np.sin(angle)])
+
+
+def _cumulative_distance(points: np.ndarray) -> np.ndarray:
+    return np.concatenate([[0.0], np.cumsum(np.hypot(*np.diff(points, axis=0).T))])
+
+
+def _clock(seconds: np.ndarray) -> List[str]:
+    """GTFS HH:MM:SS times (hours may exceed 24)."""
+    seconds = np.round(seconds).astype(int)
+    return [f"{s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in seconds]
+
+
+def generate_feed(
+    routes: int = 4,
+    trips_per_day: int = 100,
+    route_length: float = 8000.0,
+    loops: float = 0.25,
+    seed: int = 0,
+    start_date: str = "2024-12-01",
+    end_date: str = "2025-03-01",
+) -> Dict[str, pd.DataFrame]:
+    """
+    Generate a synthetic static GTFS feed.
+
+    :param routes: Number of routes.
+    :param trips_per_day: Trips per route per day, split over both directions.
+    :param route_length: Approximate shape length in meters.
+    :param loops: Fraction of routes whose shape is a near-closed loop.
+    :param seed: Random seed.
+    :param start_date: First service date of the feed (YYYY-MM-DD).
+    :param end_date: Last service date of the feed (YYYY-MM-DD).
+    :return: Dictionary of GTFS file names to DataFrames, like `api.parse_zipped_gtfs`.
+    """
+    rng = np.random.default_rng(seed)
+    route_rows, shape_frames, stop_frames, trip_frames, stop_time_frames = [], [], [], [], []
+
+    for r in range(routes):
+        route_id = f"S{r + 1}"
+        route_rows.append({"route_id": route_id, "agency_id": "SYN", "route_short_name": route_id,
+                           "route_long_name": f"Synthetic Route {r + 1}", "route_type": 3})
+        is_loop = r < round(routes * loops)
+        length = route_length * rng.uniform(0.7, 1.3)
+        path = _loop_path(rng, length) if is_loop else _street_path(rng, length)
+
+        n_trips = np.full(2, trips_per_day // 2) + [trips_per_day % 2, 0]
+        for direction in range(2):
+            shape_id = f"{route_id}_{direction}"
+            points = path if direction == 0 else path[::-1]
+            distance = _cumulative_distance(points)
+            lats, lons = _to_degrees(points[:, 0], points[:, 1])
+            shape_frames.append(pd.DataFrame({
+                "shape_id": shape_id, "shape_pt_lat": lats, "shape_pt_lon": lons,
+                "shape_pt_sequence": np.arange(len(points)), "shape_dist_traveled": distance,
+            }))
+
+            # Stops every STOP_SPACING meters, offset to the kerb side of the street
+            stop_distance = np.arange(0, distance[-1], STOP_SPACING)
+            x = np.interp(stop_distance, distance, points[:, 0])
+            y = np.interp(stop_distance, distance, points[:, 1])
+            heading = np.arctan2(np.gradient(y), np.gradient(x)) if len(x) > 1 else np.zeros(len(x))
+            x, y = x + 6 * np.sin(heading), y - 6 * np.cos(heading)
+            stop_lats, stop_lons = _to_degrees(x, y)
+            stop_ids = 100_000 + r * 1000 + direction * 500 + np.arange(len(stop_distance))
+            stop_frames.append(pd.DataFrame({
+                "stop_id": stop_ids, "stop_name": [f"{route_id} Stop {i}" for i in stop_ids],
+                "stop_lat": stop_lats, "stop_lon": stop_lons,
+            }))
+
+            # Scheduled departures spread over the service day; about 9 mph plus dwell
+            departures = np.sort(rng.uniform(SERVICE_START, SERVICE_END, n_trips[direction]))
+            run_times = np.diff(stop_distance) * FEET_PER_METER / (9 * 5280 / 3600)
+            offsets = np.concatenate([[0.0], np.cumsum(run_times + DWELL_SECONDS)])
+            trip_ids = [f"SYN-{route_id}-{direction}-{i:04d}" for i in range(n_trips[direction])]
+            trip_frames.append(pd.DataFrame({
+                "route_id": route_id, "service_id": FEED_SERVICE_ID, "trip_id": trip_ids,
+                "trip_headsign": f"{route_id} direction {direction}", "direction_id": direction,
+                "block_id": r, "shape_id": shape_id,
+            }))
+            arrival = (departures[:, None] + offsets[None, :]).ravel()
+            stop_time_frames.append(pd.DataFrame({
+                "trip_id": np.repeat(trip_ids, len(stop_ids)),
+                "arrival_time": _clock(arrival),
+                "departure_time": _clock(arrival + DWELL_SECONDS),
+                "stop_id": np.tile(stop_ids, len(trip_ids)),
+                "stop_sequence": np.tile(np.arange(1, len(stop_ids) + 1), len(trip_ids)),
+                "shape_dist_traveled": np.tile(stop_distance, len(trip_ids)),
+            }))
+
+    start, end = (d.replace("-", "") for d in (start_date, end_date))
+    return {
+        "agency.txt": pd.DataFrame({"agency_id": ["SYN"], "agency_name": ["Synthetic Transit"],
+                                    "agency_url": ["https://example.com"],
+                                    "agency_timezone": ["America/New_York"]}),
+        "calendar.txt": pd.DataFrame({"service_id": [FEED_SERVICE_ID], "monday": [1], "tuesday": [1],
+                                      "wednesday": [1], "thursday": [1], "friday": [1], "saturday": [1],
+                                      "sunday": [1], "start_date": [int(start)], "end_date": [int(end)]}),
+        "calendar_dates.txt": pd.DataFrame(columns=["service_id", "date", "exception_type"]),
+        "routes.txt": pd.DataFrame(route_rows),
+        "shapes.txt": pd.concat(shape_frames, ignore_index=True),
+        "stops.txt": pd.concat(stop_frames, ignore_index=True),
+        "trips.txt": pd.concat(trip_frames, ignore_index=True),
+        "stop_times.txt": pd.concat(stop_time_frames, ignore_index=True),
+    }
+
+
+def _seconds(clock: pd.Series) -> np.ndarray:
+    parts = clock.str.split(":", expand=True).astype(int).to_numpy()
+    return parts[:, 0] * 3600 + parts[:, 1] * 60 + parts[:, 2]
+
+
+def generate_vehicle_positions(
+    gtfs: Dict[str, pd.DataFrame],
+    date: str,
+    ping_interval: float = 30.0,
+    gps_noise_ft: float = 15.0,
+    delay: float = 0.2,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Generate a day of vehicle positions for every trip of a synthetic feed.
+
+    :param gtfs: Feed from `generate_feed`.
+    :param date: Service date (YYYY-MM-DD), interpreted in America/New_York.
+    :param ping_interval: Mean seconds between pings of a vehicle.
+    :param gps_noise_ft: Standard deviation of the GPS error in feet.
+    :param delay: Log-normal spread of actual over scheduled segment run times.
+    :param seed: Random seed; combined with the date so every day differs.
+    :return: DataFrame with the columns of the normalized vehicle-position parquet.
+    """
+    rng = np.random.default_rng([seed, int(date.replace("-", ""))])
+    shapes = {shape_id: group for shape_id, group in gtfs["shapes.txt"].groupby("shape_id", sort=False)}
+    trip_shapes = gtfs["trips.txt"].set_index("trip_id")
+    stop_times = gtfs["stop_times.txt"]
+    midnight = pd.Timestamp(date, tz="America/New_York").tz_convert("UTC").timestamp()
+    start_date = date.replace("-", "")
+
+    frames = []
+    for vehicle, (trip_id, schedule) in enumerate(stop_times.groupby("trip_id", sort=False)):
+        trip = trip_shapes.loc[trip_id]
+        shape = shapes[trip["shape_id"]]
+        arrival = _seconds(schedule["arrival_time"])
+        stop_distance = schedule["shape_dist_traveled"].to_numpy()
+
+        # Actual run times vary around the schedule; dwell is kept fixed
+        run_times = np.diff(arrival) - DWELL_SECONDS
+        run_times = run_times * rng.lognormal(0, delay, len(run_times))
+        actual_arrival = arrival[0] + rng.normal(0, 60) + np.concatenate(
+            [[0.0], np.cumsum(run_times + DWELL_SECONDS)])
+        times = np.column_stack([actual_arrival, actual_arrival + DWELL_SECONDS]).ravel()
+        distances = np.repeat(stop_distance, 2)
+
+        ping_times = np.arange(times[0], times[-1], ping_interval) + rng.uniform(0, ping_interval)
+        ping_times = ping_times[ping_times <= times[-1]]
+        ping_distance = np.interp(ping_times, times, distances)
+        shape_distance = shape["shape_dist_traveled"].to_numpy()
+        noise = rng.normal(0, gps_noise_ft / FEET_PER_METER, (2, len(ping_times)))
+        lats = np.interp(ping_distance, shape_distance, shape["shape_pt_lat"].to_numpy()) \
+            + noise[0] / METERS_PER_DEGREE_LAT
+        lons = np.interp(ping_distance, shape_distance, shape["shape_pt_lon"].to_numpy()) \
+            + noise[1] / METERS_PER_DEGREE_LON
+        stop_index = np.clip(np.searchsorted(stop_distance, ping_distance), 0, len(stop_distance) - 1)
+
+        vehicle_id = f"SYN_{vehicle:05d}"
+        timestamps = np.round(midnight + ping_times).astype(np.int64)
+        frames.append(pd.DataFrame({
+            "id": vehicle_id,
+            "time": timestamps,
+            "trip.trip_id": trip_id,
+            "trip.route_id": trip["route_id"],
+            "trip.direction_id": int(trip["direction_id"]),
+            "trip.start_time": schedule["departure_time"].iloc[0],
+            "trip.start_date": start_date,
+            "vehicle.id": vehicle_id,
+            "position.latitude": lats,
+            "position.longitude": lons,
+            "current_stop_sequence": schedule["stop_sequence"].to_numpy()[stop_index],
+            "stop_id": schedule["stop_id"].astype(str).to_numpy()[stop_index],
+            "timestamp": timestamps,
+            "date": date,
+        }))
+
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True).sort_values("timestamp", kind="stable", ignore_index=True)
+
+
+def write_feed(gtfs: Dict[str, pd.DataFrame], path: str) -> str:
+    """Write a feed as a GTFS zip that `api.parse_zipped_gtfs` can read."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, df in gtfs.items():
+            buffer = io.StringIO()
+            df.to_csv(buffer, index=False)
+            archive.writestr(name, buffer.getvalue())
+    return path
+
+
+def write_vehicle_positions(positions: pd.DataFrame, output_dir: str, date: str) -> str:
+    """Write a day of positions in the bucket layout (`{output_dir}/date={date}/part-0.parquet`)."""
+    directory = os.path.join(output_dir, f"date={date}")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "part-0.parquet")
+    positions.to_parquet(path, index=False)
+    return path
+
+
+def write_vehicle_snapshots(positions: pd.DataFrame, output_dir: str, date: str, interval: float = 30.0,
+                            max_age: float = 90.0) -> List[str]:
+    """
+    Write a day of positions as raw GTFS-rt VehiclePositions snapshots, one
+    `{output_dir}/date={date}/{timestamp}.pb` file every `interval` seconds. Like a
+    live feed, each snapshot repeats every vehicle's latest ping until it is
+    `max_age` seconds old. Requires gtfs-realtime-bindings.
+
+    :return: Paths of the written snapshots.
+    """
+    from google.transit import gtfs_realtime_pb2
+
+    directory = os.path.join(output_dir, f"date={date}")
+    os.makedirs(directory, exist_ok=True)
+    positions = positions.sort_values("timestamp", kind="stable", ignore_index=True)
+    times = positions["timestamp"].to_numpy()
+    paths = []
+    for snapshot in np.arange(times[0], times[-1] + interval, interval).astype(np.int64):
+        start, end = np.searchsorted(times, [snapshot - max_age, snapshot], side="right")
+        current = positions.iloc[start:end].drop_duplicates("vehicle.id", keep="last")
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.header.gtfs_realtime_version = "2.0"
+        feed.header.timestamp = int(snapshot)
+        for row in current.to_dict("records"):
+            entity = feed.entity.add()
+            entity.id = row["id"]
+            vehicle = entity.vehicle
+            vehicle.trip.trip_id = row["trip.trip_id"]
+            vehicle.trip.route_id = row["trip.route_id"]
+            vehicle.trip.direction_id = row["trip.direction_id"]
+            vehicle.trip.start_time = row["trip.start_time"]
+            vehicle.trip.start_date = row["trip.start_date"]
+            vehicle.vehicle.id = row["vehicle.id"]
+            vehicle.position.latitude = row["position.latitude"]
+            vehicle.position.longitude = row["position.longitude"]
+            vehicle.current_stop_sequence = row["current_stop_sequence"]
+            vehicle.stop_id = row["stop_id"]
+            vehicle.timestamp = row["timestamp"]
+        path = os.path.join(directory, f"{snapshot}.pb")
+        with open(path, "wb") as f:
+            f.write(feed.SerializeToString())
+        paths.append(path)
+    return paths
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Generate a synthetic GTFS feed and vehicle positions')
+    parser.add_argument('--output-dir', required=True,
+                        help='Writes gtfs.zip and vehicles/date=YYYY-MM-DD/part-0.parquet here')
+    parser.add_argument('--scale', choices=SCALES, default='small', help='Preset routes, trips and ping interval')
+    parser.add_argument('--routes', type=int, help='Number of routes (overrides --scale)')
+    parser.add_argument('--trips-per-day', type=int, help='Trips per route per day (overrides --scale)')
+    parser.add_argument('--ping-interval', type=float, help='Seconds between pings (overrides --scale)')
+    parser.add_argument('--gps-noise-ft', type=float, default=15.0, help='GPS error standard deviation in feet')
+    parser.add_argument('--loops', type=float, default=0.25, help='Fraction of loop routes')
+    parser.add_argument('--start-date', default='2025-01-15', help='First date of positions (YYYY-MM-DD)')
+    parser.add_argument('--end-date', help='Last date of positions (default: --start-date)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--protobuf', action='store_true',
+                        help='Also write raw GTFS-rt snapshots to vehicles-pb/date=YYYY-MM-DD/')
+    args = parser.parse_args(argv)
+
+    scale = dict(SCALES[args.scale])
+    for key in ("routes", "trips_per_day", "ping_interval"):
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+
+    gtfs = generate_feed(scale["routes"], scale["trips_per_day"], loops=args.loops, seed=args.seed)
+    feed_path = write_feed(gtfs, os.path.join(args.output_dir, "gtfs.zip"))
+    print(f"Wrote {len(gtfs['trips.txt'])} trips on {scale['routes']} routes to {feed_path}")
+
+    date = datetime.strptime(args.start_date, '%Y-%m-%d')
+    end = datetime.strptime(args.end_date or args.start_date, '%Y-%m-%d')
+    while date <= end:
+        day = date.strftime('%Y-%m-%d')
+        positions = generate_vehicle_positions(gtfs, day, scale["ping_interval"], args.gps_noise_ft,
+                                               seed=args.seed)
+        path = write_vehicle_positions(positions, os.path.join(args.output_dir, "vehicles"), day)
+        print(f"Wrote {len(positions)} vehicle positions to {path}")
+        if args.protobuf:
+            paths = write_vehicle_snapshots(positions, os.path.join(args.output_dir, "vehicles-pb"), day)
+            print(f"Wrote {len(paths)} GTFS-rt snapshots for {day}")
+        date += timedelta(days=1)
+
+
+if __name__ == "__main__":
+    main()
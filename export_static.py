@@ -0,0 +1,32 @@
+"""
+Export script that renders the dashboard into a static site for object storage or a CDN.
+
+Examples:
+    python export_static.py --output-dir site
+    python export_static.py --output-dir site --routes M50,M102 --workers 2
+
+Preview the export locally with:
+    python -m http.server --directory site
+"""
+import argparse
+from src.rollups import ROLLUPS_DIR
+from src.static_export import STATIC_EXPORT_DIR, export_static
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the bus speed dashboard as a static site')
+    parser.add_argument('--output-dir', default=STATIC_EXPORT_DIR, help='Output directory')
+    parser.add_argument('--routes', help='Comma-separated list of route IDs (default: all dashboard routes)')
+    parser.add_argument('--workers', type=int, help='Number of worker processes (default: one per CPU)')
+    parser.add_argument('--rollup-dir', default=ROLLUPS_DIR, help='Rollup store directory')
+    args = parser.parse_args()
+
+    route_ids = args.routes.split(',') if args.routes else None
+    exported = export_static(args.output_dir, route_ids, args.workers, args.rollup_dir)
+    for route_id, n_maps in exported.items():
+        print(f"Exported {route_id} with {n_maps} maps")
+    print(f"Wrote static site to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
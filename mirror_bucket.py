@@ -0,0 +1,34 @@
+"""
+Mirror a date range of the vehicle positions bucket to a local directory, in the
+same layout, so that backfills can read local disk instead of S3 (see
+`src/storage.py`). Files already mirrored are skipped, so reruns only fetch what
+is missing.
+
+Examples:
+    python mirror_bucket.py --start-date 2025-01-01 --end-date 2025-01-31 --dest data/mirror
+    python runner.py --storage data/mirror --start-date 2025-01-01 --end-date 2025-01-31 ...
+"""
+import argparse
+import pandas as pd
+from src.storage import VEHICLES_PREFIX, VEHICLES_URI, LocalStorage, mirror, open_storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mirror vehicle positions to local disk')
+    parser.add_argument('--start-date', required=True, help='Start date (YYYY-MM-DD)')
+    parser.add_argument('--end-date', required=True, help='End date (YYYY-MM-DD)')
+    parser.add_argument('--dest', required=True, help='Local mirror directory')
+    parser.add_argument('--source', default=VEHICLES_URI, help='Source bucket (default: %(default)s)')
+    parser.add_argument('--prefix', default=VEHICLES_PREFIX, help='Key prefix of the date partitions')
+    parser.add_argument('--workers', type=int, default=8, help='Parallel downloads')
+    args = parser.parse_args()
+
+    dates = pd.date_range(args.start_date, args.end_date).strftime('%Y-%m-%d')
+    prefixes = [f"{args.prefix}date={date}/" for date in dates]
+    counts = mirror(open_storage(args.source), LocalStorage(args.dest), prefixes, args.workers)
+    print(f"Copied {counts['copied']} files ({counts['bytes'] / 2 ** 20:,.1f} MB), "
+          f"skipped {counts['skipped']}, failed {counts['failed']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Report on the per-stage metrics that `runner.py` records while processing
+(see `src/metrics.py`).
+
+Examples:
+    python pipeline_metrics.py summary
+    python pipeline_metrics.py summary --by date,stage --start-date 2025-01-01 --end-date 2025-01-31
+    python pipeline_metrics.py slowest --top 10
+"""
+import argparse
+import pandas as pd
+from src.metrics import METRICS_PATH, dominant_stages, read_metrics, summarize_metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize pipeline stage metrics')
+    parser.add_argument('--path', default=METRICS_PATH, help='Metrics JSON-lines file')
+    parser.add_argument('--feed-id', help='Only include this feed')
+    parser.add_argument('--start-date', help='First date to include (YYYY-MM-DD)')
+    parser.add_argument('--end-date', help='Last date to include (YYYY-MM-DD)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    summary = subparsers.add_parser('summary', help='Totals, percentiles and throughput per stage')
+    summary.add_argument('--by', default='stage',
+                         help='Comma-separated grouping columns (e.g. stage, date,stage or feed_id,stage)')
+
+    slowest = subparsers.add_parser('slowest', help='Slowest dates and the stage that dominated each')
+    slowest.add_argument('--top', type=int, default=10, help='Number of dates to show')
+    args = parser.parse_args()
+
+    metrics = read_metrics(args.path)
+    if metrics.empty:
+        print(f"No metrics recorded in {args.path}")
+        return
+    if args.feed_id:
+        metrics = metrics[metrics["feed_id"] == args.feed_id]
+    if args.start_date:
+        metrics = metrics[metrics["date"] >= args.start_date]
+    if args.end_date:
+        metrics = metrics[metrics["date"] <= args.end_date]
+
+    with pd.option_context('display.max_rows', None, 'display.width', 200,
+                           'display.float_format', '{:,.2f}'.format):
+        if args.command == 'summary':
+            print(summarize_metrics(metrics, args.by.split(',')).to_string())
+        elif args.command == 'slowest':
+            print(pd.DataFrame(dominant_stages(metrics, args.top)).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
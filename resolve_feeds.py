@@ -0,0 +1,55 @@
+"""
+Cache GTFS feed versions and show which one applies to each date (see
+`src/feed_resolver.py`). Consecutive dates resolved to the same version are
+printed as one range, with its match score, in place of the hand-made date
+ranges of `run_feeds.sh`.
+
+Examples:
+    python resolve_feeds.py --cache https://files.mobilitydatabase.org/mdb-513/mdb-513-202412120015/mdb-513-202412120015.zip
+    python resolve_feeds.py --start-date 2024-12-01 --end-date 2025-03-29
+    python runner.py --start-date 2024-12-01 --end-date 2025-03-29 --routes M102,M50    # resolves the same way, but keeps processed dates on their feed
+"""
+import argparse
+import pandas as pd
+from src.feed_resolver import FEEDS_DIR, FeedResolver, cache_feed, sample_trip_ids
+from src.storage import VEHICLES_PREFIX, VEHICLES_URI, open_storage
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resolve dates to cached GTFS feed versions')
+    parser.add_argument('--cache', nargs='+', default=[], metavar='URL', help='Feed zips to add to the cache')
+    parser.add_argument('--start-date', help='Start date (YYYY-MM-DD)')
+    parser.add_argument('--end-date', help='End date (YYYY-MM-DD)')
+    parser.add_argument('--feeds-dir', default=FEEDS_DIR, help='Cached feed versions (default: %(default)s)')
+    parser.add_argument('--storage', default=VEHICLES_URI, help='Vehicle positions bucket or local mirror directory')
+    parser.add_argument('--prefix', default=VEHICLES_PREFIX, help='Key prefix of the date partitions')
+    parser.add_argument('--vehicle-format', choices=['parquet', 'protobuf'], default='parquet')
+    args = parser.parse_args()
+
+    for url in args.cache:
+        print(f"Cached {cache_feed(url, args.feeds_dir)}")
+    resolver = FeedResolver(args.feeds_dir)
+    print(f"Indexed {resolver.refresh()} feed versions in {args.feeds_dir}")
+    if not (args.start_date and args.end_date):
+        return
+
+    storage = open_storage(args.storage)
+    ranges = []
+    for date in pd.date_range(args.start_date, args.end_date).strftime('%Y-%m-%d'):
+        resolution = resolver.resolve(date, sample_trip_ids(storage, f"{args.prefix}date={date}/", args.vehicle_format))
+        feed_version = resolution.feed_version if resolution else None
+        score = resolution.score if resolution and resolution.sampled else None
+        if ranges and ranges[-1][0] == feed_version:
+            ranges[-1][2] = date
+            if score is not None:
+                ranges[-1][3].append(score)
+        else:
+            ranges.append([feed_version, date, date, [] if score is None else [score]])
+
+    for feed_version, start, end, scores in ranges:
+        match = f"worst date: {min(scores):.0%} of sampled trips matched" if scores else "calendar only"
+        print(f"{start} to {end}: {feed_version or 'no matching feed'} ({match})")
+
+
+if __name__ == "__main__":
+    main()
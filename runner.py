@@ -5,13 +5,26 @@ For each period, it:
 2. Processes the selected routes
 3. Calculates bus speeds
 4. Stores the results
+
+With `--queue`, a backfill is split across processes and nodes: `--role coordinator`
+enqueues one task per date and shard of routes, and any number of `--role worker`
+processes claim and process them (see `src/work_queue.py`).
 """
 import argparse
+import os
+import time
 from datetime import datetime, timedelta
-from src.speed_calculator import SpeedCalculator
+from src.speed_calculator import VEHICLE_FORMATS, SpeedCalculator, build_manifest, remove_outputs
 from src.logger import setup_logger
 from src.gtfs_segments import GTFS_shape_processor
 from src.api import parse_zipped_gtfs
+from src.feed_resolver import FEEDS_DIR, MIN_MATCH_SCORE, FeedResolver, sample_trip_ids
+from src.manifest import MANIFEST_DIR
+from src.metrics import metrics_context
+from src.work_queue import (LEASE_SECONDS, POLL_SECONDS, LeaseLost, WorkQueue, default_worker_id,
+                            format_progress, run_worker, shard_routes)
+from src.storage import VEHICLES_PREFIX, VEHICLES_URI, open_storage
+from src.profiling import DEFAULT_STAGES, PROFILE_MODES, start_profiling, stop_profiling
 import warnings
 from shapely.errors import ShapelyDeprecationWarning
 
@@ -29,15 +42,146 @@ def generate_date_list(start_date: str, end_date: str) -> list:
         current += timedelta(days=1)
     return date_list
 
+def build_calculator(args, storage, feed_id: str, gtfs_url: str, logger) -> SpeedCalculator:
+    """Load a GTFS feed and build its SpeedCalculator"""
+    logger.info(f"Loading feed GTFS data for {feed_id}...")
+    segment_df = GTFS_shape_processor(gtfs_url, 4326, 2263).process_shapes()
+    gtfs_dict = parse_zipped_gtfs(gtfs_url)
+    logger.info("Feed GTFS data loaded successfully")
+
+    logger.info("Initializing SpeedCalculator")
+    return SpeedCalculator(
+        bucket=getattr(storage, 'bucket', ''),
+        prefix=args.prefix,
+        feed_id=feed_id,
+        gtfs_dict=gtfs_dict,
+        segment_df=segment_df,
+        storage=storage,
+        vehicle_format=args.vehicle_format,
+        manifest_dir=args.manifest_dir
+    )
+
+def resolve_feeds(args, storage, date_list: list, route_list: list, manifest, logger) -> tuple:
+    """
+    Assign every date to the cached feed version that best matches its realtime trips,
+    keeping the version a date was already processed with while it still matches.
+    Returns the (feed_id, gtfs_url, dates) of every version, and the earlier versions
+    of the dates that move to another one.
+    """
+    resolver = FeedResolver(args.feeds_dir)
+    if not resolver.refresh():
+        raise ValueError(f"No cached GTFS feeds in {args.feeds_dir}; pass --feed-id and --gtfs-url instead")
+    assigned = {}
+    moved = {}
+    for date in date_list:
+        trip_ids = sample_trip_ids(storage, f"{args.prefix}date={date}/", args.vehicle_format)
+        processed = [feed_version for feed_version in resolver.feeds
+                     if manifest.has_records(feed_version, date, route_list)]
+        resolution = resolver.resolve(date, trip_ids, prefer=processed)
+        if processed and resolution is not None and resolution.feed_version not in processed:
+            # Outputs of every feed are summed, so the old feed's outputs of the date must go
+            logger.warning(f"{date} moves from feed {','.join(processed)} to {resolution.feed_version}")
+            moved[date] = processed
+        if resolution is None:
+            logger.warning(f"No cached feed matches {date}, skipping it")
+            continue
+        if resolution.sampled and resolution.score < MIN_MATCH_SCORE:
+            logger.warning(f"Only {resolution.matched}/{resolution.sampled} sampled trips of {date} "
+                           f"match {resolution.feed_version}")
+        assigned.setdefault(resolution.feed_version, []).append(date)
+    for feed_version, dates in assigned.items():
+        logger.info(f"Resolved {len(dates)} dates ({dates[0]} to {dates[-1]}) to feed {feed_version}")
+    feeds = [(feed_version, resolver.feeds[feed_version].path, dates) for feed_version, dates in assigned.items()]
+    return feeds, moved
+
+def coordinate(args, plans: list, logger):
+    """Enqueue the pending partitions as tasks and report the progress of the queue"""
+    queue = WorkQueue(args.queue, args.lease_seconds)
+    for feed_id, gtfs_url, pending in plans:
+        shards = {date: shard_routes(routes, args.shard_size) for date, routes in pending.items()}
+        added = queue.enqueue(feed_id, gtfs_url, shards)
+        logger.info(f"Enqueued {added} tasks for {feed_id} in {args.queue}")
+    while True:
+        progress = queue.progress()
+        logger.info(format_progress(progress))
+        if not args.watch or not (progress['pending'] or progress['leased']):
+            break
+        time.sleep(args.watch)
+
+def work(args, storage, logger):
+    """Claim and process tasks from the queue until it is drained"""
+    queue = WorkQueue(args.queue, args.lease_seconds)
+    # One feed's GTFS data at a time; workers prefer tasks of the feed they have loaded
+    calculators = {}
+
+    def process(task, lost) -> int:
+        if task.feed_id not in calculators:
+            calculators.clear()
+            calculators[task.feed_id] = build_calculator(args, storage, task.feed_id, task.gtfs_url, logger)
+        calculator = calculators[task.feed_id]
+        with metrics_context(worker=args.worker_id, task_id=task.id):
+            speeds = calculator.process_date(task.date, task.routes, cancel=lost)
+        if lost.is_set():
+            raise LeaseLost(f"Lease of task {task.id} was taken over")
+        # Load and speed errors are only logged by the calculator; retry the routes they left pending
+        pending = calculator.manifest.pending_routes(task.feed_id, task.date, task.routes)
+        if pending:
+            raise RuntimeError(f"{len(pending)} routes still pending for {task.date}: {','.join(pending)}")
+        return 0 if speeds is None else len(speeds)
+
+    completed = run_worker(queue, process, args.worker_id, args.poll_seconds)
+    logger.info(f"Worker {args.worker_id} completed {completed} tasks")
+
 def main():
     # Parse arguments
     parser = argparse.ArgumentParser(description='Calculate bus speeds')
-    parser.add_argument('--start-date', required=True, help='Start date (YYYY-MM-DD)')
-    parser.add_argument('--end-date', required=True, help='End date (YYYY-MM-DD)')
-    parser.add_argument('--feed-id', required=True, help='Feed ID')
-    parser.add_argument('--gtfs-url', required=True, help='GTFS URL')
-    parser.add_argument('--routes', required=True, help='Comma-separated list of route IDs')
+    parser.add_argument('--start-date', help='Start date (YYYY-MM-DD)')
+    parser.add_argument('--end-date', help='End date (YYYY-MM-DD)')
+    parser.add_argument('--feed-id', help='Feed ID (default: resolve each date to a feed in --feeds-dir)')
+    parser.add_argument('--gtfs-url', help='GTFS URL (default: resolve each date to a feed in --feeds-dir)')
+    parser.add_argument('--routes', help='Comma-separated list of route IDs')
+    parser.add_argument('--storage', default=VEHICLES_URI,
+                        help='Vehicle positions bucket or local mirror directory (default: %(default)s)')
+    parser.add_argument('--prefix', default=VEHICLES_PREFIX,
+                        help='Key prefix of the date=YYYY-MM-DD partitions (default: %(default)s)')
+    parser.add_argument('--vehicle-format', choices=VEHICLE_FORMATS, default='parquet',
+                        help='Normalized parquet or raw GTFS-rt protobuf snapshots')
+    parser.add_argument('--feeds-dir', default=FEEDS_DIR,
+                        help='Cached GTFS feed versions, used without --feed-id/--gtfs-url (default: %(default)s)')
+    parser.add_argument('--manifest-dir', default=MANIFEST_DIR,
+                        help='Directory of the partition completion records (default: %(default)s)')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only print the missing and stale route/date partitions')
+    parser.add_argument('--queue', help='SQLite work queue file shared by the coordinator and workers')
+    parser.add_argument('--role', choices=['coordinator', 'worker'],
+                        help='Enqueue the pending partitions as tasks, or claim and process tasks')
+    parser.add_argument('--shard-size', type=int, default=10, help='Routes per task (default: %(default)s)')
+    parser.add_argument('--watch', type=float, metavar='SECONDS',
+                        help='Coordinator: report progress every SECONDS until the queue is drained')
+    parser.add_argument('--worker-id', default=default_worker_id(), help='Worker ID (default: host-pid)')
+    parser.add_argument('--lease-seconds', type=float, default=LEASE_SECONDS,
+                        help='Task lease, renewed by heartbeats (default: %(default)s)')
+    parser.add_argument('--poll-seconds', type=float, default=POLL_SECONDS,
+                        help='Worker wait when no task is available (default: %(default)s)')
+    parser.add_argument('--profile', choices=PROFILE_MODES, nargs='?', const='sampling',
+                        help='Profile selected stages (default mode: sampling)')
+    parser.add_argument('--profile-stages', default=','.join(DEFAULT_STAGES),
+                        help='Comma-separated stages to profile (e.g. projection,lis,interpolation,write_speeds)')
+    parser.add_argument('--profile-dates', help='Comma-separated dates to profile (default: all)')
+    parser.add_argument('--profile-dir', default=os.path.join('logs', 'profiles'),
+                        help='Directory for the .collapsed/.pstats files')
+    parser.add_argument('--profile-top', type=int, default=20, help='Functions per stage in the profile report')
     args = parser.parse_args()
+    if bool(args.queue) != bool(args.role):
+        parser.error('--queue and --role must be given together')
+    if bool(args.feed_id) != bool(args.gtfs_url):
+        parser.error('--feed-id and --gtfs-url must be given together')
+    if args.role != 'worker':
+        # Workers take the feed, dates and routes from their tasks
+        missing = [f'--{name.replace("_", "-")}' for name in ('start_date', 'end_date', 'routes')
+                   if getattr(args, name) is None]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
 
     print(f"Starting main with feed_id: {args.feed_id}")  # Debug print
     
@@ -48,32 +192,68 @@ def main():
 
     try:
         # Configuration
-        bucket = "dataclinic-gtfs-rt"
-        prefix = "norm/bus-mta-vp/vehicles/"
-        route_list = args.routes.split(',')
-
-        # Initialize GTFS data once
-        logger.info("Loading feed GTFS data...")
-        segment_df = GTFS_shape_processor(args.gtfs_url, 4326, 2263).process_shapes()
-        gtfs_dict = parse_zipped_gtfs(args.gtfs_url)
-        logger.info("Feed GTFS data loaded successfully")
-
-        # Initialize calculator
-        logger.info("Initializing SpeedCalculator")
-        calculator = SpeedCalculator(
-            bucket=bucket,
-            prefix=prefix,
-            feed_id=args.feed_id,
-            gtfs_dict=gtfs_dict,
-            segment_df=segment_df
-        )
-
-        # Process dates
-        date_list = generate_date_list(args.start_date, args.end_date)
-        logger.info(f"Processing dates: {date_list} for routes: {route_list}")
-        
-        for date in date_list:
-            calculator.process_date(date, route_list) 
+        storage = open_storage(args.storage)
+
+        if args.role != 'worker':
+            route_list = args.routes.split(',')
+            date_list = generate_date_list(args.start_date, args.end_date)
+
+            manifest = build_manifest(args.vehicle_format, args.manifest_dir)
+
+            # The given feed for every date, or the best-matching cached feed version of each date
+            if args.feed_id:
+                feeds, moved = [(args.feed_id, args.gtfs_url, date_list)], {}
+            else:
+                feeds, moved = resolve_feeds(args, storage, date_list, route_list, manifest, logger)
+
+            # Plan the missing and stale partitions; complete ones are skipped
+            plans = []
+            for feed_id, gtfs_url, dates in feeds:
+                pending, counts = manifest.plan(feed_id, dates, route_list)
+                logger.info(f"Partitions of {feed_id} for {len(dates)} dates x {len(route_list)} routes "
+                            f"(version {manifest.version}): {counts['complete']} complete, "
+                            f"{counts['stale']} stale, {counts['missing']} missing")
+                plans.append((feed_id, gtfs_url, pending))
+            if args.dry_run:
+                for date, old_feeds in moved.items():
+                    print(f"{date}: outputs of {','.join(old_feeds)} would be removed")
+                for feed_id, _, pending in plans:
+                    for date, routes in pending.items():
+                        print(f"{feed_id} {date}: {','.join(routes)}")
+                return
+            for date, old_feeds in moved.items():
+                for feed_id in old_feeds:
+                    for route in route_list:
+                        remove_outputs(manifest, feed_id, route, date)
+                logger.info(f"Removed the outputs of {','.join(old_feeds)} for {date}")
+            if args.role == 'coordinator':
+                coordinate(args, plans, logger)
+                return
+
+        if args.profile:
+            start_profiling(
+                stages=args.profile_stages.split(','),
+                dates=args.profile_dates.split(',') if args.profile_dates else None,
+                mode=args.profile,
+                output_dir=args.profile_dir,
+            )
+        try:
+            if args.role == 'worker':
+                work(args, storage, logger)
+            else:
+                for feed_id, gtfs_url, pending in plans:
+                    if not pending:
+                        continue
+                    # Initialize GTFS data once per feed
+                    calculator = build_calculator(args, storage, feed_id, gtfs_url, logger)
+                    logger.info(f"Processing dates: {list(pending)}")
+                    for date, routes in pending.items():
+                        calculator.process_date(date, routes)
+        finally:
+            session = stop_profiling()
+            if session is not None:
+                print(session.report(args.profile_top))
+                logger.info(f"Profiles written to {args.profile_dir}")
 
     except Exception as e:
         logger.error(f"Fatal error in main execution: {str(e)}")
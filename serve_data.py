@@ -0,0 +1,34 @@
+"""
+Serve the precomputed dashboard data over HTTP, so dashboard replicas can share
+one copy of `data/`.
+
+Examples:
+    python serve_data.py --port 8600
+    DASHBOARD_DATA_URL=http://127.0.0.1:8600 streamlit run tracker.py
+"""
+import argparse
+from src.dashboard_data import FEATURED_ROUTES
+from src.data_service import DATA_SERVICE_PORT, DataService, make_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the bus speed dashboard data')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to bind')
+    parser.add_argument('--port', type=int, default=DATA_SERVICE_PORT, help='Port to listen on')
+    parser.add_argument('--verbose', action='store_true', help='Log every request')
+    args = parser.parse_args()
+
+    service = DataService()
+    service.data.preload(FEATURED_ROUTES.values())
+    server = make_server(args.host, args.port, service, quiet=not args.verbose)
+    print(f"Serving dashboard data on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
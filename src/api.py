@@ -41,8 +41,12 @@ def query_feed_data(feed_id, access_token):
 
 
 def parse_zipped_gtfs(url):
-    response = requests.get(url)
-    zip_file = zipfile.ZipFile(io.BytesIO(response.content))
+    # Local feed files (e.g. synthetic benchmark feeds) are read without a download
+    if os.path.isfile(url):
+        zip_file = zipfile.ZipFile(url)
+    else:
+        response = requests.get(url)
+        zip_file = zipfile.ZipFile(io.BytesIO(response.content))
 
     file_names = zip_file.namelist()
 
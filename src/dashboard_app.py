@@ -0,0 +1,642 @@
+"""
+Application core of the Streamlit dashboard.
+
+Streamlit re-executes `tracker.py` on every interaction, but imported modules
+are loaded once per server process. Everything that does not depend on the
+current session lives here: selector options, data lookups and the figure
+builders. `tracker.py` only lays out widgets and renders the cached figures.
+"""
+import base64
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from .dashboard_data import FEATURED_ROUTES, get_dashboard_data
+from .figure_cache import get_figure_cache
+from .map_render import segment_traces
+
+# Route selected when a session starts
+DEFAULT_ROUTE_ID = "M50"
+
+# Day options
+DAY_OPTIONS = ["Mondays", "Tuesdays", "Wednesdays", "Thursdays", "Fridays", "Saturdays", "Sundays"]
+DAY_TO_NUM = {day: weekday for weekday, day in enumerate(DAY_OPTIONS)}
+
+# Rush hour selection - exact strings that match the parquet data
+RUSH_HOURS = {
+    "Morning Rush": "morning_rush",
+    "Evening Rush": "evening_rush"
+}
+
+# Chart views and the time cube resolution behind each; "Hourly" on a selected
+# day is the precomputed chart, every other combination is read from the rollups
+CHART_VIEWS = {
+    "Hourly": "hour",
+    "15 minutes": "quarter",
+    "Rush periods": "rush",
+    "Monthly": "rush",
+}
+DAY_SELECTIONS = {
+    "Selected day": None,
+    "Weekdays": "weekday",
+    "Weekends": "weekend",
+}
+RUSH_PERIOD_LABELS = ["Morning Rush", "Evening Rush", "Other Hours"]
+
+
+def route_options():
+    """Route display names for the selector, featured routes first"""
+    return list(get_dashboard_data().routes())
+
+
+def default_route_index(options):
+    """Index of the default route in the selector options"""
+    routes = get_dashboard_data().routes()
+    ids = [routes[name] for name in options]
+    return ids.index(DEFAULT_ROUTE_ID) if DEFAULT_ROUTE_ID in ids else 0
+
+
+def get_speed_data(route, day):
+    """Hourly speeds before and after for a route and day, as 24-element arrays"""
+    # Convert day string to weekday number (0 = Monday, 6 = Sunday)
+    weekday = DAY_TO_NUM[day]
+    
+    # Get route ID from the route data
+    route_id = get_dashboard_data().routes()[route]
+    
+    # Look up both control and treatment speeds in the process-wide index
+    return get_dashboard_data().hourly_speeds(route_id, weekday)
+
+
+def get_segment_speed_diff(route_id, weekday, rush_hour):
+    """
+    Get speed differences for route segments, joined with the cached segment geometry.
+    Returns (data, message), where message is a (level, text) tuple to show when data is None.
+    Errors are raised rather than returned, so they are never cached with the figure.
+    """
+    data = get_dashboard_data()
+
+    # 1. Speed Diff Data, from the rollup cube when available
+    speed_diff_data = data.map_speed_diff(route_id, weekday, rush_hour)
+
+    if speed_diff_data is None or speed_diff_data.empty:
+        return None, ("warning", "No data found for selected weekday and rush hour")
+
+    # 2. Pre-projected Segment Geometry
+    geometry = data.route_geometry(route_id)
+
+    if geometry is None:
+        return None, ("warning", f"No segment geometry data found for route {route_id}")
+
+    # 3. Join speed data with geometry in memory
+    merged_data = geometry.join(speed_diff_data)
+
+    if merged_data.empty:
+        return None, ("warning", "No matching segments found after merging")
+
+    return merged_data, None
+
+
+def create_color_gradient_legend(max_abs_diff, decrease_color, increase_color):
+    # Create color gradient for legend
+    n_steps = 11  # Same number of steps as in map
+    gradient_colors = []
+    
+    # Convert hex colors to RGB
+    def hex_to_rgb(hex_color):
+        return tuple(int(hex_color.lstrip("#")[i:i+2], 16) for i in (0, 2, 4))
+    
+    decrease_rgb = hex_to_rgb(decrease_color)
+    increase_rgb = hex_to_rgb(increase_color)
+    
+    # Add decrease color gradient (orange)
+    for i in range(n_steps // 2):
+        intensity = 2 * i / (n_steps - 1)
+        alpha = 0.3 + 0.7 * intensity
+        r, g, b = decrease_rgb
+        gradient_colors.append(f"rgba({r}, {g}, {b}, {alpha})")
+    
+    # Add white for zero
+    gradient_colors.append("rgb(255, 255, 255)")
+    
+    # Add increase color gradient (blue)
+    for i in range(n_steps // 2 + 1, n_steps):
+        intensity = 2 * (i - n_steps // 2) / (n_steps - 1)
+        alpha = 0.3 + 0.7 * intensity
+        r, g, b = increase_rgb
+        gradient_colors.append(f"rgba({r}, {g}, {b}, {alpha})")
+    
+    # Create CSS gradient string
+    gradient_str = ", ".join([f"{color} {i * 100 / (len(gradient_colors)-1)}%" for i, color in enumerate(gradient_colors)])
+    
+    return f"""
+    <div style="display: flex; align-items: center; justify-content: center; margin: 10px 0;">
+        <div style="display: flex; align-items: center;">
+            <div style="text-align: right; min-width: 60px;">
+                <span style="font-size: 12px;">{-max_abs_diff:.1f} mph</span>
+            </div>
+            <div style="width: 200px; height: 15px; margin: 0 8px;
+                background: linear-gradient(to right, {gradient_str});
+                border: 1px solid #ccc;">
+            </div>
+            <div style="text-align: left; min-width: 60px;">
+                <span style="font-size: 12px;">+{max_abs_diff:.1f} mph</span>
+            </div>
+        </div>
+    </div>
+    """
+
+
+def create_map(route_id, rush_hour, weekday, color_blind_mode, dark_mode):
+    """
+    Create map visualization for route segments.
+    Returns (fig, legend_html, message); legend_html is None when there is no segment data.
+    """
+    # Get segment speed differences with geometry
+    segments_data, message = get_segment_speed_diff(route_id, weekday, rush_hour)
+    geometry = get_dashboard_data().route_geometry(route_id)
+    text_color = "#FFFFFF" if dark_mode else "#333333"
+    legend_html = None
+    
+    # Create the base map
+    fig = go.Figure()
+    
+    if segments_data is not None and not segments_data.empty:
+        # Calculate speed range
+        max_abs_diff = max(abs(segments_data['avg_speed_diff'].max()), 
+                          abs(segments_data['avg_speed_diff'].min()))
+        # Round up to nearest whole number for cleaner scale
+        max_abs_diff = np.ceil(max_abs_diff)
+        
+        # Set colors based on color blind mode
+        if color_blind_mode:
+            decrease_color = '#D55E00'  # Orange-red for color blind
+            increase_color = '#0072B2'  # Blue for color blind
+        else:
+            decrease_color = '#FF6347'  # Tomato red
+            increase_color = '#4169E1'  # Royal blue
+        
+        # TODO: might change later
+        speed_diffs = -segments_data["avg_speed_diff"].to_numpy()
+        
+        # One line trace per colour class, with segments separated by gaps
+        traces, all_lons, all_lats = segment_traces(
+            segments_data, geometry, speed_diffs, max_abs_diff, decrease_color, increase_color
+        )
+        fig.add_traces(traces)
+        
+        # Calculate center and zoom
+        center_lat = (np.nanmax(all_lats) + np.nanmin(all_lats)) / 2
+        center_lon = (np.nanmax(all_lons) + np.nanmin(all_lons)) / 2
+        
+        lat_range = np.nanmax(all_lats) - np.nanmin(all_lats)
+        lon_range = np.nanmax(all_lons) - np.nanmin(all_lons)
+        
+        # Use smaller multipliers to zoom in more and show all segments clearly
+        lat_range *= 1.02  # Reduced from 1.05 to zoom in more
+        lon_range *= 1.02  # Reduced from 1.05 to zoom in more
+        
+        # Calculate zoom level with a larger increase to zoom in more
+        zoom = min(
+            np.log2(360 / lon_range),
+            np.log2(180 / lat_range)
+        ) + 1.0  # Increased from 0.5 to 1.0 to zoom in more
+        
+        # Create more detailed colorscale with smooth transitions
+        n_steps = 11  # Number of color steps
+        colorscale = []
+        
+        # Convert hex colors to RGB
+        decrease_rgb = tuple(int(decrease_color.lstrip("#")[i:i+2], 16) for i in (0, 2, 4))
+        increase_rgb = tuple(int(increase_color.lstrip("#")[i:i+2], 16) for i in (0, 2, 4))
+        
+        # Add decrease color gradient
+        for i in range(n_steps // 2):
+            pos = i / (n_steps - 1)
+            intensity = 2 * i / (n_steps - 1)
+            r = int(decrease_rgb[0] * (0.6 + 0.4 * intensity))
+            g = int(decrease_rgb[1] * (1-intensity))
+            b = int(decrease_rgb[2] * (1-intensity))
+            colorscale.append([pos, f'rgb({r}, {g}, {b})'])
+        
+        # Add white for zero
+        colorscale.append([0.5, 'rgb(255, 255, 255)'])
+        
+        # Add increase color gradient
+        for i in range(n_steps // 2 + 1, n_steps):
+            pos = i / (n_steps - 1)
+            intensity = 2 * (i - n_steps // 2) / (n_steps - 1)
+            r = int(increase_rgb[0] * (1-intensity))
+            g = int(increase_rgb[1] * (0.6 + 0.4 * intensity))
+            b = int(increase_rgb[2] * (1-intensity))
+            colorscale.append([pos, f'rgb({r}, {g}, {b})'])
+        
+        # Add a continuous color scale
+        fig.add_trace(go.Scattermapbox(
+            mode="markers",
+            lon=[],
+            lat=[],
+            marker=dict(
+                size=10,
+                colorscale=colorscale,
+                colorbar=dict(
+                    title=dict(
+                        text="Speed Difference (mph)",
+                        font=dict(size=12)
+                    ),
+                    thickness=15,
+                    len=0.75,
+                    x=0.9,
+                    xpad=10,
+                    tickmode='array',
+                    tickvals=np.linspace(-max_abs_diff, max_abs_diff, 9),
+                    ticktext=[f"{x:+.1f}" for x in np.linspace(-max_abs_diff, max_abs_diff, 9)],
+                    tickfont=dict(size=10),
+                    outlinewidth=0,
+                    ticklabelposition="outside"
+                ),
+                cmin=-max_abs_diff,
+                cmax=max_abs_diff,
+                showscale=True
+            ),
+            showlegend=False
+        ))
+        
+        # Set map layout
+        fig.update_layout(
+            mapbox=dict(
+                style="carto-darkmatter" if dark_mode else "carto-positron",
+                zoom=zoom - 1.0,  # Zoom out more to show all segments
+                center=dict(lat=center_lat, lon=center_lon),
+            ),
+            margin=dict(l=0, r=0, t=0, b=0),
+            height=375,
+            hoverlabel=dict(
+                bgcolor="white",
+                font_size=12,
+                font_family="Arial"
+            ),
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="center",
+                x=0.5,
+                bgcolor="rgba(0,0,0,0)" if dark_mode else "rgba(255,255,255,0)",
+                font=dict(color=text_color)
+            )
+        )
+
+        legend_html = create_color_gradient_legend(max_abs_diff, decrease_color, increase_color)
+    else:
+        # Default view for NYC if no segments
+        fig.update_layout(
+            mapbox=dict(
+                style="carto-positron",
+                zoom=12,
+                center=dict(lat=40.75, lon=-73.98),  # NYC center
+            ),
+            margin=dict(l=0, r=0, t=0, b=0),
+            height=440,
+            hoverlabel=dict(
+                bgcolor="white",
+                font_size=12,
+                font_family="Arial"
+            ),
+            legend=dict(
+                orientation="h",
+                yanchor="bottom",
+                y=1.02,
+                xanchor="center",
+                x=0.5,
+                bgcolor="rgba(0,0,0,0)" if dark_mode else "rgba(255,255,255,0)",
+                font=dict(color=text_color)
+            )
+        )
+        print("No segment data available for the selected time period")
+    
+    return fig, legend_html, message
+
+
+def map_spec(route_id, rush_hour, weekday, color_blind_mode, dark_mode):
+    """Serialized map figure, legend and message for a selection, from the shared figure cache"""
+    data = get_dashboard_data()
+    key = ("map", route_id, weekday, rush_hour, color_blind_mode, dark_mode,
+           data.route_version(route_id), data.segment_rollup_version(route_id))
+
+    def build():
+        fig, legend_html, message = create_map(route_id, rush_hour, weekday, color_blind_mode, dark_mode)
+        return fig.to_json(), legend_html, message
+
+    return get_figure_cache().get_or_build(key, build)
+
+
+def create_chart(before_data, after_data, color_blind_mode, dark_mode, height=500):
+    """Create the hourly speed chart from before and after 24-hour speed arrays"""
+    # Create the plot using Plotly
+    fig = go.Figure()
+    
+    # Create a complete set of hours (0-23), or fractional hours for finer bins
+    bins_per_hour = len(before_data) // 24
+    all_hours = pd.Series(range(24)) if bins_per_hour == 1 else pd.Series(np.arange(len(before_data)) / bins_per_hour)
+    
+    # Interpolate both datasets to ensure they have values at all hours
+    before_interp = pd.Series(before_data).interpolate(method='linear')
+    after_interp = pd.Series(after_data).interpolate(method='linear')
+    
+    # Choose colors based on color blind mode
+    if color_blind_mode:
+        before_color = "#D55E00"   # Orange-red that works well for color blind users
+        after_color = "#0072B2"    # Blue that works well for color blind users
+        before_fill = "rgba(213, 94, 0, 0.2)"    # Light orange fill
+        after_fill = "rgba(0, 114, 178, 0.2)"    # Light blue fill
+    else:
+        before_color = "#FF6347"   # Tomato red
+        after_color = "#4169E1"    # Royal blue
+        before_fill = "rgba(255, 99, 71, 0.2)"   # Light tomato red fill
+        after_fill = "rgba(65, 105, 225, 0.2)"   # Light blue fill
+    
+    
+    # Choose background based on dark mode
+    bg_color = "#121212" if dark_mode else "#FFFFFF"
+    text_color = "#FFFFFF" if dark_mode else "#333333"
+    grid_color = "rgba(255,255,255,0.1)" if dark_mode else "rgba(0,0,0,0.1)"
+    
+    # Add filled area for before line
+    fig.add_trace(go.Scatter(
+        x=all_hours,
+        y=before_interp,
+        mode='lines',
+        line=dict(width=0),
+        fill='tozeroy',
+        fillcolor=before_fill,
+        name='',
+        showlegend=False,
+        hoverinfo='skip'  # Skip hover info for filled areas
+    ))
+    
+    # Add filled area for after line
+    fig.add_trace(go.Scatter(
+        x=all_hours,
+        y=after_interp,
+        mode='lines',
+        line=dict(width=0),
+        fill='tozeroy',
+        fillcolor=after_fill,
+        name='',
+        showlegend=False,
+        hoverinfo='skip'  # Skip hover info for filled areas
+    ))
+    
+    # Add the lines
+    fig.add_trace(go.Scatter(
+        x=all_hours,
+        y=before_interp,
+        mode='lines',
+        line=dict(
+            color=before_color, 
+            width=2, 
+            dash='dash',
+            shape='spline',# This creates a smoothed curve
+            smoothing=0.3 # Adjust smoothing factor (0.5-1.5 range works well)
+        ),   
+        name='Before Jan 5th',
+        showlegend=True
+    ))
+    
+    fig.add_trace(go.Scatter(
+        x=all_hours,
+        y=after_interp,
+        mode='lines',
+        line=dict(
+            color=after_color, 
+            width=2,
+            shape='spline',# This creates a smoothed curve
+            smoothing=0.3 # Adjust smoothing factor (0.5-1.5 range works well)
+        ),
+        name='Jan 5th and After',
+        showlegend=True
+    ))
+    
+    # Update layout
+    fig.update_layout(
+        title="",
+        xaxis=dict(
+            title='Time of Day',
+            tickmode='array',
+            tickvals=list(range(24)),
+            ticktext=['12 am', '1 am', '2 am', '3 am', '4 am', '5 am', 
+                     '6 am', '7 am', '8 am', '9 am', '10 am', '11 am',
+                     '12 pm', '1 pm', '2 pm', '3 pm', '4 pm', '5 pm', 
+                     '6 pm', '7 pm', '8 pm', '9 pm', '10 pm', '11 pm'],
+            gridcolor=grid_color,
+            color=text_color,
+            title_font_color=text_color,
+            tickfont_color=text_color,
+        ),
+        yaxis=dict(
+            title_text='Average Bus Speed (mph)',
+            title_standoff=10,
+            gridcolor=grid_color,
+            color=text_color,
+            title_font_color=text_color,
+            tickfont_color=text_color,
+        ),
+        plot_bgcolor=bg_color,
+        paper_bgcolor=bg_color,
+        font=dict(color=text_color),
+        hovermode="x unified",
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="center",
+            x=0.5,
+            bgcolor="rgba(0,0,0,0)" if dark_mode else "rgba(255,255,255,0)",
+            font=dict(color=text_color)
+        ),
+        margin=dict(l=50, r=20, t=50, b=50),  # Increased top margin to accommodate legend
+        height=height,
+        autosize=True,
+    )
+    
+    return fig
+
+
+def chart_spec(route, day, color_blind_mode, dark_mode):
+    """Serialized hourly speed chart for a selection, from the shared figure cache"""
+    key = ("chart", route, day, color_blind_mode, dark_mode, get_dashboard_data().version)
+    return get_figure_cache().get_or_build(
+        key, lambda: create_chart(*get_speed_data(route, day), color_blind_mode, dark_mode).to_json()
+    )
+
+
+def _chart_colors(color_blind_mode, dark_mode):
+    """Before and after colours, background, text and grid colours of the rollup charts"""
+    before_color, after_color = ("#D55E00", "#0072B2") if color_blind_mode else ("#FF6347", "#4169E1")
+    if dark_mode:
+        return before_color, after_color, "#121212", "#FFFFFF", "rgba(255,255,255,0.1)"
+    return before_color, after_color, "#FFFFFF", "#333333", "rgba(0,0,0,0.1)"
+
+
+def _chart_layout(fig, xaxis_title, color_blind_mode, dark_mode, height):
+    _, _, bg_color, text_color, grid_color = _chart_colors(color_blind_mode, dark_mode)
+    fig.update_layout(
+        xaxis=dict(title=xaxis_title, gridcolor=grid_color, color=text_color),
+        yaxis=dict(title_text='Average Bus Speed (mph)', title_standoff=10, gridcolor=grid_color,
+                   color=text_color),
+        plot_bgcolor=bg_color,
+        paper_bgcolor=bg_color,
+        font=dict(color=text_color),
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="center", x=0.5,
+                    bgcolor="rgba(0,0,0,0)", font=dict(color=text_color)),
+        margin=dict(l=50, r=20, t=50, b=50),
+        height=height,
+        autosize=True,
+    )
+    return fig
+
+
+def create_rush_chart(before_data, after_data, color_blind_mode, dark_mode, height=500):
+    """Grouped bar chart of average speeds before and after per rush period"""
+    before_color, after_color, *_ = _chart_colors(color_blind_mode, dark_mode)
+    fig = go.Figure([
+        go.Bar(x=RUSH_PERIOD_LABELS, y=before_data, name='Before Jan 5th', marker_color=before_color),
+        go.Bar(x=RUSH_PERIOD_LABELS, y=after_data, name='Jan 5th and After', marker_color=after_color),
+    ])
+    fig.update_layout(barmode="group", hovermode="x unified")
+    return _chart_layout(fig, 'Period', color_blind_mode, dark_mode, height)
+
+
+def create_monthly_chart(months, speeds, color_blind_mode, dark_mode, height=500):
+    """Line chart of average speeds per month, one line per rush period"""
+    before_color, after_color, *_ = _chart_colors(color_blind_mode, dark_mode)
+    colors = [before_color, after_color, "#009E73" if color_blind_mode else "#808080"]
+    fig = go.Figure([
+        go.Scatter(x=list(months), y=speeds[:, i], mode='lines+markers', name=label,
+                   line=dict(color=color, width=2))
+        for i, (label, color) in enumerate(zip(RUSH_PERIOD_LABELS, colors))
+    ])
+    fig.add_vline(x="2025-01", line_dash="dot", line_color="#888888")
+    fig.update_layout(hovermode="x unified")
+    return _chart_layout(fig, 'Month', color_blind_mode, dark_mode, height)
+
+
+def chart_days(day, day_selection):
+    """Time cube day selection for the selected day and "Days" option"""
+    return DAY_SELECTIONS[day_selection] or DAY_TO_NUM[day]
+
+
+def time_chart_spec(route, day, view, day_selection, color_blind_mode, dark_mode):
+    """
+    Serialized chart of a rollup view (see `CHART_VIEWS`), from the shared figure cache,
+    or None if there are no rollups for the route.
+    """
+    data = get_dashboard_data()
+    route_id = data.routes()[route]
+    key = ("time", route, day, view, day_selection, color_blind_mode, dark_mode,
+           data.time_rollup_version(route_id))
+
+    def build():
+        days, resolution = chart_days(day, day_selection), CHART_VIEWS[view]
+        if view == "Monthly":
+            speeds = data.monthly_speeds(route_id, days, resolution)
+            return None if speeds is None else create_monthly_chart(*speeds, color_blind_mode, dark_mode).to_json()
+        speeds = data.period_speeds(route_id, days, resolution)
+        if speeds is None:
+            return None
+        if resolution == "rush":
+            return create_rush_chart(*speeds, color_blind_mode, dark_mode).to_json()
+        return create_chart(*speeds, color_blind_mode, dark_mode).to_json()
+
+    return get_figure_cache().get_or_build(key, build)
+
+
+def _typed_array(values):
+    """Decode trace data that Plotly serialized as a binary typed array, or pass through a list"""
+    if isinstance(values, dict) and "bdata" in values:
+        return np.frombuffer(base64.b64decode(values["bdata"]), dtype=values["dtype"])
+    return np.asarray(values if values is not None else [])
+
+
+def map_segment_rows(map_fig):
+    """Geometry rows of the segments drawn on a map figure, from the traces' customdata"""
+    rows = [_typed_array(trace.customdata) for trace in map_fig.data if trace.customdata is not None]
+    return np.unique(np.concatenate(rows)).astype(int).tolist() if rows else []
+
+
+def clicked_segment_row(map_fig, selection):
+    """Geometry row of the first selected map point, or None if no segment was clicked"""
+    for point in (selection or {}).get("points", []):
+        curve, index = point.get("curve_number"), point.get("point_index")
+        if curve is None or index is None or curve >= len(map_fig.data):
+            continue
+        customdata = map_fig.data[curve].customdata
+        if customdata is not None:
+            return int(_typed_array(customdata)[index])
+    return None
+
+
+def segment_names(route_id, rows):
+    """Labels ("From → To") of a route's segments, keyed by geometry row"""
+    geometry = get_dashboard_data().route_geometry(route_id)
+    if geometry is None:
+        return {}
+    segments = geometry.segments.iloc[rows]
+    return dict(zip(rows, segments["prev_stop_name"].astype(str) + " → " + segments["stop_name"].astype(str)))
+
+
+def get_segment_hourly_speeds(route_id, row, day):
+    """Hourly speeds before and after of one segment (by geometry row) on a day, as 24-element arrays"""
+    data = get_dashboard_data()
+    segment = data.route_geometry(route_id).segments.iloc[row]
+    return data.segment_hourly_speeds(route_id, segment["prev_stop_id"], segment["stop_id"], DAY_TO_NUM[day])
+
+
+def segment_chart_spec(route_id, row, day, color_blind_mode, dark_mode):
+    """Serialized hourly speed chart of one segment, from the shared figure cache"""
+    data = get_dashboard_data()
+    key = ("segment", route_id, row, day, color_blind_mode, dark_mode,
+           data.segment_hours_version, data.route_version(route_id)[1])
+    return get_figure_cache().get_or_build(
+        key, lambda: create_chart(*get_segment_hourly_speeds(route_id, row, day),
+                                  color_blind_mode, dark_mode, height=350).to_json()
+    )
+
+
+def warm_figure_cache():
+    """Precompute the chart and map of every route, day and rush period in the default colour mode and theme"""
+    for route, route_id in FEATURED_ROUTES.items():
+        for weekday, day in enumerate(DAY_OPTIONS):
+            try:
+                chart_spec(route, day, False, False)
+                for rush_hour in ("morning_rush", "evening_rush"):
+                    map_spec(route_id, rush_hour, weekday, False, False)
+            except Exception as e:
+                print(f"Could not precompute figures for {route} on {day}: {str(e)}")
+    print(f"Figure cache warmed with {len(get_figure_cache())} figures")
+
+
+_first_render = None
+_render_lock = threading.Lock()
+
+
+def report_render_time(started, session_state):
+    """
+    Record how long a script run took since `started` (a `time.perf_counter()` value).
+    The first render of the process and the first render of each session are printed.
+    """
+    global _first_render
+    elapsed = time.perf_counter() - started
+    with _render_lock:
+        first_in_process = _first_render is None
+        if first_in_process:
+            _first_render = elapsed
+    if "first_render" not in session_state:
+        session_state.first_render = elapsed
+        scope = "first run in this process" if first_in_process else "new session"
+        print(f"Time to first render: {elapsed:.3f} s ({scope})")
+    return elapsed
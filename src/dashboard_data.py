@@ -0,0 +1,512 @@
+"""
+Process-wide, indexed data layer for the Streamlit dashboard.
+
+Streamlit reruns `tracker.py` on every widget interaction, but imported modules
+persist for the life of the server process. The stores below are loaded once,
+indexed into ready-to-plot arrays, and shared by every session. Each access
+costs one `os.stat` per file to detect changes; a file is only reloaded when
+its content hash actually differs. The rollup cubes are versioned by a scan of
+the route's partition files, repeated at most every `ROLLUP_VERSION_TTL` seconds.
+"""
+import glob
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .geometry_cache import RouteGeometry, load_route_geometry, load_segment_store
+
+CONTROL_SPEEDS_PATH = "data/chart-speeds/control_speeds.parquet"
+TREATMENT_SPEEDS_PATH = "data/chart-speeds/treatment_speeds.parquet"
+MAP_SPEEDS_DIR = "data/map-speeds"
+MAP_SEGMENTS_DIR = "data/map-segments"
+
+# Consolidated store of all routes, built by `aggregate.py route-catalog`
+DASHBOARD_STORE_DIR = "data/dashboard"
+ROUTE_CATALOG_FILE = "routes.parquet"
+MAP_SPEEDS_FILE = "map-speeds.parquet"
+SEGMENT_GEOMETRY_FILE = "segment-geometry.npz"
+SEGMENT_HOURS_FILE = "segment-hours.parquet"  # built by `aggregate.py segment-hours`
+
+# Base URL of a data service (see `data_service.py`) to read from instead of `data/`
+DATA_URL_ENV = "DASHBOARD_DATA_URL"
+
+# Seconds a route's rollup version is reused before its partition files are scanned again
+ROLLUP_VERSION_TTL = 5.0
+
+# Comparison windows (inclusive processed dates) for the speed difference map
+CONTROL_PERIOD = ("2024-12-03", "2025-01-04")
+TREATMENT_PERIOD = ("2025-01-05", "2025-02-06")
+
+# Routes shown on the dashboard, by display name
+ROUTE_DATA = {
+    "Route B39: Williamsburg Bridge": {
+        "id": "B39",
+        "geojson_file": "data/map-segments/mdb-512_B39_unique_segments.geojson",
+        "is_affected": True
+    },
+    "Route SIM24: Lincoln Tunnel": {
+        "id": "SIM24",
+        "geojson_file": "data/map-segments/mdb-514_SIM24_unique_segments.geojson",
+        "is_affected": True
+    },
+    "Route SIM4X: Hugh Carey Tunnel": {
+        "id": "SIM4X",
+        "geojson_file": "data/map-segments/mdb-514_SIM4X_unique_segments.geojson",
+        "is_affected": True
+    },
+    "Route M102: CBD North/South": {
+        "id": "M102",
+        "geojson_file": "data/map-segments/mdb-513_M102_unique_segments.geojson",
+        "is_affected": True
+    },
+    "Route M50: CBD East/West": {
+        "id": "M50",
+        "geojson_file": "data/map-segments/mdb-513_M50_unique_segments.geojson",
+        "is_affected": True
+    }
+}
+
+# Featured routes by display name, used when no route catalog has been built
+FEATURED_ROUTES = {name: info["id"] for name, info in ROUTE_DATA.items()}
+
+HOURS = 24
+
+
+def file_stat(path: str) -> Optional[Tuple[int, int]]:
+    """Return (mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def file_hash(path: str) -> str:
+    """Return the SHA-256 digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class VersionedFile:
+    """
+    Tracks one data file and reloads its derived value when the content changes.
+    Subclasses implement `load(path, digest)`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.stat = None
+        self.digest = None
+        self.value = None
+        self._lock = threading.Lock()
+
+    def load(self, path: str, digest: str):
+        raise NotImplementedError
+
+    def get(self):
+        """Return the current value, reloading it if the file content changed."""
+        stat = file_stat(self.path)
+        if stat is not None and stat == self.stat:
+            return self.value
+
+        with self._lock:
+            stat = file_stat(self.path)
+            if stat == self.stat:
+                return self.value
+            if stat is None:
+                self.stat, self.digest, self.value = None, None, None
+                return None
+            digest = file_hash(self.path)
+            if digest != self.digest:
+                self.value = self.load(self.path, digest)
+                self.digest = digest
+            self.stat = stat
+            return self.value
+
+    @property
+    def version(self) -> Optional[str]:
+        """Content hash of the loaded file, usable as a cache key."""
+        self.get()
+        return self.digest
+
+
+class HourlySpeedIndex(VersionedFile):
+    """
+    Chart speeds (route_id, weekday, hour, average_speed_mph) indexed by
+    (route_id, weekday) into 24-element arrays, NaN where an hour has no data.
+    """
+
+    def load(self, path: str, digest: str) -> Dict[Tuple[str, int], np.ndarray]:
+        data = pd.read_parquet(path, columns=["route_id", "weekday", "hour", "average_speed_mph"])
+        index = {}
+        for (route_id, weekday), group in data.groupby(["route_id", "weekday"], sort=False):
+            speeds = np.full(HOURS, np.nan)
+            speeds[group["hour"].to_numpy()] = group["average_speed_mph"].to_numpy()
+            speeds.setflags(write=False)
+            index[(route_id, int(weekday))] = speeds
+        return index
+
+
+class SpeedDiffIndex(VersionedFile):
+    """
+    A route's segment speed differences indexed by (weekday, rush_hour) into
+    DataFrames of prev_stop_id, stop_id and avg_speed_diff.
+    """
+
+    def load(self, path: str, digest: str) -> Dict[Tuple[int, str], pd.DataFrame]:
+        data = pd.read_parquet(path, columns=["prev_stop_id", "stop_id", "weekday",
+                                              "rush_hour", "avg_speed_diff"])
+        return {
+            (int(weekday), rush_hour): group.drop(columns=["weekday", "rush_hour"]).reset_index(drop=True)
+            for (weekday, rush_hour), group in data.groupby(["weekday", "rush_hour"], sort=False)
+        }
+
+
+class SegmentGeometryFile(VersionedFile):
+    """A route's segment geometry, pre-projected and simplified (see `geometry_cache.py`)."""
+
+    def load(self, path: str, digest: str) -> RouteGeometry:
+        return load_route_geometry(path, digest)
+
+
+class RouteCatalog(VersionedFile):
+    """
+    Route catalog (see `route_catalog.py`) indexed by route_id, together with
+    a mapping of display names to route IDs in catalog order.
+    """
+
+    def load(self, path: str, digest: str) -> Tuple[pd.DataFrame, Dict[str, str]]:
+        catalog = pd.read_parquet(path).set_index("route_id", drop=False)
+        return catalog, dict(zip(catalog["name"], catalog["route_id"]))
+
+
+class MapSpeedStore(VersionedFile):
+    """
+    Segment speed differences of all routes indexed by (route_id, weekday, rush_hour)
+    into DataFrames of prev_stop_id, stop_id and avg_speed_diff.
+    """
+
+    def load(self, path: str, digest: str) -> Dict[Tuple[str, int, str], pd.DataFrame]:
+        data = pd.read_parquet(path, columns=["route_id", "prev_stop_id", "stop_id", "weekday",
+                                              "rush_hour", "avg_speed_diff"])
+        return {
+            (route_id, int(weekday), rush_hour):
+                group.drop(columns=["route_id", "weekday", "rush_hour"]).reset_index(drop=True)
+            for (route_id, weekday, rush_hour), group in data.groupby(["route_id", "weekday", "rush_hour"],
+                                                                      sort=False)
+        }
+
+
+class SegmentGeometryStore(VersionedFile):
+    """Segment geometry of all feeds, as a RouteGeometry per Mobility Database ID."""
+
+    def load(self, path: str, digest: str) -> Dict[str, RouteGeometry]:
+        return load_segment_store(path)
+
+
+class SegmentHourIndex(VersionedFile):
+    """
+    Segment-hour store (see `rollups.write_segment_hours`) held as flat arrays in
+    key order, with each (route_id, prev_stop_id, stop_id) mapped to its slice of
+    at most 7 x 24 rows.
+    """
+
+    def load(self, path: str, digest: str) -> Tuple[Dict[Tuple[str, int, int], Tuple[int, int]], dict]:
+        data = pd.read_parquet(path, columns=["route_id", "prev_stop_id", "stop_id", "weekday", "hour",
+                                              "before_speed_mph", "after_speed_mph"])
+        data = data.sort_values(["route_id", "prev_stop_id", "stop_id", "weekday", "hour"], kind="stable")
+        route_ids = data["route_id"].astype(str).to_numpy()
+        prev_stop_ids = data["prev_stop_id"].to_numpy(dtype=np.int64)
+        stop_ids = data["stop_id"].to_numpy(dtype=np.int64)
+
+        # First row of every segment, and the end of its slice
+        changed = np.ones(len(data), dtype=bool)
+        changed[1:] = ((route_ids[1:] != route_ids[:-1]) | (prev_stop_ids[1:] != prev_stop_ids[:-1])
+                       | (stop_ids[1:] != stop_ids[:-1]))
+        starts = np.flatnonzero(changed)
+        ends = np.append(starts[1:], len(data))
+        slices = {
+            (route_id, int(prev_stop_id), int(stop_id)): (int(start), int(end))
+            for route_id, prev_stop_id, stop_id, start, end
+            in zip(route_ids[starts], prev_stop_ids[starts], stop_ids[starts], starts, ends)
+        }
+        columns = {
+            "weekday": data["weekday"].to_numpy(dtype=np.intp),
+            "hour": data["hour"].to_numpy(dtype=np.intp),
+            "before": data["before_speed_mph"].to_numpy(dtype=float),
+            "after": data["after_speed_mph"].to_numpy(dtype=float),
+        }
+        return slices, columns
+
+
+EMPTY_HOURS = np.full(HOURS, np.nan)
+EMPTY_HOURS.setflags(write=False)
+
+
+class DashboardData:
+    """Chart data for the dashboard, indexed for constant-time lookups."""
+
+    def __init__(self, control_path: str = CONTROL_SPEEDS_PATH,
+                 treatment_path: str = TREATMENT_SPEEDS_PATH,
+                 speeds_dir: str = MAP_SPEEDS_DIR,
+                 segments_dir: str = MAP_SEGMENTS_DIR,
+                 store_dir: str = DASHBOARD_STORE_DIR,
+                 rollup_dir: Optional[str] = None):
+        self.control = HourlySpeedIndex(control_path)
+        self.treatment = HourlySpeedIndex(treatment_path)
+        self.catalog = RouteCatalog(os.path.join(store_dir, ROUTE_CATALOG_FILE))
+        self.map_speeds = MapSpeedStore(os.path.join(store_dir, MAP_SPEEDS_FILE))
+        self.segment_geometry = SegmentGeometryStore(os.path.join(store_dir, SEGMENT_GEOMETRY_FILE))
+        self.segment_hours = SegmentHourIndex(os.path.join(store_dir, SEGMENT_HOURS_FILE))
+        self.speeds_dir = speeds_dir
+        self.segments_dir = segments_dir
+        self.rollup_dir = rollup_dir
+        self._segment_cubes = {}
+        self._time_cubes = {}
+        self._rollup_versions = {}
+        self._speed_diffs = {}
+        self._geometries = {}
+        self._lock = threading.Lock()
+
+    def _route_file(self, files: dict, route_id: str, pattern: str, cls):
+        """Resolve a per-route file once; missing files are looked up again next time."""
+        if route_id not in files:
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                return None
+            with self._lock:
+                files.setdefault(route_id, cls(matches[0]))
+        return files[route_id]
+
+    def routes(self) -> Dict[str, str]:
+        """Display names of the available routes mapped to route IDs, featured routes first."""
+        catalog = self.catalog.get()
+        return FEATURED_ROUTES if catalog is None else catalog[1]
+
+    def route_info(self, route_id: str) -> Optional[pd.Series]:
+        """Catalog entry of a route, or None if there is no catalog or the route is not in it."""
+        catalog = self.catalog.get()
+        if catalog is None or route_id not in catalog[0].index:
+            return None
+        return catalog[0].loc[route_id]
+
+    def hourly_speeds(self, route_id: str, weekday: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Hourly average speeds before and after for one route and weekday.
+
+        :return: Two read-only arrays of 24 speeds (index = hour), NaN where missing.
+        """
+        control = self.control.get() or {}
+        treatment = self.treatment.get() or {}
+        return (control.get((route_id, weekday), EMPTY_HOURS),
+                treatment.get((route_id, weekday), EMPTY_HOURS))
+
+    def segment_hourly_speeds(self, route_id: str, prev_stop_id: int, stop_id: int,
+                              weekday: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Hourly average speeds before and after for one segment of a route and a weekday.
+
+        :return: Two arrays of 24 speeds (index = hour), NaN where missing.
+        """
+        store = self.segment_hours.get()
+        span = None if store is None else store[0].get((route_id, int(prev_stop_id), int(stop_id)))
+        if span is None:
+            return EMPTY_HOURS, EMPTY_HOURS
+        columns = store[1]
+        rows = np.arange(*span)
+        rows = rows[columns["weekday"][rows] == weekday]
+        before, after = np.full(HOURS, np.nan), np.full(HOURS, np.nan)
+        before[columns["hour"][rows]] = columns["before"][rows]
+        after[columns["hour"][rows]] = columns["after"][rows]
+        return before, after
+
+    def _speed_diff_file(self, route_id: str) -> Optional[SpeedDiffIndex]:
+        return self._route_file(self._speed_diffs, route_id,
+                                os.path.join(self.speeds_dir, f"*_{route_id}_speed_diff.parquet"),
+                                SpeedDiffIndex)
+
+    def _geometry_file(self, route_id: str) -> Optional[SegmentGeometryFile]:
+        return self._route_file(self._geometries, route_id,
+                                os.path.join(self.segments_dir, f"*_{route_id}_unique_segments.geojson"),
+                                SegmentGeometryFile)
+
+    def speed_diff(self, route_id: str, weekday: int, rush_hour: str) -> Optional[pd.DataFrame]:
+        """Segment speed differences for a route, weekday and rush period, or None if unavailable."""
+        store = self.map_speeds.get()
+        if store is not None:
+            return store.get((route_id, weekday, rush_hour))
+        index = self._speed_diff_file(route_id)
+        if index is None or index.get() is None:
+            return None
+        return index.get().get((weekday, rush_hour))
+
+    def _rollup_version(self, name: str, route_id: str) -> Optional[str]:
+        """Version of a route's rollup partitions, rescanned at most every `ROLLUP_VERSION_TTL` seconds."""
+        now = time.monotonic()
+        cached = self._rollup_versions.get((name, route_id))
+        if cached is not None and now < cached[0]:
+            return cached[1]
+
+        # Imported here so the rollup store's dependencies load only when a rollup view is drawn
+        from .rollups import ROLLUPS_DIR, rollup_version
+
+        version = rollup_version(name, route_id, self.rollup_dir or ROLLUPS_DIR)
+        self._rollup_versions[(name, route_id)] = (now + ROLLUP_VERSION_TTL, version)
+        return version
+
+    def _rollup_cube(self, cubes: dict, route_id: str, name: str, build):
+        """
+        Cube of a route's rollup, built on first use and rebuilt whenever the
+        route's partitions of the rollup change, e.g. when new dates are processed.
+        """
+        from .rollups import ROLLUPS_DIR
+
+        version = self._rollup_version(name, route_id)
+        cached = cubes.get(route_id)
+        if cached is None or cached[0] != version:
+            with self._lock:
+                cached = cubes.get(route_id)
+                if cached is None or cached[0] != version:
+                    cached = (version, build([route_id], self.rollup_dir or ROLLUPS_DIR))
+                    cubes[route_id] = cached
+        return cached[1]
+
+    def segment_cube(self, route_id: str):
+        """Prefix-sum cube of the route's segment rollups"""
+        from .rollups import SEGMENT_RUSH
+        from .segment_cube import SegmentSpeedCube
+
+        return self._rollup_cube(self._segment_cubes, route_id, SEGMENT_RUSH, SegmentSpeedCube.from_rollups)
+
+    def segment_rollup_version(self, route_id: str) -> Optional[str]:
+        """Version of the route's segment rollups, or None if it has none."""
+        from .rollups import SEGMENT_RUSH
+
+        return self._rollup_version(SEGMENT_RUSH, route_id)
+
+    def map_speed_diff(self, route_id: str, weekday: int, rush_hour: str) -> Optional[pd.DataFrame]:
+        """
+        Segment speed differences shown on the map: from the rollup cube when it has
+        data for the route, from the map speed files otherwise.
+        """
+        cube = self.segment_cube(route_id)
+        if len(cube.dates):
+            diff = cube.speed_diff(CONTROL_PERIOD, TREATMENT_PERIOD)
+            return diff[(diff["weekday"] == weekday) & (diff["rush_hour"] == rush_hour)]
+        return self.speed_diff(route_id, weekday, rush_hour)
+
+    def time_cube(self, route_id: str):
+        """15-minute time cube of the route's rollups"""
+        from .rollups import ROUTE_QUARTER_HOURLY
+        from .time_cube import TimeCube
+
+        return self._rollup_cube(self._time_cubes, route_id, ROUTE_QUARTER_HOURLY, TimeCube.from_rollups)
+
+    def time_rollup_version(self, route_id: str) -> Optional[str]:
+        """Version of the route's 15-minute rollups, or None if it has none."""
+        from .rollups import ROUTE_QUARTER_HOURLY
+
+        return self._rollup_version(ROUTE_QUARTER_HOURLY, route_id)
+
+    def period_speeds(self, route_id: str, days=None,
+                      resolution: str = "hour") -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Average speeds before and after per time bin, from the route's time cube.
+
+        :param route_id: Route ID.
+        :param days: Weekday number, "weekday", "weekend" or None for every day.
+        :param resolution: "quarter" (96 bins), "hour" (24) or "rush" (morning, evening, non-rush).
+        :return: Two arrays of speeds, NaN where missing, or None if there are no rollups for the route.
+        """
+        cube = self.time_cube(route_id)
+        if route_id not in cube:
+            return None
+        return (cube.speeds(route_id, *CONTROL_PERIOD, days, resolution),
+                cube.speeds(route_id, *TREATMENT_PERIOD, days, resolution))
+
+    def monthly_speeds(self, route_id: str, days=None,
+                       resolution: str = "rush") -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Average speeds per month and time bin, from the route's time cube.
+
+        :return: (months as YYYY-MM strings, array of shape (months, bins)), or None if
+                 there are no rollups for the route.
+        """
+        cube = self.time_cube(route_id)
+        if route_id not in cube:
+            return None
+        return cube.monthly_speeds(route_id, days, resolution)
+
+    def route_geometry(self, route_id: str) -> Optional[RouteGeometry]:
+        """Pre-projected segment geometry of a route, or None if unavailable."""
+        store = self.segment_geometry.get()
+        info = self.route_info(route_id)
+        if store is not None and info is not None:
+            return store.get(info["mdb_id"])
+        geometry = self._geometry_file(route_id)
+        return None if geometry is None else geometry.get()
+
+    def route_version(self, route_id: str) -> Tuple[Optional[str], Optional[str]]:
+        """Content versions of a route's speed difference and geometry files."""
+        if self.map_speeds.get() is not None and self.segment_geometry.get() is not None:
+            return self.map_speeds.digest, self.segment_geometry.digest
+        return tuple(
+            None if file is None else file.version
+            for file in (self._speed_diff_file(route_id), self._geometry_file(route_id))
+        )
+
+    def preload(self, route_ids: Iterable[str]) -> None:
+        """
+        Load the chart speeds, the dashboard store and each route's speed
+        differences and geometry, building any missing geometry caches so later
+        loads skip geopandas.
+        """
+        self.control.get()
+        self.treatment.get()
+        for store in (self.catalog, self.map_speeds, self.segment_geometry, self.segment_hours):
+            store.get()
+        for route_id in route_ids:
+            for file in (self._speed_diff_file(route_id), self._geometry_file(route_id)):
+                if file is not None:
+                    file.get()
+
+    @property
+    def version(self) -> Tuple[Optional[str], Optional[str]]:
+        """Content versions of the underlying files."""
+        return self.control.version, self.treatment.version
+
+    @property
+    def segment_hours_version(self) -> Optional[str]:
+        """Content version of the segment-hour store."""
+        return self.segment_hours.version
+
+
+_dashboard_data = None
+_dashboard_data_lock = threading.Lock()
+
+
+def get_dashboard_data() -> DashboardData:
+    """
+    Return the process-wide `DashboardData`, creating it on first use. When
+    `DASHBOARD_DATA_URL` is set, a client of that data service is returned instead.
+    """
+    global _dashboard_data
+    if _dashboard_data is None:
+        with _dashboard_data_lock:
+            if _dashboard_data is None:
+                url = os.environ.get(DATA_URL_ENV)
+                if url:
+                    from .data_client import DataServiceClient
+
+                    _dashboard_data = DataServiceClient(url)
+                else:
+                    _dashboard_data = DashboardData()
+    return _dashboard_data
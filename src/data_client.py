@@ -0,0 +1,181 @@
+"""
+Thin client of the dashboard data service (see `data_service.py`).
+
+`DataServiceClient` has the read interface of `DashboardData`, so the dashboard
+runs unchanged against a remote service when `DASHBOARD_DATA_URL` is set (see
+`dashboard_data.get_dashboard_data`). Every decoded response is kept with its
+ETag: after `revalidate_after` seconds the next access sends a conditional GET,
+and a 304 reuses the decoded value, so arrays and geometry are only decoded
+again when the data actually changed.
+"""
+import gzip
+import http.client
+import json
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+from .dashboard_data import EMPTY_HOURS
+from .geometry_cache import RouteGeometry, decode_polyline
+
+REVALIDATE_AFTER = 1.0
+
+
+def _hours(values) -> np.ndarray:
+    speeds = np.array([np.nan if v is None else v for v in values], dtype=float)
+    speeds.setflags(write=False)
+    return speeds
+
+
+def _geometry(payload: dict) -> RouteGeometry:
+    decoded = [decode_polyline(polyline) for polyline in payload["polyline"]]
+    counts = [len(lats) for lats, _ in decoded]
+    segments = pd.DataFrame({
+        column: payload[column] for column in ("prev_stop_id", "stop_id", "prev_stop_name", "stop_name")
+    })
+    return RouteGeometry(
+        segments,
+        np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        np.concatenate([lons for _, lons in decoded]) if decoded else np.array([]),
+        np.concatenate([lats for lats, _ in decoded]) if decoded else np.array([]),
+    )
+
+
+def _speed_diff(payload: dict) -> pd.DataFrame:
+    return pd.DataFrame({
+        "prev_stop_id": np.asarray(payload["prev_stop_id"], dtype=np.int64),
+        "stop_id": np.asarray(payload["stop_id"], dtype=np.int64),
+        "avg_speed_diff": np.array([np.nan if v is None else v for v in payload["avg_speed_diff"]], dtype=float),
+    })
+
+
+def _days(days) -> str:
+    return "all" if days is None else str(days)
+
+
+def _monthly(payload: dict) -> Tuple[np.ndarray, np.ndarray]:
+    months = np.array(payload["months"], dtype=object)
+    return months, np.array([_hours(row) for row in payload["speeds"]]).reshape(len(months), payload["bins"])
+
+
+class DataServiceClient:
+    """Read-only view of the dashboard data served by `data_service.py`."""
+
+    def __init__(self, base_url: str, timeout: float = 10.0, revalidate_after: float = REVALIDATE_AFTER):
+        url = urlsplit(base_url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.prefix = url.path.rstrip("/")
+        self.timeout = timeout
+        self.revalidate_after = revalidate_after
+        self.requests = 0
+        self.not_modified = 0
+        self._responses: Dict[str, Tuple[float, Optional[str], object]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        """Keep-alive connection of the calling thread."""
+        if getattr(self._local, "connection", None) is None:
+            self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._local.connection
+
+    def _request(self, path: str, etag: Optional[str]) -> Tuple[int, Optional[str], bytes]:
+        headers = {"Accept-Encoding": "gzip"}
+        if etag:
+            headers["If-None-Match"] = etag
+        for attempt in range(2):
+            connection = self._connection()
+            try:
+                connection.request("GET", self.prefix + path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed an idle keep-alive connection; reconnect once
+                connection.close()
+                self._local.connection = None
+                if attempt:
+                    raise
+        if response.getheader("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        return response.status, response.getheader("ETag"), body
+
+    def _get(self, path: str, convert: Callable[[dict], object] = lambda payload: payload):
+        """
+        Decoded response for a path, or None if the service returned 404.
+        A cached value is reused while fresh or after a 304 Not Modified.
+        """
+        with self._lock:
+            cached = self._responses.get(path)
+        now = time.monotonic()
+        if cached is not None and now - cached[0] < self.revalidate_after:
+            return cached[2]
+
+        status, etag, body = self._request(path, cached[1] if cached else None)
+        self.requests += 1
+        if status == 304 and cached is not None:
+            self.not_modified += 1
+            value = cached[2]
+        elif status == 404:
+            etag, value = None, None
+        elif status == 200:
+            value = convert(json.loads(body))
+        else:
+            raise RuntimeError(f"Data service returned {status} for {path}: {body[:200]!r}")
+
+        with self._lock:
+            self._responses[path] = (now, etag, value)
+        return value
+
+    def routes(self) -> Dict[str, str]:
+        return self._get("/routes")["routes"]
+
+    def hourly_speeds(self, route_id: str, weekday: int) -> Tuple[np.ndarray, np.ndarray]:
+        speeds = self._get(f"/routes/{route_id}/hourly/{weekday}",
+                           lambda payload: (_hours(payload["before"]), _hours(payload["after"])))
+        return speeds if speeds is not None else (EMPTY_HOURS, EMPTY_HOURS)
+
+    def map_speed_diff(self, route_id: str, weekday: int, rush_hour: str) -> Optional[pd.DataFrame]:
+        return self._get(f"/routes/{route_id}/speed-diff/{weekday}/{rush_hour}", _speed_diff)
+
+    speed_diff = map_speed_diff
+
+    def route_geometry(self, route_id: str) -> Optional[RouteGeometry]:
+        return self._get(f"/routes/{route_id}/geometry", _geometry)
+
+    def segment_hourly_speeds(self, route_id: str, prev_stop_id: int, stop_id: int,
+                              weekday: int) -> Tuple[np.ndarray, np.ndarray]:
+        speeds = self._get(f"/routes/{route_id}/segments/{int(prev_stop_id)}/{int(stop_id)}/hourly/{weekday}",
+                           lambda payload: (_hours(payload["before"]), _hours(payload["after"])))
+        return speeds if speeds is not None else (EMPTY_HOURS, EMPTY_HOURS)
+
+    def period_speeds(self, route_id: str, days=None,
+                      resolution: str = "hour") -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        return self._get(f"/routes/{route_id}/periods/{_days(days)}/{resolution}",
+                         lambda payload: (_hours(payload["before"]), _hours(payload["after"])))
+
+    def monthly_speeds(self, route_id: str, days=None,
+                       resolution: str = "rush") -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        return self._get(f"/routes/{route_id}/monthly/{_days(days)}/{resolution}", _monthly)
+
+    def route_version(self, route_id: str) -> Tuple[Optional[str], Optional[str]]:
+        return tuple(self._get(f"/routes/{route_id}/version")["map"])
+
+    def segment_rollup_version(self, route_id: str) -> Optional[str]:
+        return self._get(f"/routes/{route_id}/version")["segment_rollups"]
+
+    def time_rollup_version(self, route_id: str) -> Optional[str]:
+        return self._get(f"/routes/{route_id}/version")["time_rollups"]
+
+    @property
+    def version(self) -> Tuple[Optional[str], Optional[str]]:
+        return tuple(self._get("/version")["chart"])
+
+    @property
+    def segment_hours_version(self) -> Optional[str]:
+        return self._get("/version")["segment_hours"]
@@ -0,0 +1,291 @@
+"""
+Read-only HTTP service for the precomputed dashboard data.
+
+Several dashboard replicas can share one copy of `data/` by reading it through
+this service instead of the local files (see `data_client.py`). Every response
+is JSON, built once from `DashboardData` and kept in an in-process LRU keyed by
+request path and the content version of the files behind it, so repeated
+requests only cost a dictionary lookup. Responses carry a weak ETag and honour
+If-None-Match with 304 Not Modified; bodies are sent gzip (or brotli, when the
+`brotli` package is installed) compressed when the client accepts it.
+
+Endpoints:
+    GET /version                                   chart and segment-hour data versions
+    GET /routes                                    route display names mapped to route IDs
+    GET /routes/{route_id}/version                 map and rollup data versions of a route
+    GET /routes/{route_id}/hourly/{weekday}        chart speeds before and after
+    GET /routes/{route_id}/speed-diff/{weekday}/{rush_hour}
+                                                   map segment speed differences
+    GET /routes/{route_id}/geometry                encoded polylines of the route's segments
+    GET /routes/{route_id}/segments/{prev_stop_id}/{stop_id}/hourly/{weekday}
+                                                   segment speeds before and after
+    GET /routes/{route_id}/periods/{days}/{resolution}
+                                                   time cube speeds before and after
+    GET /routes/{route_id}/monthly/{days}/{resolution}
+                                                   time cube speeds per month
+
+{days} is a weekday number, `weekday`, `weekend` or `all`; {resolution} is
+`quarter`, `hour` or `rush`.
+"""
+import gzip
+import hashlib
+import json
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from .dashboard_app import RUSH_HOURS
+from .dashboard_data import DashboardData
+from .figure_cache import FigureCache
+from .geometry_cache import encode_polyline
+from .time_cube import DAY_TYPES, RESOLUTIONS
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DATA_SERVICE_PORT = 8600
+RESPONSE_CACHE_SIZE = 1024
+
+
+class Response(NamedTuple):
+    """A cached response body in each content encoding, with its ETag."""
+    etag: str
+    body: bytes
+    encoded: Dict[str, bytes]
+
+
+class NotFound(Exception):
+    pass
+
+
+def _floats(values: np.ndarray) -> List[Optional[float]]:
+    """Floats for JSON, mapping NaN to null."""
+    return [None if np.isnan(v) else v for v in np.asarray(values, dtype=float).tolist()]
+
+
+def _weekday(value: str) -> int:
+    weekday = int(value)
+    if not 0 <= weekday <= 6:
+        raise NotFound(f"Unknown weekday {value}")
+    return weekday
+
+
+def _days(value: str):
+    """Day selection of a time cube query: a weekday number, a day type or None for all days."""
+    if value == "all":
+        return None
+    if value in DAY_TYPES:
+        return value
+    return _weekday(value)
+
+
+def _resolution(value: str) -> str:
+    if value not in RESOLUTIONS:
+        raise NotFound(f"Unknown resolution {value}")
+    return value
+
+
+class DataService:
+    """Resolves request paths to JSON responses, caching them by data version."""
+
+    def __init__(self, data: Optional[DashboardData] = None, cache_size: int = RESPONSE_CACHE_SIZE):
+        self.data = data or DashboardData()
+        self.cache = FigureCache(cache_size)
+        self._routes = [
+            (re.compile(r"^/version$"), self.version),
+            (re.compile(r"^/routes$"), self.routes),
+            (re.compile(r"^/routes/([^/]+)/version$"), self.route_version),
+            (re.compile(r"^/routes/([^/]+)/hourly/(\d+)$"), self.hourly),
+            (re.compile(r"^/routes/([^/]+)/speed-diff/(\d+)/([a-z_]+)$"), self.speed_diff),
+            (re.compile(r"^/routes/([^/]+)/geometry$"), self.geometry),
+            (re.compile(r"^/routes/([^/]+)/segments/(\d+)/(\d+)/hourly/(\d+)$"), self.segment_hourly),
+            (re.compile(r"^/routes/([^/]+)/periods/([a-z0-9]+)/([a-z]+)$"), self.periods),
+            (re.compile(r"^/routes/([^/]+)/monthly/([a-z0-9]+)/([a-z]+)$"), self.monthly),
+        ]
+
+    def version(self) -> dict:
+        return {"chart": list(self.data.version), "segment_hours": self.data.segment_hours_version}
+
+    def routes(self) -> dict:
+        return {"routes": self.data.routes()}
+
+    def route_version(self, route_id: str) -> dict:
+        return {"map": list(self.data.route_version(route_id)),
+                "segment_rollups": self.data.segment_rollup_version(route_id),
+                "time_rollups": self.data.time_rollup_version(route_id)}
+
+    def hourly(self, route_id: str, weekday: str) -> dict:
+        before, after = self.data.hourly_speeds(route_id, _weekday(weekday))
+        return {"before": _floats(before), "after": _floats(after)}
+
+    def speed_diff(self, route_id: str, weekday: str, rush_hour: str) -> dict:
+        if rush_hour not in RUSH_HOURS.values():
+            raise NotFound(f"Unknown rush period {rush_hour}")
+        diff = self.data.map_speed_diff(route_id, _weekday(weekday), rush_hour)
+        if diff is None or diff.empty:
+            raise NotFound(f"No speed differences for {route_id}")
+        return {
+            "prev_stop_id": diff["prev_stop_id"].astype(int).tolist(),
+            "stop_id": diff["stop_id"].astype(int).tolist(),
+            "avg_speed_diff": _floats(diff["avg_speed_diff"]),
+        }
+
+    def geometry(self, route_id: str) -> dict:
+        geometry = self.data.route_geometry(route_id)
+        if geometry is None:
+            raise NotFound(f"No segment geometry for {route_id}")
+
+        # Segment files cover a whole feed; keep the segments the route's maps use
+        rows = [
+            geometry.join(diff)["row"].to_numpy()
+            for weekday in range(7) for rush_hour in RUSH_HOURS.values()
+            for diff in [self.data.map_speed_diff(route_id, weekday, rush_hour)]
+            if diff is not None and not diff.empty
+        ]
+        rows = np.unique(np.concatenate(rows)) if rows else np.arange(len(geometry))
+        segments = geometry.segments.iloc[rows]
+        offsets = geometry.offsets
+        return {
+            "prev_stop_id": segments["prev_stop_id"].astype(int).tolist(),
+            "stop_id": segments["stop_id"].astype(int).tolist(),
+            "prev_stop_name": segments["prev_stop_name"].astype(str).tolist(),
+            "stop_name": segments["stop_name"].astype(str).tolist(),
+            "polyline": [
+                encode_polyline(geometry.lats[offsets[row]:offsets[row + 1]],
+                                geometry.lons[offsets[row]:offsets[row + 1]])
+                for row in rows
+            ],
+        }
+
+    def segment_hourly(self, route_id: str, prev_stop_id: str, stop_id: str, weekday: str) -> dict:
+        before, after = self.data.segment_hourly_speeds(route_id, int(prev_stop_id), int(stop_id),
+                                                        _weekday(weekday))
+        return {"before": _floats(before), "after": _floats(after)}
+
+    def periods(self, route_id: str, days: str, resolution: str) -> dict:
+        speeds = self.data.period_speeds(route_id, _days(days), _resolution(resolution))
+        if speeds is None:
+            raise NotFound(f"No rollups for {route_id}")
+        return {"before": _floats(speeds[0]), "after": _floats(speeds[1])}
+
+    def monthly(self, route_id: str, days: str, resolution: str) -> dict:
+        speeds = self.data.monthly_speeds(route_id, _days(days), _resolution(resolution))
+        if speeds is None:
+            raise NotFound(f"No rollups for {route_id}")
+        months, monthly = speeds
+        return {"months": list(months), "bins": monthly.shape[1], "speeds": [_floats(row) for row in monthly]}
+
+    def _resolve(self, path: str):
+        for pattern, handler in self._routes:
+            match = pattern.match(path)
+            if match:
+                return handler, match.groups()
+        raise NotFound(f"Unknown path {path}")
+
+    def _data_version(self, args: tuple) -> tuple:
+        """Versions of every file a response may depend on."""
+        if not args:
+            return self.data.version, self.data.segment_hours_version
+        route_id = args[0]
+        return (self.data.version, self.data.segment_hours_version,
+                self.data.route_version(route_id), self.data.segment_rollup_version(route_id),
+                self.data.time_rollup_version(route_id))
+
+    def response(self, path: str) -> Response:
+        """
+        Cached response for a request path.
+
+        :raises NotFound: If the path or the data it names does not exist.
+        """
+        handler, args = self._resolve(path)
+        key = (path, self._data_version(args))
+        return self.cache.get_or_build(key, lambda: self._build(handler, args))
+
+    @staticmethod
+    def _build(handler: Callable[..., dict], args: tuple) -> Response:
+        body = json.dumps(handler(*args), separators=(",", ":")).encode()
+        encoded = {"gzip": gzip.compress(body, compresslevel=6)}
+        if brotli is not None:
+            encoded["br"] = brotli.compress(body)
+        return Response(f'W/"{hashlib.sha256(body).hexdigest()[:32]}"', body, encoded)
+
+
+def _accepted_encoding(header: str, available: Dict[str, bytes]) -> Optional[str]:
+    """Preferred content encoding accepted by the client, or None for identity."""
+    accepted = {part.split(";")[0].strip() for part in header.split(",")}
+    for encoding in ("br", "gzip"):
+        if encoding in accepted and encoding in available:
+            return encoding
+    return None
+
+
+class DataServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; without TCP_NODELAY keep-alive requests stall on delayed ACKs
+    disable_nagle_algorithm = True
+    service: DataService = None
+    quiet = True
+
+    def do_GET(self):
+        try:
+            response = self.service.response(self.path.split("?", 1)[0].rstrip("/") or "/")
+        except (NotFound, ValueError) as e:
+            self._send_error(404, str(e))
+            return
+        except Exception as e:
+            self._send_error(500, str(e))
+            return
+
+        etags = {tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")}
+        if response.etag in etags or "*" in etags:
+            self.send_response(304)
+            self.send_header("ETag", response.etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        encoding = _accepted_encoding(self.headers.get("Accept-Encoding", ""), response.encoded)
+        body = response.encoded[encoding] if encoding else response.body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("ETag", response.etag)
+        self.send_header("Vary", "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str):
+        body = json.dumps({"error": message}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(host: str = "127.0.0.1", port: int = DATA_SERVICE_PORT,
+                service: Optional[DataService] = None, quiet: bool = True) -> ThreadingHTTPServer:
+    """
+    Create a threaded HTTP server for the data service; call `serve_forever()` to run it.
+
+    :param host: Interface to bind.
+    :param port: Port to listen on (0 picks a free port).
+    :param service: (Optional) DataService to serve (default: one over the local `data/` directory).
+    :param quiet: Suppress per-request access logs.
+    """
+    handler = type("BoundDataServiceHandler", (DataServiceHandler,),
+                   {"service": service or DataService(), "quiet": quiet})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
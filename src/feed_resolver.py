@@ -0,0 +1,262 @@
+"""
+Resolution of the GTFS feed version that applies to a processed date.
+
+Feed versions (e.g. `mdb-513-202412120015.zip` from the Mobility Database) are
+cached in `data/feeds/`. `FeedResolver` keeps a validity index of every cached
+version in `data/feed-index/`: the service IDs active on each date, from
+`calendar.txt` and `calendar_dates.txt`, and the service ID of every trip in
+`trips.txt`. An index is rebuilt only when its zip changes, so loading the index
+of all versions takes well under a second.
+
+For a date and a sample of realtime trip IDs, every version is scored by the
+share of sampled trips that it schedules on that date: the trip is in its
+`trips.txt` and the trip's service is active. This is the share that survives the
+`trips.txt` merge of `BusSpeedCalculator`. Ties, and dates without realtime data,
+go to the version that is active on the date and whose service starts latest,
+i.e. the newest. Scoring is a dictionary lookup per sampled trip and version,
+so resolving a date takes milliseconds.
+
+A date already processed with one version keeps it while that version still
+matches the date well (`prefer`), even if a newer version also schedules it.
+Outputs are partitioned by feed ID and summed across feeds, so a processed date
+that does move must have the old version's outputs removed (`runner.py` does),
+or it would be counted under both versions.
+"""
+import json
+import os
+import zipfile
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, List, NamedTuple, Optional
+
+import pandas as pd
+
+from .raw_speeds import atomic_output
+from .storage import LocalStorage, Storage, split_uri
+
+FEEDS_DIR = "data/feeds"
+FEED_INDEX_DIR = "data/feed-index"
+INDEX_FORMAT = 1
+TRIP_SAMPLE_SIZE = 500
+# Below this share of matched trips a resolution is reported as doubtful
+MIN_MATCH_SCORE = 0.5
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+
+class Resolution(NamedTuple):
+    feed_version: str
+    path: str
+    score: float    # share of the sampled trips scheduled by the version on the date
+    matched: int
+    sampled: int
+    active: bool    # whether any service of the version runs on the date
+
+
+def _date_key(date: str) -> int:
+    """YYYY-MM-DD (or YYYYMMDD) as the integer YYYYMMDD used by GTFS calendars."""
+    return int(date.replace("-", ""))
+
+
+def _read_txt(feed: zipfile.ZipFile, name: str, columns: List[str]) -> Optional[pd.DataFrame]:
+    if name not in feed.namelist():
+        return None
+    with feed.open(name) as f:
+        df = pd.read_csv(f, dtype=str, skipinitialspace=True)
+    df.columns = df.columns.str.strip()
+    return df[[col for col in columns if col in df.columns]]
+
+
+def service_dates(calendar: Optional[pd.DataFrame], calendar_dates: Optional[pd.DataFrame]) -> Dict[str, List[int]]:
+    """
+    Expand `calendar.txt` and `calendar_dates.txt` into the dates of every service.
+
+    :param calendar: calendar.txt (weekday flags and start/end dates), or None.
+    :param calendar_dates: calendar_dates.txt (added and removed dates), or None.
+    :return: Sorted YYYYMMDD dates per service ID.
+    """
+    dates = defaultdict(set)
+    if calendar is not None:
+        for row in calendar.itertuples(index=False):
+            days = pd.date_range(str(row.start_date), str(row.end_date))
+            flags = [str(getattr(row, day)).strip() == "1" for day in WEEKDAYS]
+            runs = [flags[weekday] for weekday in days.weekday]
+            dates[row.service_id].update(days[runs].strftime("%Y%m%d").astype(int).tolist())
+    if calendar_dates is not None:
+        for row in calendar_dates.itertuples(index=False):
+            if str(row.exception_type).strip() == "1":
+                dates[row.service_id].add(int(row.date))
+            elif str(row.exception_type).strip() == "2":
+                dates[row.service_id].discard(int(row.date))
+    return {service_id: sorted(days) for service_id, days in dates.items()}
+
+
+class FeedVersion:
+    """Validity index of one cached feed version: services per date and the service of every trip."""
+
+    def __init__(self, feed_version: str, path: str, services: Dict[str, List[int]],
+                 trips: Dict[str, List[str]]):
+        """
+        Parameters:
+        feed_version (str): Name of the version, e.g. mdb-513-202412120015.
+        path (str): Path of the feed zip.
+        services (Dict[str, List[int]]): YYYYMMDD dates per service ID.
+        trips (Dict[str, List[str]]): Trip IDs per service ID.
+        """
+        self.feed_version = feed_version
+        self.path = path
+        self.services = services
+        self.trips = trips
+        date_services = defaultdict(set)
+        for service_id, days in services.items():
+            for day in days:
+                date_services[day].add(service_id)
+        self.date_services: Dict[int, FrozenSet[str]] = {day: frozenset(ids) for day, ids in date_services.items()}
+        self.trip_services = {trip_id: service_id for service_id, trip_ids in trips.items() for trip_id in trip_ids}
+        self.first_date = min(self.date_services, default=None)
+        self.last_date = max(self.date_services, default=None)
+
+    @classmethod
+    def from_zip(cls, path: str) -> "FeedVersion":
+        """Index a GTFS zip, reading only its calendar files and the trip and service IDs of trips.txt."""
+        with zipfile.ZipFile(path) as feed:
+            calendar = _read_txt(feed, "calendar.txt", ["service_id", *WEEKDAYS, "start_date", "end_date"])
+            calendar_dates = _read_txt(feed, "calendar_dates.txt", ["service_id", "date", "exception_type"])
+            trips = _read_txt(feed, "trips.txt", ["trip_id", "service_id"])
+        trips = {} if trips is None else trips.groupby("service_id")["trip_id"].agg(list).to_dict()
+        name = os.path.splitext(os.path.basename(path))[0]
+        return cls(name, path, service_dates(calendar, calendar_dates), trips)
+
+    def match(self, date: str, trip_ids: Iterable[str]) -> Resolution:
+        """Score the version for a date against a sample of realtime trip IDs."""
+        active = self.date_services.get(_date_key(date), frozenset())
+        trip_ids = list(trip_ids)
+        matched = sum(1 for trip_id in trip_ids if self.trip_services.get(trip_id) in active)
+        score = matched / len(trip_ids) if trip_ids else 0.0
+        return Resolution(self.feed_version, self.path, score, matched, len(trip_ids), bool(active))
+
+
+class FeedResolver:
+    """Picks the cached feed version that best matches a date and its realtime trips."""
+
+    def __init__(self, feeds_dir: str = FEEDS_DIR, index_dir: str = FEED_INDEX_DIR):
+        """
+        Parameters:
+        feeds_dir (str): Directory of the cached feed zips.
+        index_dir (str): Directory of the per-version validity indexes.
+        """
+        self.feeds_dir = feeds_dir
+        self.index_dir = index_dir
+        self.feeds: Dict[str, FeedVersion] = {}
+
+    def _load(self, path: str) -> FeedVersion:
+        info = os.stat(path)
+        name = os.path.splitext(os.path.basename(path))[0]
+        index_path = os.path.join(self.index_dir, f"{name}.json")
+        try:
+            with open(index_path) as f:
+                record = json.load(f)
+            if (record["format"], record["size"], record["mtime"]) == (INDEX_FORMAT, info.st_size, info.st_mtime):
+                return FeedVersion(name, path, record["services"], record["trips"])
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            pass
+
+        feed = FeedVersion.from_zip(path)
+        record = {"format": INDEX_FORMAT, "size": info.st_size, "mtime": info.st_mtime,
+                  "services": feed.services, "trips": feed.trips}
+        with atomic_output(index_path) as temp_path:
+            with open(temp_path, "w") as f:
+                json.dump(record, f)
+        return feed
+
+    def refresh(self) -> int:
+        """Load the index of every cached version, (re)building those whose zip is new or changed."""
+        names = sorted(name for name in os.listdir(self.feeds_dir) if name.endswith(".zip")) \
+            if os.path.isdir(self.feeds_dir) else []
+        feeds = {}
+        for name in names:
+            try:
+                feed = self._load(os.path.join(self.feeds_dir, name))
+            except (zipfile.BadZipFile, ValueError, KeyError) as e:
+                print(f"Error indexing feed {name}: {e}")
+                continue
+            feeds[feed.feed_version] = feed
+        self.feeds = feeds
+        return len(feeds)
+
+    def candidates(self, date: str, trip_ids: Iterable[str] = ()) -> List[Resolution]:
+        """Every cached version scored for a date, best first."""
+        trip_ids = list(trip_ids)
+        scored = [(feed.match(date, trip_ids), feed.first_date or 0) for feed in self.feeds.values()]
+        scored.sort(key=lambda item: (item[0].score, item[0].active, item[1]), reverse=True)
+        return [resolution for resolution, _ in scored]
+
+    def resolve(self, date: str, trip_ids: Iterable[str] = (),
+                prefer: Iterable[str] = ()) -> Optional[Resolution]:
+        """
+        Best feed version for a date.
+
+        Parameters:
+        date (str): Processed date (YYYY-MM-DD).
+        trip_ids (Iterable[str]): Sample of the realtime trip IDs of the date; may be empty.
+        prefer (Iterable[str]): Versions to keep if they still match the date (at least
+            `MIN_MATCH_SCORE` of the sampled trips, or active without a sample), e.g.
+            the versions the date was already processed with.
+
+        Returns:
+        Optional[Resolution]: The best version, or None if no version matches a sampled
+            trip or, without a sample, none is active on the date.
+        """
+        candidates = self.candidates(date, trip_ids)
+        prefer = set(prefer)
+        for candidate in candidates:
+            if candidate.feed_version in prefer and (
+                    candidate.score >= MIN_MATCH_SCORE if candidate.sampled else candidate.active):
+                return candidate
+        if not candidates or not (candidates[0].matched or (candidates[0].active and not candidates[0].sampled)):
+            return None
+        return candidates[0]
+
+
+def sample_trip_ids(storage: Storage, prefix: str, vehicle_format: str = "parquet",
+                    size: int = TRIP_SAMPLE_SIZE) -> List[str]:
+    """
+    Sample the realtime trip IDs of a date from its middle file (or snapshot), around
+    midday when most trips run.
+
+    :param storage: Storage of the vehicle positions.
+    :param prefix: Key prefix of the date, e.g. `{prefix}date=2025-01-15/`.
+    :param vehicle_format: "parquet" (normalized positions) or "protobuf" (raw GTFS-rt snapshots).
+    :param size: Maximum number of distinct trip IDs.
+    :return: Distinct trip IDs, empty if the date has no data.
+    """
+    suffixes = (".pb", ".pb.gz") if vehicle_format == "protobuf" else (".parquet",)
+    keys = sorted(key for key in storage.list(prefix) if key.endswith(suffixes))
+    if not keys:
+        return []
+    key = keys[len(keys) // 2]
+    if vehicle_format == "protobuf":
+        from .gtfs_rt import decode_snapshot
+        trip_ids = pd.Series(decode_snapshot(storage.read(key))["trip.trip_id"], dtype=object)
+    else:
+        trip_ids = storage.read_parquet(key, columns=["trip.trip_id"])[0]["trip.trip_id"]
+    trip_ids = trip_ids.dropna().astype(str).drop_duplicates()
+    return trip_ids.sample(min(size, len(trip_ids)), random_state=0).tolist()
+
+
+def cache_feed(url: str, feeds_dir: str = FEEDS_DIR) -> str:
+    """
+    Copy a feed zip (URL, S3 URI or local path) into the feed cache, unless it is
+    already there.
+
+    :return: Path of the cached zip, named after the last part of the URL.
+    """
+    source, key = split_uri(url)
+    name = os.path.basename(key)
+    cache = LocalStorage(feeds_dir)
+    path = os.path.join(feeds_dir, name)
+    if not os.path.exists(path):
+        stream = source.open(key)
+        try:
+            cache.write(name, stream)
+        finally:
+            stream.close()
+    return path
@@ -0,0 +1,82 @@
+"""
+Process-wide LRU cache of serialized dashboard figures.
+
+The dashboard has a small, fixed space of selections (route, weekday, rush
+period, colour mode, theme), so finished figures are kept as Plotly JSON specs
+keyed by the selection and the version of the data they were built from. The
+cache is shared by every session of the Streamlit server; a figure requested
+by several viewers at once is built only once while the others wait for it.
+"""
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+FIGURE_CACHE_SIZE = 512
+
+
+class FigureCache:
+    """Thread-safe, bounded LRU cache with single-flight builds."""
+
+    def __init__(self, maxsize: int = FIGURE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get_or_build(self, key: Hashable, build: Callable[[], object]):
+        """
+        Return the cached value for `key`, calling `build()` on a miss.
+
+        :param key: Hashable selection tuple, including the data version.
+        :param build: Builds the value to cache, e.g. a figure's JSON spec.
+        :return: The cached or newly built value.
+        """
+        while True:
+            with self._lock:
+                if key in self._items:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return self._items[key]
+                pending = self._building.get(key)
+                if pending is None:
+                    pending = self._building[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Another thread is building this key; wait and look again
+            pending.wait()
+
+        try:
+            value = build()
+            with self._lock:
+                self._items[key] = value
+                self._items.move_to_end(key)
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                del self._building[key]
+            pending.set()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+_figure_cache: Optional[FigureCache] = None
+_figure_cache_lock = threading.Lock()
+
+
+def get_figure_cache() -> FigureCache:
+    """Return the process-wide `FigureCache`, creating it on first use."""
+    global _figure_cache
+    if _figure_cache is None:
+        with _figure_cache_lock:
+            if _figure_cache is None:
+                _figure_cache = FigureCache()
+    return _figure_cache
@@ -0,0 +1,226 @@
+"""
+Pre-projected, simplified segment geometry for the dashboard map.
+
+`RouteGeometry` holds every segment of a route as WGS84 coordinates in flat
+arrays, keyed by (prev_stop_id, stop_id):
+
+    lons[offsets[i]:offsets[i + 1]], lats[offsets[i]:offsets[i + 1]]
+
+are the coordinates of segment i. Geometries are simplified in the source
+projected CRS (EPSG:2263, feet) before reprojection, so no simplified line
+deviates from the original by more than the tolerance.
+
+Built geometry is also saved as a `.npz` file next to a hash of its source
+GeoJSON. Later processes load the arrays directly and do not need geopandas.
+Segments are sent to browsers and dashboard clients as encoded polylines
+(`encode_polyline` / `decode_polyline`).
+"""
+import os
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Maximum deviation from the original line, in feet (EPSG:2263 units)
+SIMPLIFY_TOLERANCE_FT = 3.0
+SOURCE_CRS = 2263
+GEOMETRY_CACHE_DIR = "data/map-geometry"
+
+SEGMENT_KEYS = ["prev_stop_id", "stop_id"]
+ATTRIBUTE_COLUMNS = ["prev_stop_id", "stop_id", "prev_stop_name", "stop_name"]
+
+
+class RouteGeometry:
+    """WGS84 segment coordinates of one route in flat arrays."""
+
+    def __init__(self, segments: pd.DataFrame, offsets: np.ndarray, lons: np.ndarray, lats: np.ndarray):
+        """
+        Parameters:
+        segments (pd.DataFrame): prev_stop_id, stop_id, prev_stop_name, stop_name per segment.
+        offsets (np.ndarray): len(segments) + 1 start offsets into lons/lats.
+        lons (np.ndarray): Flat longitudes of all segments.
+        lats (np.ndarray): Flat latitudes of all segments.
+        """
+        self.segments = segments.reset_index(drop=True)
+        self.segments["row"] = np.arange(len(self.segments))
+        self.offsets = offsets
+        self.lons = lons
+        self.lats = lats
+        self._rows = {
+            key: row for row, key in enumerate(zip(self.segments["prev_stop_id"], self.segments["stop_id"]))
+        }
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    @classmethod
+    def from_geojson(cls, path: str, tolerance: float = SIMPLIFY_TOLERANCE_FT) -> "RouteGeometry":
+        """Read, simplify and reproject a `*_unique_segments.geojson` file."""
+        import geopandas as gpd
+        import shapely
+
+        segments = gpd.read_file(path)
+        if segments.crs is None:
+            segments = segments.set_crs(epsg=SOURCE_CRS)
+        # The tolerance is in feet, so simplify in the projected CRS whatever the file's CRS
+        segments = segments.to_crs(epsg=SOURCE_CRS)
+        segments = segments.drop_duplicates(SEGMENT_KEYS).reset_index(drop=True)
+        segments["geometry"] = segments.geometry.simplify(tolerance, preserve_topology=False)
+        segments = segments.to_crs(epsg=4326)
+
+        coords, index = shapely.get_coordinates(segments.geometry.values, return_index=True)
+        counts = np.bincount(index, minlength=len(segments))
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        return cls(segments[ATTRIBUTE_COLUMNS], offsets, coords[:, 0].copy(), coords[:, 1].copy())
+
+    def save(self, path: str, source_digest: str, tolerance: float) -> None:
+        """Save the arrays to an `.npz` file tagged with the source digest and tolerance."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            prev_stop_id=self.segments["prev_stop_id"].to_numpy(),
+            stop_id=self.segments["stop_id"].to_numpy(),
+            prev_stop_name=self.segments["prev_stop_name"].to_numpy(dtype=str),
+            stop_name=self.segments["stop_name"].to_numpy(dtype=str),
+            offsets=self.offsets,
+            lons=self.lons,
+            lats=self.lats,
+            source_digest=np.array(source_digest),
+            tolerance=np.array(tolerance),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, source_digest: str, tolerance: float) -> Optional["RouteGeometry"]:
+        """Load an `.npz` cache, or return None if it is missing or stale."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle=False) as arrays:
+            if str(arrays["source_digest"]) != source_digest or float(arrays["tolerance"]) != tolerance:
+                return None
+            segments = pd.DataFrame({col: arrays[col] for col in ATTRIBUTE_COLUMNS})
+            return cls(segments, arrays["offsets"], arrays["lons"], arrays["lats"])
+
+    def coords(self, prev_stop_id: int, stop_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Longitudes and latitudes of one segment."""
+        row = self._rows[(prev_stop_id, stop_id)]
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self.lons[start:end], self.lats[start:end]
+
+    def join(self, speeds: pd.DataFrame) -> pd.DataFrame:
+        """
+        Inner-join per-segment values with the geometry.
+
+        :param speeds: DataFrame with prev_stop_id and stop_id columns.
+        :return: The matched rows with stop names and a `row` column indexing
+                 `offsets` for each segment's coordinates.
+        """
+        return speeds.merge(self.segments, on=SEGMENT_KEYS, how="inner")
+
+
+def cache_path(geojson_path: str, cache_dir: str = GEOMETRY_CACHE_DIR) -> str:
+    """Path of the `.npz` cache for a segment GeoJSON file."""
+    name = os.path.splitext(os.path.basename(geojson_path))[0]
+    return os.path.join(cache_dir, f"{name}.npz")
+
+
+def load_route_geometry(geojson_path: str, source_digest: str,
+                        tolerance: float = SIMPLIFY_TOLERANCE_FT,
+                        cache_dir: str = GEOMETRY_CACHE_DIR) -> RouteGeometry:
+    """
+    Load route geometry from its `.npz` cache, rebuilding the cache from the
+    GeoJSON when it is missing or out of date. A read-only data directory only
+    costs the rebuild; the cache write is skipped.
+    """
+    path = cache_path(geojson_path, cache_dir)
+    geometry = RouteGeometry.load(path, source_digest, tolerance)
+    if geometry is None:
+        geometry = RouteGeometry.from_geojson(geojson_path, tolerance)
+        try:
+            geometry.save(path, source_digest, tolerance)
+        except OSError:
+            pass
+    return geometry
+
+
+def save_segment_store(geometries: Dict[str, RouteGeometry], path: str) -> None:
+    """
+    Save the geometry of several feeds to one `.npz` file.
+
+    :param geometries: RouteGeometry per feed (Mobility Database ID).
+    :param path: Output path.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    feed_ids = sorted(geometries)
+    parts = [geometries[feed_id] for feed_id in feed_ids]
+    segment_counts = [len(part) for part in parts]
+    coord_starts = np.cumsum([0] + [len(part.lons) for part in parts])[:-1]
+    segments = pd.concat([part.segments[ATTRIBUTE_COLUMNS] for part in parts], ignore_index=True)
+
+    tmp_path = f"{path}.tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        feed_ids=np.array(feed_ids, dtype=str),
+        feed_offsets=np.cumsum([0] + segment_counts),
+        prev_stop_id=segments["prev_stop_id"].to_numpy(),
+        stop_id=segments["stop_id"].to_numpy(),
+        prev_stop_name=segments["prev_stop_name"].to_numpy(dtype=str),
+        stop_name=segments["stop_name"].to_numpy(dtype=str),
+        offsets=np.concatenate(
+            [part.offsets[:-1] + start for part, start in zip(parts, coord_starts)]
+            + [[sum(len(part.lons) for part in parts)]]
+        ),
+        lons=np.concatenate([part.lons for part in parts]) if parts else np.array([]),
+        lats=np.concatenate([part.lats for part in parts]) if parts else np.array([]),
+    )
+    os.replace(tmp_path, path)
+
+
+def load_segment_store(path: str) -> Dict[str, RouteGeometry]:
+    """Load a file written by `save_segment_store` into a RouteGeometry per feed."""
+    with np.load(path, allow_pickle=False) as arrays:
+        arrays = dict(arrays)
+    geometries = {}
+    feed_offsets = arrays["feed_offsets"]
+    for i, feed_id in enumerate(arrays["feed_ids"]):
+        first, last = feed_offsets[i], feed_offsets[i + 1]
+        segments = pd.DataFrame({col: arrays[col][first:last] for col in ATTRIBUTE_COLUMNS})
+        offsets = arrays["offsets"][first:last + 1]
+        start, end = offsets[0], offsets[-1]
+        geometries[str(feed_id)] = RouteGeometry(segments, offsets - start,
+                                                 arrays["lons"][start:end], arrays["lats"][start:end])
+    return geometries
+
+
+POLYLINE_PRECISION = 5
+
+
+def encode_polyline(lats: np.ndarray, lons: np.ndarray, precision: int = POLYLINE_PRECISION) -> str:
+    """Encode coordinates with the Google encoded polyline algorithm."""
+    points = np.rint(np.column_stack([lats, lons]) * 10 ** precision).astype(np.int64)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    zigzag = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+
+    chars = []
+    for value in zigzag.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def decode_polyline(encoded: str, precision: int = POLYLINE_PRECISION) -> Tuple[np.ndarray, np.ndarray]:
+    """Decode a Google encoded polyline into (lats, lons) arrays."""
+    values = []
+    value = shift = 0
+    for char in encoded:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1F) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    points = np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10 ** precision
+    return points[:, 0], points[:, 1]
@@ -0,0 +1,179 @@
+"""
+Ingestion of raw GTFS-realtime VehiclePositions snapshots.
+
+Directories of `.pb` (or `.pb.gz`) FeedMessage files are decoded in parallel
+worker processes, one chunk of snapshots per task, into Arrow record batches
+with the columns of the normalized vehicle-position parquet (`id`,
+`trip.route_id`, `position.latitude`, ...), so `BusSpeedCalculator` takes them
+unchanged and no separate normalization job is needed.
+
+Consecutive snapshots repeat every vehicle that has not reported since, so rows
+are de-duplicated on the fly: each chunk drops its repeated (vehicle, timestamp)
+rows, and as chunks are consumed in key (time) order a vehicle's row is kept only
+if its timestamp is newer than the last one kept for that vehicle. The state is
+one timestamp per vehicle.
+"""
+import gzip
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from .metrics import stage
+from .storage import Storage, list_keys
+
+SNAPSHOTS_PER_TASK = 64
+LOCAL_TIMEZONE = "America/New_York"
+
+VEHICLE_POSITION_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("time", pa.int64()),
+    ("trip.trip_id", pa.string()),
+    ("trip.route_id", pa.string()),
+    ("trip.direction_id", pa.int64()),
+    ("trip.start_time", pa.string()),
+    ("trip.start_date", pa.string()),
+    ("vehicle.id", pa.string()),
+    ("position.latitude", pa.float64()),
+    ("position.longitude", pa.float64()),
+    ("current_stop_sequence", pa.int64()),
+    ("stop_id", pa.string()),
+    ("timestamp", pa.int64()),
+    ("date", pa.string()),
+])
+
+
+def decode_snapshot(data: bytes, columns: Optional[Dict[str, list]] = None) -> Dict[str, list]:
+    """
+    Decode one VehiclePositions FeedMessage, appending a row per vehicle with a trip
+    and a position to `columns` (without `date`, which is derived per batch).
+
+    :param data: Serialized FeedMessage, optionally gzip-compressed.
+    :param columns: (Optional) Column lists to append to.
+    :return: The column lists.
+    """
+    from google.transit import gtfs_realtime_pb2
+
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(data)
+    if columns is None:
+        columns = {name: [] for name in VEHICLE_POSITION_SCHEMA.names if name != "date"}
+    header_time = feed.header.timestamp if feed.header.HasField("timestamp") else None
+    for entity in feed.entity:
+        if not entity.HasField("vehicle"):
+            continue
+        vehicle = entity.vehicle
+        if not (vehicle.HasField("trip") and vehicle.HasField("position")):
+            # Not in service
+            continue
+        trip = vehicle.trip
+        columns["id"].append(entity.id)
+        columns["time"].append(header_time)
+        columns["trip.trip_id"].append(trip.trip_id)
+        columns["trip.route_id"].append(trip.route_id)
+        columns["trip.direction_id"].append(trip.direction_id if trip.HasField("direction_id") else None)
+        columns["trip.start_time"].append(trip.start_time or None)
+        columns["trip.start_date"].append(trip.start_date or None)
+        columns["vehicle.id"].append(vehicle.vehicle.id or entity.id)
+        columns["position.latitude"].append(vehicle.position.latitude)
+        columns["position.longitude"].append(vehicle.position.longitude)
+        columns["current_stop_sequence"].append(
+            vehicle.current_stop_sequence if vehicle.HasField("current_stop_sequence") else None)
+        columns["stop_id"].append(vehicle.stop_id or None)
+        columns["timestamp"].append(vehicle.timestamp if vehicle.HasField("timestamp") else header_time)
+    return columns
+
+
+def _local_dates(timestamps: pa.Array) -> pa.Array:
+    local = pd.to_datetime(timestamps.to_numpy(zero_copy_only=False), unit="s", utc=True).tz_convert(LOCAL_TIMEZONE)
+    return pa.array(local.strftime("%Y-%m-%d"), pa.string())
+
+
+def _drop_repeats(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """Keep the first row of every (vehicle, timestamp)."""
+    repeated = batch.select(["vehicle.id", "timestamp"]).to_pandas().duplicated()
+    return batch.filter(pa.array(~repeated.to_numpy()))
+
+
+def _decode_chunk(task: Tuple[Storage, List[str], Optional[str]]) -> Tuple[pa.RecordBatch, List[Tuple[str, str]]]:
+    """Decode a chunk of snapshots into one de-duplicated batch; also returns the keys that failed."""
+    storage, keys, date = task
+    columns = {name: [] for name in VEHICLE_POSITION_SCHEMA.names if name != "date"}
+    errors = []
+    for key in keys:
+        try:
+            decode_snapshot(storage.read(key), columns)
+        except Exception as e:
+            errors.append((key, str(e)))
+    arrays = {field.name: pa.array(columns[field.name], field.type)
+              for field in VEHICLE_POSITION_SCHEMA if field.name != "date"}
+    arrays["date"] = _local_dates(arrays["timestamp"])
+    batch = pa.RecordBatch.from_arrays(list(arrays.values()), schema=VEHICLE_POSITION_SCHEMA)
+    batch = batch.filter(pc.is_valid(batch.column("timestamp")))
+    if date is not None:
+        batch = batch.filter(pc.equal(batch.column("date"), date))
+    return _drop_repeats(batch), errors
+
+
+def iter_vehicle_batches(
+    storage: Storage,
+    keys: List[str],
+    date: Optional[str] = None,
+    snapshots_per_task: int = SNAPSHOTS_PER_TASK,
+    workers: Optional[int] = None,
+    errors: Optional[List[Tuple[str, str]]] = None,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Decode VehiclePositions snapshots into de-duplicated record batches.
+
+    :param storage: Storage holding the snapshots.
+    :param keys: Snapshot keys; sorted, so that names with timestamps are read in time order.
+    :param date: (Optional) Keep only positions on this local date (YYYY-MM-DD).
+    :param snapshots_per_task: Snapshots decoded per worker task and per batch.
+    :param workers: (Optional) Number of worker processes (default: one per CPU).
+    :param errors: (Optional) Receives a (key, error message) tuple for every snapshot that failed to decode.
+    :return: Iterator of batches with `VEHICLE_POSITION_SCHEMA`, in key order.
+    """
+    keys = sorted(keys)
+    tasks = [(storage, keys[i:i + snapshots_per_task], date) for i in range(0, len(keys), snapshots_per_task)]
+    last_seen: Dict[str, int] = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch, failed in executor.map(_decode_chunk, tasks):
+            for key, message in failed:
+                print(f"Error decoding {key}: {message}")
+            if errors is not None:
+                errors.extend(failed)
+            if not len(batch):
+                continue
+            seen = batch.select(["vehicle.id", "timestamp"]).to_pandas()
+            newer = (seen["timestamp"] > seen["vehicle.id"].map(last_seen).fillna(-1)).to_numpy()
+            if not newer.any():
+                continue
+            last_seen.update(seen[newer].groupby("vehicle.id")["timestamp"].max().to_dict())
+            yield batch.filter(pa.array(newer))
+
+
+def load_vehicle_positions(storage: Storage, prefix: str, date: Optional[str] = None,
+                           workers: Optional[int] = None) -> pd.DataFrame:
+    """
+    Decode every snapshot under a prefix into one DataFrame of vehicle positions,
+    recording a `gtfs_rt.decode` metrics stage.
+
+    :param storage: Storage holding the snapshots.
+    :param prefix: Key prefix of the snapshots, e.g. `{prefix}date=2025-01-15/`.
+    :param date: (Optional) Keep only positions on this local date (YYYY-MM-DD).
+    :param workers: (Optional) Number of worker processes.
+    :return: DataFrame with the columns of the normalized vehicle-position parquet.
+    """
+    keys = [key for key in list_keys(storage, prefix) if key.endswith((".pb", ".pb.gz"))]
+    with stage("gtfs_rt.decode", rows_in=len(keys)) as record:
+        errors = []
+        batches = list(iter_vehicle_batches(storage, keys, date, workers=workers, errors=errors))
+        table = pa.Table.from_batches(batches, schema=VEHICLE_POSITION_SCHEMA)
+        record["rows_out"] = table.num_rows
+    print(f"Decoded {len(keys) - len(errors)} snapshots ({len(errors)} failed) into {table.num_rows} positions")
+    return table.to_pandas()
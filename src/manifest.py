@@ -0,0 +1,157 @@
+"""
+Job manifest of the speed pipeline: one completion record per feed/route/date
+partition.
+
+    data/manifest/feed_id={feed_id}/route_id={route_id}/service_date={date}.json
+
+A record is written (atomically, after the partition's raw speeds and rollups)
+with the pipeline version that produced it, the row count and the size of every
+output file. On the next run a partition is
+
+    complete  if its record has the current version and its files are intact
+    stale     if it was produced by another version, or a recorded file is gone or changed size
+    missing   if it has no record, e.g. a new route or a date that crashed mid-write
+
+and only stale and missing partitions are processed. The version is a hash of
+the source files that shape the output and of the run configuration, so editing
+`speeds.py` or changing `--vehicle-format` marks earlier partitions stale.
+A route without any vehicle positions on a processed date is recorded as
+complete with no rows, so it does not reload the whole date on every rerun.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .raw_speeds import atomic_output, partition_path
+
+MANIFEST_DIR = "data/manifest"
+PARTITION_STATES = ("complete", "stale", "missing")
+
+# Modules whose code determines the raw speeds and rollups of a partition
+VERSIONED_MODULES = (
+    "api.py", "gtfs_rt.py", "gtfs_segments.py", "raw_speeds.py", "rollups.py",
+    "sketches.py", "speed_calculator.py", "speeds.py",
+)
+
+
+def pipeline_version(config: Optional[dict] = None, modules: Iterable[str] = VERSIONED_MODULES) -> str:
+    """
+    Version of the pipeline output: a short hash of the versioned source files and
+    of the run configuration.
+
+    :param config: (Optional) JSON-serializable settings that change the output.
+    :param modules: File names in `src/` to hash.
+    :return: 12 hexadecimal characters.
+    """
+    digest = hashlib.sha256()
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(modules):
+        digest.update(name.encode())
+        with open(os.path.join(src_dir, name), "rb") as f:
+            digest.update(f.read())
+    digest.update(json.dumps(config or {}, sort_keys=True, default=str).encode())
+    return digest.hexdigest()[:12]
+
+
+class Manifest:
+    """Completion records of the feed/route/date partitions produced by one pipeline version."""
+
+    def __init__(self, version: str, base_dir: str = MANIFEST_DIR):
+        """
+        Parameters:
+        version (str): Current pipeline version, from `pipeline_version`.
+        base_dir (str): Root directory of the records.
+        """
+        self.version = version
+        self.base_dir = base_dir
+
+    def record_path(self, feed_id: str, route_id: str, service_date: str) -> str:
+        return partition_path(self.base_dir, feed_id, route_id, service_date) + ".json"
+
+    def read(self, feed_id: str, route_id: str, service_date: str) -> Optional[dict]:
+        """Return the completion record of a partition, or None if there is none (or it is unreadable)."""
+        try:
+            with open(self.record_path(feed_id, route_id, service_date)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def status(self, feed_id: str, route_id: str, service_date: str) -> str:
+        """Return "complete", "stale" or "missing" for a partition."""
+        record = self.read(feed_id, route_id, service_date)
+        if record is None:
+            return "missing"
+        if record.get("version") != self.version:
+            return "stale"
+        for path, size in record.get("files", {}).items():
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                return "stale"
+        return "complete"
+
+    def complete(self, feed_id: str, route_id: str, service_date: str,
+                 files: Iterable[str] = (), rows: int = 0) -> str:
+        """
+        Record a partition as complete. Call it only after all its outputs are written.
+
+        Parameters:
+        feed_id (str): Feed ID of the partition.
+        route_id (str): Route ID of the partition.
+        service_date (str): Processed date (YYYY-MM-DD).
+        files (Iterable[str]): Output files of the partition, checked on later runs.
+        rows (int): Number of speed rows written.
+
+        Returns:
+        str: Path of the record.
+        """
+        record = {
+            "feed_id": feed_id,
+            "route_id": route_id,
+            "service_date": service_date,
+            "version": self.version,
+            "rows": int(rows),
+            "files": {path: os.path.getsize(path) for path in files},
+            "completed_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+        path = self.record_path(feed_id, route_id, service_date)
+        with atomic_output(path) as temp_path:
+            with open(temp_path, "w") as f:
+                json.dump(record, f, indent=2)
+        return path
+
+    def has_records(self, feed_id: str, service_date: str, route_ids: Iterable[str]) -> bool:
+        """Whether any of the routes has a record for the date under the feed, of any version."""
+        return any(os.path.exists(self.record_path(feed_id, route_id, service_date)) for route_id in route_ids)
+
+    def remove(self, feed_id: str, route_id: str, service_date: str) -> None:
+        """Delete the record of a partition, if any."""
+        try:
+            os.unlink(self.record_path(feed_id, route_id, service_date))
+        except FileNotFoundError:
+            pass
+
+    def pending_routes(self, feed_id: str, service_date: str, route_ids: Iterable[str]) -> List[str]:
+        """Return the routes of a date whose partitions are stale or missing."""
+        return [route_id for route_id in route_ids
+                if self.status(feed_id, route_id, service_date) != "complete"]
+
+    def plan(self, feed_id: str, dates: Iterable[str],
+             route_ids: Iterable[str]) -> Tuple[Dict[str, List[str]], Dict[str, int]]:
+        """
+        Work left for a run: the stale or missing routes of every date.
+
+        Returns:
+        Tuple[Dict[str, List[str]], Dict[str, int]]: Pending routes per date (dates
+            with nothing pending are left out), and the number of partitions in each state.
+        """
+        route_ids = list(route_ids)
+        pending = {}
+        counts = dict.fromkeys(PARTITION_STATES, 0)
+        for date in dates:
+            for route_id in route_ids:
+                state = self.status(feed_id, route_id, date)
+                counts[state] += 1
+                if state != "complete":
+                    pending.setdefault(date, []).append(route_id)
+        return pending, counts
@@ -0,0 +1,137 @@
+"""
+Batched rendering of route segments for the speed difference map.
+
+Instead of one Plotly trace per segment, segments are binned into a small
+fixed set of colour classes and each class is drawn as a single
+`Scattermapbox` trace. Segment coordinates are concatenated with NaN
+separators (serialized as null, which breaks the line) and hover text is
+attached per point, along with the segment's geometry row as customdata so a
+clicked point can be traced back to its segment. Everything is gathered with
+NumPy from the flat arrays of `RouteGeometry`, so the number of traces stays
+fixed and the payload grows only with coordinate count.
+"""
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from .geometry_cache import RouteGeometry
+
+# Intensity levels per direction of change; level 0 is a zero difference
+COLOR_LEVELS = 5
+
+
+def hex_to_rgb(hex_color: str) -> Tuple[int, int, int]:
+    """Convert '#RRGGBB' to an (r, g, b) tuple."""
+    return tuple(int(hex_color.lstrip("#")[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def color_classes(decrease_color: str, increase_color: str,
+                  levels: int = COLOR_LEVELS) -> List[str]:
+    """
+    RGBA colours of every class: `levels + 1` decrease classes followed by
+    `levels + 1` increase classes, with alpha rising from 0.3 to 1.0 with intensity.
+    """
+    classes = []
+    for rgb in (hex_to_rgb(decrease_color), hex_to_rgb(increase_color)):
+        for level in range(levels + 1):
+            alpha = 0.3 + 0.7 * level / levels
+            classes.append(f"rgba({rgb[0]}, {rgb[1]}, {rgb[2]}, {alpha:.2f})")
+    return classes
+
+
+def speed_diff_classes(speed_diffs: np.ndarray, max_abs_diff: float,
+                       levels: int = COLOR_LEVELS) -> np.ndarray:
+    """
+    Colour class of each speed difference, indexing `color_classes`. Positive
+    differences use the increase classes, zero and negative the decrease classes.
+    """
+    speed_diffs = np.asarray(speed_diffs, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        intensity = np.minimum(1.0, np.abs(speed_diffs) / max_abs_diff)
+    level = np.rint(np.nan_to_num(intensity) * levels).astype(np.intp)
+    return np.where(speed_diffs > 0, levels + 1 + level, level)
+
+
+def gather_coordinates(geometry: RouteGeometry, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Concatenate the coordinates of the given segment rows, each followed by a NaN separator.
+
+    :return: (lons, lats, counts), where counts[i] is the number of points
+             (including the separator) taken by rows[i].
+    """
+    starts = geometry.offsets[rows]
+    lengths = geometry.offsets[rows + 1] - starts
+    counts = lengths + 1
+
+    # Source index of every point, and its output slot after leaving room for separators
+    total = int(lengths.sum())
+    segment_of_point = np.repeat(np.arange(len(rows)), lengths)
+    first_point = np.cumsum(lengths) - lengths
+    source = np.arange(total) - first_point[segment_of_point] + starts[segment_of_point]
+    target = np.arange(total) + segment_of_point
+
+    lons = np.full(total + len(rows), np.nan)
+    lats = np.full(total + len(rows), np.nan)
+    lons[target] = geometry.lons[source]
+    lats[target] = geometry.lats[source]
+    return lons, lats, counts
+
+
+def segment_traces(
+    segments_data: pd.DataFrame,
+    geometry: RouteGeometry,
+    speed_diffs: np.ndarray,
+    max_abs_diff: float,
+    decrease_color: str,
+    increase_color: str,
+    levels: int = COLOR_LEVELS,
+) -> Tuple[List[go.Scattermapbox], np.ndarray, np.ndarray]:
+    """
+    Build one line trace per colour class for the map.
+
+    Parameters:
+    segments_data (pd.DataFrame): Output of `RouteGeometry.join`, with prev_stop_name,
+        stop_name and row columns.
+    geometry (RouteGeometry): Geometry the rows index into.
+    speed_diffs (np.ndarray): Speed change to display for each row, in mph.
+    max_abs_diff (float): Speed change mapped to full colour intensity.
+    decrease_color (str): Hex colour for slower segments.
+    increase_color (str): Hex colour for faster segments.
+    levels (int): Intensity levels per direction.
+
+    Returns:
+    tuple: (traces, lons, lats), with lons/lats holding all plotted coordinates for bounds.
+    """
+    speed_diffs = np.asarray(speed_diffs, dtype=float)
+    rows = segments_data["row"].to_numpy()
+    classes = speed_diff_classes(speed_diffs, max_abs_diff, levels)
+    colors = color_classes(decrease_color, increase_color, levels)
+    hover = (
+        "From Stop: " + segments_data["prev_stop_name"].astype(str)
+        + "<br>To Stop: " + segments_data["stop_name"].astype(str)
+        + "<br>Speed change: " + pd.Series(speed_diffs, index=segments_data.index).map("{:+.1f} mph".format)
+    ).to_numpy()
+
+    traces = []
+    all_lons, all_lats = [], []
+    for color_class in np.unique(classes):
+        selected = np.flatnonzero(classes == color_class)
+        lons, lats, counts = gather_coordinates(geometry, rows[selected])
+        all_lons.append(lons)
+        all_lats.append(lats)
+        traces.append(go.Scattermapbox(
+            mode="lines",
+            lon=lons,
+            lat=lats,
+            line=dict(width=3, color=colors[color_class]),
+            showlegend=False,
+            hoverinfo="text",
+            hovertext=np.repeat(hover[selected], counts),
+            customdata=np.repeat(rows[selected], counts),
+        ))
+
+    if not all_lons:
+        return traces, np.array([]), np.array([])
+    return traces, np.concatenate(all_lons), np.concatenate(all_lats)
@@ -0,0 +1,268 @@
+"""
+Per-stage timing and memory metrics of the processing pipeline.
+
+Each instrumented stage (S3 listing and download, bus preparation, projection,
+the trip loop, writes) appends one JSON line to the metrics file when it ends:
+
+    {"ts": "2025-01-15T10:03:11", "stage": "speeds.projection", "feed_id": "mdb-513",
+     "date": "2025-01-15", "wall_s": 12.4, "cpu_s": 12.1, "rows_in": 512000,
+     "run_id": "5f0c2a9e41d3", "rows_out": 512000, "bytes_read": null, "rss_start_mb": 1210.4,
+     "peak_rss_mb": 1830.2, "status": "ok"}
+
+`feed_id`, `date` and `run_id` come from the enclosing `metrics_context`; the
+stages of one `process_date` call share its run_id and do not overlap, so
+their wall times add up to most of the date's total. CPU time is
+process CPU time, so it includes the stage's worker threads.
+
+Memory is measured for the whole process:
+- `rss_start_mb` is the resident set size when the stage started.
+- `peak_rss_mb` is the high-water mark when the stage ended. `SpeedCalculator`
+  resets it (`reset_peak_rss`) when each date starts, so it is the peak of the
+  current date and feed. Where the reset is unsupported (outside Linux), it is
+  the peak since the process started. Recording costs a few clock reads
+and one short file append per stage, so it stays enabled in production.
+
+The file defaults to `logs/pipeline_metrics.jsonl`. Set `PIPELINE_METRICS` to
+another path, or to `off` to disable recording. `pipeline_metrics.py`
+summarizes the file.
+"""
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Callable, ContextManager, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRICS_ENV = "PIPELINE_METRICS"
+METRICS_PATH = os.path.join("logs", "pipeline_metrics.jsonl")
+
+_local = threading.local()
+_write_lock = threading.Lock()
+_metrics_path = os.environ.get(METRICS_ENV, METRICS_PATH)
+_stage_scopes: List[Callable[[str], ContextManager]] = []
+
+
+def configure_metrics(path: Optional[str]) -> None:
+    """Record metrics to `path`, or stop recording if it is None or 'off'."""
+    global _metrics_path
+    _metrics_path = path
+
+
+def metrics_path() -> Optional[str]:
+    """Current metrics file, or None if recording is disabled."""
+    return None if not _metrics_path or _metrics_path.lower() == "off" else _metrics_path
+
+
+PROC_STATUS = "/proc/self/status"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+
+
+def _proc_status_mb(field: str) -> Optional[float]:
+    """A kB field of /proc/self/status (e.g. VmRSS) in MB, or None if unavailable."""
+    try:
+        with open(PROC_STATUS) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the high-water mark reported by `peak_rss_mb` to the current RSS.
+    Supported on Linux only; returns whether the mark was reset.
+    """
+    try:
+        with open(PROC_CLEAR_REFS, "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size of the process in MB, if available."""
+    return _proc_status_mb("VmRSS")
+
+
+def peak_rss_mb() -> Optional[float]:
+    """High-water mark of the process resident set size in MB since the last `reset_peak_rss`, if available."""
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None or resource is None:
+        return peak
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS, and is never reset
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def _context() -> Dict[str, str]:
+    if not hasattr(_local, "context"):
+        _local.context = {}
+    return _local.context
+
+
+def current_context() -> Dict[str, str]:
+    """Fields of the enclosing `metrics_context` in this thread."""
+    return dict(_context())
+
+
+def add_stage_scope(scope: Callable[[str], ContextManager]) -> None:
+    """Enter `scope(name)` around every stage from now on (e.g. a profiling session)."""
+    _stage_scopes.append(scope)
+
+
+def remove_stage_scope(scope: Callable[[str], ContextManager]) -> None:
+    if scope in _stage_scopes:
+        _stage_scopes.remove(scope)
+
+
+@contextlib.contextmanager
+def metrics_context(**fields) -> Iterator[None]:
+    """Attach fields (e.g. feed_id, date) to every stage recorded in this thread inside the block."""
+    context = _context()
+    previous = dict(context)
+    context.update(fields)
+    try:
+        yield
+    finally:
+        context.clear()
+        context.update(previous)
+
+
+def _write(record: dict) -> None:
+    path = metrics_path()
+    if path is None:
+        return
+    line = json.dumps(record, default=str) + "\n"
+    with _write_lock:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "a") as f:
+            f.write(line)
+
+
+@contextlib.contextmanager
+def stage(name: str, rows_in: Optional[int] = None) -> Iterator[dict]:
+    """
+    Time a pipeline stage and record it when the block exits.
+
+    The yielded record can be filled in inside the block, e.g.
+    `record["rows_out"] = len(df)` or `record["bytes_read"] = n`. A stage that
+    raises is recorded with status "error" and the exception is re-raised.
+
+    :param name: Stage name, prefixed by its module (e.g. "s3.load").
+    :param rows_in: (Optional) Number of input rows.
+    """
+    rss = rss_mb()
+    record = {"ts": datetime.now().isoformat(timespec="seconds"), "stage": name, **_context(),
+              "rows_in": rows_in, "rows_out": None, "bytes_read": None,
+              "rss_start_mb": None if rss is None else round(rss, 1)}
+    wall, cpu = time.perf_counter(), time.process_time()
+    status = "ok"
+    try:
+        with contextlib.ExitStack() as scopes:
+            for scope in list(_stage_scopes):
+                scopes.enter_context(scope(name))
+            yield record
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        record["wall_s"] = round(time.perf_counter() - wall, 4)
+        record["cpu_s"] = round(time.process_time() - cpu, 4)
+        rss = peak_rss_mb()
+        record["peak_rss_mb"] = None if rss is None else round(rss, 1)
+        record["status"] = status
+        try:
+            _write(record)
+        except OSError:
+            # Metrics must never fail the pipeline
+            pass
+
+
+def read_metrics(path: Optional[str] = None) -> pd.DataFrame:
+    """Read a metrics file into a DataFrame, skipping malformed lines."""
+    records = []
+    with open(path or metrics_path() or METRICS_PATH) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return pd.DataFrame.from_records(records)
+
+
+def _total(values: pd.Series) -> float:
+    """Sum that stays NaN when no record has a value."""
+    return values.sum(min_count=1)
+
+
+def summarize_metrics(metrics: pd.DataFrame, by: Iterable[str] = ("stage",)) -> pd.DataFrame:
+    """
+    Aggregate stage records.
+
+    :param metrics: Records from `read_metrics`.
+    :param by: Grouping columns, e.g. ("stage",) or ("date", "stage").
+    :return: One row per group with the number of runs and errors, total and p50/p95
+             wall time, total CPU time, rows in/out, rows per second, bytes read and
+             maximum peak RSS.
+    """
+    by = list(by)
+    for column in ("rows_in", "rows_out", "bytes_read", "peak_rss_mb", "feed_id", "date"):
+        if column not in metrics.columns:
+            metrics = metrics.assign(**{column: np.nan})
+    grouped = metrics.assign(errors=metrics["status"] != "ok").groupby(by, dropna=False)
+    summary = grouped.agg(
+        runs=("wall_s", "size"),
+        errors=("errors", "sum"),
+        wall_s=("wall_s", "sum"),
+        wall_p50_s=("wall_s", "median"),
+        wall_p95_s=("wall_s", lambda s: s.quantile(0.95)),
+        cpu_s=("cpu_s", "sum"),
+        rows_in=("rows_in", _total),
+        rows_out=("rows_out", _total),
+        bytes_read=("bytes_read", _total),
+        peak_rss_mb=("peak_rss_mb", "max"),
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        summary["rows_per_s"] = (summary["rows_in"] / summary["wall_s"]).where(summary["rows_in"] > 0)
+    return summary.sort_values("wall_s", ascending=False)
+
+
+def dominant_stages(metrics: pd.DataFrame, top: int = 10, total_stage: str = "calculator.process_date") -> List[dict]:
+    """
+    The slowest dates and the stage that took most of each.
+
+    :param top: Number of runs of `total_stage` to report.
+    :param total_stage: Stage that spans a whole date; its nested stages share its run_id.
+    :return: Dicts with feed_id, date, wall_s, dominant stage and its share of the date's wall time.
+    """
+    if "run_id" not in metrics.columns:
+        return []
+    runs = metrics[metrics["stage"] == total_stage].sort_values("wall_s", ascending=False).head(top)
+    nested = metrics[metrics["stage"] != total_stage]
+    slowest = []
+    for run in runs.itertuples():
+        stages = nested[nested["run_id"] == run.run_id]
+        stages = stages.groupby("stage")["wall_s"].sum().sort_values(ascending=False)
+        slowest.append({
+            "feed_id": run.feed_id,
+            "date": run.date,
+            "wall_s": run.wall_s,
+            "stage": stages.index[0] if len(stages) else None,
+            "share": round(stages.iloc[0] / run.wall_s, 3) if len(stages) and run.wall_s else None,
+        })
+    return slowest
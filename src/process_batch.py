@@ -8,6 +8,7 @@ pd.options.mode.chained_assignment = None
 from src.api import parse_zipped_gtfs
 from src.gtfs_segments import GTFS_shape_processor
 from src.speeds import BusSpeedCalculator
+from src.storage import split_uri
 from datetime import datetime, timedelta
 
 URLs = [
@@ -58,7 +59,8 @@ while current_date <= stop_date:
 
 dfs = []
 for url in URLs:
-    df = pd.read_parquet(url)
+    storage, key = split_uri(url)
+    df, _ = storage.read_parquet(key)
     print(df["vehicle.timestamp"].min())
     df = df[(df['vehicle.timestamp'] > start) & (df['vehicle.timestamp'] < stop)]
     dfs.append(df)
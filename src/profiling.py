@@ -0,0 +1,247 @@
+"""
+Opt-in profiling of selected pipeline stages for selected dates.
+
+A profiling session attaches to the stages recorded by `metrics.stage` (e.g.
+`speeds.projection`, `speeds.trip_loop`, `calculator.write_speeds`) and to the
+finer scopes marked with `profiled` (`speeds.lis`, `speeds.interpolation`).
+Only the stages and dates it was started with are profiled; everywhere else a
+scope costs one attribute check.
+
+Two modes:
+    sampling       a background thread samples the stack of every thread inside
+                   a selected stage every `interval` seconds. Nested stages are
+                   all attributed. Saved as collapsed stacks (`{stage}.collapsed`),
+                   ready for flamegraph.pl or speedscope.
+    deterministic  cProfile around each selected stage, saved as `{stage}.pstats`.
+                   A stage entered inside another profiled stage of the same
+                   thread is counted in the outer one.
+
+Files are written to `{output_dir}/{date}/` when the session stops, and
+`report()` lists the top functions of each stage across all dates.
+
+Example:
+    with profiling(stages=["projection", "lis"], dates=["2025-01-15"], output_dir="logs/profiles") as session:
+        calculator.process_date("2025-01-15", routes)
+    print(session.report(top=20))
+"""
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .metrics import add_stage_scope, current_context, remove_stage_scope
+
+PROFILE_MODES = ("sampling", "deterministic")
+SAMPLE_INTERVAL = 0.005
+DEFAULT_STAGES = ["speeds.projection", "speeds.lis", "speeds.interpolation", "calculator.write_speeds"]
+
+_session: Optional["ProfileSession"] = None
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileSession:
+    """Profiles of the selected stages, keyed by (date, stage)."""
+
+    def __init__(self, stages: Optional[Iterable[str]] = None, dates: Optional[Iterable[str]] = None,
+                 mode: str = "sampling", output_dir: str = os.path.join("logs", "profiles"),
+                 interval: float = SAMPLE_INTERVAL):
+        """
+        Parameters:
+        stages (Iterable[str]): Stage names to profile, with or without their module prefix
+            ("projection" selects "speeds.projection"). Default: `DEFAULT_STAGES`.
+        dates (Iterable[str]): Dates to profile (YYYY-MM-DD). Default: every date.
+        mode (str): "sampling" or "deterministic".
+        output_dir (str): Directory the profiles are written to.
+        interval (float): Seconds between stack samples in sampling mode.
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode {mode}, expected one of {PROFILE_MODES}")
+        self.stages = set(stages or DEFAULT_STAGES)
+        self.dates = None if dates is None else set(dates)
+        self.mode = mode
+        self.output_dir = output_dir
+        self.interval = interval
+        self.samples: Dict[Tuple[str, str], Counter] = defaultdict(Counter)
+        self.profiles: Dict[Tuple[str, str], cProfile.Profile] = {}
+        self._active: Dict[int, List[Tuple[str, str]]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._sampler = None
+
+    def selected(self, stage: str, date: Optional[str]) -> bool:
+        """Whether a stage on a date is profiled."""
+        if self.dates is not None and date not in self.dates:
+            return False
+        return stage in self.stages or stage.rsplit(".", 1)[-1] in self.stages
+
+    def start(self) -> None:
+        if self.mode == "sampling":
+            self._sampler = threading.Thread(target=self._sample, name="stage-profiler", daemon=True)
+            self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def _sample(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                active = {thread: list(keys) for thread, keys in self._active.items() if keys}
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread, keys in active.items():
+                frame = frames.get(thread)
+                if frame is None or thread == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack = ";".join(reversed(stack))
+                for key in keys:
+                    self.samples[key][stack] += 1
+
+    @contextlib.contextmanager
+    def scope(self, stage: str) -> Iterator[None]:
+        """Profile the block if its stage and the current date are selected."""
+        date = current_context().get("date")
+        if not self.selected(stage, date):
+            yield
+            return
+        key = (date or "all", stage)
+        if self.mode == "sampling":
+            thread = threading.get_ident()
+            with self._lock:
+                self._active.setdefault(thread, []).append(key)
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._active[thread].remove(key)
+        elif getattr(self._local, "profiling", False):
+            # cProfile allows one active profiler per thread; count the block in the outer stage
+            yield
+        else:
+            profile = self.profiles.setdefault(key, cProfile.Profile())
+            self._local.profiling = True
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                self._local.profiling = False
+
+    def save(self) -> List[str]:
+        """Write every profile to `{output_dir}/{date}/{stage}.collapsed|.pstats`; returns the paths."""
+        paths = []
+        for (date, stage), counts in self.samples.items():
+            path = os.path.join(self.output_dir, date, f"{stage}.collapsed")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                for stack, count in counts.most_common():
+                    f.write(f"{stack} {count}\n")
+            paths.append(path)
+        for (date, stage), profile in self.profiles.items():
+            path = os.path.join(self.output_dir, date, f"{stage}.pstats")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def _stage_keys(self) -> Dict[str, List[Tuple[str, str]]]:
+        keys = defaultdict(list)
+        for key in list(self.samples) + list(self.profiles):
+            keys[key[1]].append(key)
+        return keys
+
+    def report(self, top: int = 20) -> str:
+        """Top `top` functions of each profiled stage, over all dates."""
+        lines = []
+        for stage, keys in sorted(self._stage_keys().items()):
+            if self.mode == "sampling":
+                counts = Counter()
+                for key in keys:
+                    counts.update(self.samples[key])
+                total = sum(counts.values())
+                own, inclusive = Counter(), Counter()
+                for stack, count in counts.items():
+                    frames = stack.split(";")
+                    own[frames[-1]] += count
+                    for frame in set(frames):
+                        inclusive[frame] += count
+                lines.append(f"== {stage}: {total} samples ({total * self.interval:.2f} s)")
+                lines.append(f"{'self %':>8} {'total %':>8}  function")
+                for frame, count in own.most_common(top):
+                    lines.append(f"{100 * count / total:>8.1f} {100 * inclusive[frame] / total:>8.1f}  {frame}")
+            else:
+                stats = pstats.Stats(self.profiles[keys[0]], stream=io.StringIO())
+                for key in keys[1:]:
+                    stats.add(self.profiles[key])
+                stream = io.StringIO()
+                stats.stream = stream
+                stats.sort_stats("tottime").print_stats(top)
+                lines.append(f"== {stage}: {stats.total_tt:.2f} s")
+                body = stream.getvalue()
+                # Drop the pstats preamble; keep the table
+                lines.extend(body[body.find("   ncalls"):].rstrip().splitlines())
+            lines.append("")
+        return "\n".join(lines) if lines else "No profiled stages ran"
+
+
+def start_profiling(**kwargs) -> ProfileSession:
+    """Start a process-wide profiling session; see `ProfileSession` for the arguments."""
+    global _session
+    if _session is not None:
+        raise RuntimeError("A profiling session is already running")
+    _session = ProfileSession(**kwargs)
+    _session.start()
+    add_stage_scope(_session.scope)
+    return _session
+
+
+def stop_profiling() -> Optional[ProfileSession]:
+    """Stop the running session and write its profiles; returns it, or None if none was running."""
+    global _session
+    session, _session = _session, None
+    if session is None:
+        return None
+    remove_stage_scope(session.scope)
+    session.stop()
+    session.save()
+    return session
+
+
+@contextlib.contextmanager
+def profiling(**kwargs) -> Iterator[ProfileSession]:
+    """Profile the selected stages inside the block; see `ProfileSession` for the arguments."""
+    session = start_profiling(**kwargs)
+    try:
+        yield session
+    finally:
+        stop_profiling()
+
+
+@contextlib.contextmanager
+def profiled(stage: str) -> Iterator[None]:
+    """
+    Mark a block as a profiling scope finer than a metrics stage. Costs one global
+    lookup when no session is running.
+    """
+    if _session is None:
+        yield
+    else:
+        with _session.scope(stage):
+            yield
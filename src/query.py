@@ -0,0 +1,274 @@
+"""
+Ad-hoc analytical queries over the raw speeds dataset with DuckDB.
+
+DuckDB runs in-process, scans the partitioned Parquet files in parallel, and
+spills to disk when an aggregation does not fit in memory. Route/date
+predicates prune partitions before any file is opened.
+
+Views registered by `connect`:
+- `raw_speeds`: the hive-partitioned raw speeds dataset, with a derived `rush_hour` column.
+- `segments`: segment attributes (stop names, lengths) from `data/map-segments/`,
+  with the route_id and mdb_id taken from each file name.
+
+Example:
+    con = connect()
+    compare_periods(con, ["M50"], ("2024-12-03", "2025-01-04"), ("2025-01-05", "2025-02-06"),
+                    hours=hour_band("morning_rush"), by=["prev_stop_id", "stop_id"])
+"""
+import glob
+import os
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import duckdb
+import pandas as pd
+
+from .raw_speeds import RAW_SPEEDS_DIR, list_partition_files
+from .rollups import RUSH_HOUR_RANGES
+
+SEGMENTS_DIR = "data/map-segments"
+
+# Columns that comparisons may be grouped by. Anything else is rejected, since
+# identifiers cannot be passed as query parameters.
+GROUP_COLUMNS = [
+    "feed_id", "route_id", "shape_id", "prev_stop_id", "stop_id",
+    "service_date", "weekday", "hour", "rush_hour",
+]
+
+
+def _rush_hour_sql() -> str:
+    """SQL CASE expression labelling hours with the rush periods used by the map."""
+    cases = " ".join(
+        f"WHEN hour >= {start} AND hour < {end} THEN '{period}'"
+        for period, (start, end) in RUSH_HOUR_RANGES.items()
+    )
+    return f"CASE {cases} ELSE 'non_rush' END"
+
+
+def hour_band(name: str) -> List[int]:
+    """Hours of a named rush period, for the `hours` filter of the query functions."""
+    start, end = RUSH_HOUR_RANGES[name]
+    return list(range(start, end))
+
+
+def load_segment_attributes(segments_dir: str = SEGMENTS_DIR) -> pd.DataFrame:
+    """
+    Read segment attributes (without geometry) from `{mdb_id}_{route_id}_unique_segments.geojson` files.
+
+    :param segments_dir: Directory holding the segment GeoJSON files.
+    :return: DataFrame of segment properties with mdb_id and route_id columns.
+    """
+    import pyogrio
+
+    frames = []
+    for path in sorted(glob.glob(os.path.join(segments_dir, "*_unique_segments.geojson"))):
+        mdb_id, route_id = os.path.basename(path).split("_")[:2]
+        attributes = pyogrio.read_dataframe(path, read_geometry=False)
+        frames.append(attributes.assign(mdb_id=mdb_id, route_id=route_id))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def connect(
+    raw_dir: str = RAW_SPEEDS_DIR,
+    segments_dir: str = SEGMENTS_DIR,
+    threads: Optional[int] = None,
+    memory_limit: Optional[str] = None,
+    temp_directory: Optional[str] = None,
+) -> duckdb.DuckDBPyConnection:
+    """
+    Open an in-memory DuckDB connection with the raw speeds and segment views registered.
+
+    :param raw_dir: Root directory of the raw speeds dataset.
+    :param segments_dir: Directory holding the segment GeoJSON files.
+    :param threads: (Optional) Number of scan/aggregation threads (default: all cores).
+    :param memory_limit: (Optional) Memory limit such as "4GB"; larger work spills to disk.
+    :param temp_directory: (Optional) Directory for spilled data.
+    :return: DuckDB connection.
+    """
+    if not list_partition_files(raw_dir):
+        raise FileNotFoundError(f"No raw speeds partitions found in {raw_dir}")
+
+    con = duckdb.connect()
+    if threads is not None:
+        con.execute(f"SET threads = {int(threads)}")
+    if memory_limit is not None:
+        con.execute("SET memory_limit = ?", [memory_limit])
+    if temp_directory is not None:
+        con.execute("SET temp_directory = ?", [temp_directory])
+
+    pattern = os.path.join(raw_dir, "feed_id=*", "route_id=*", "service_date=*", "*.parquet")
+    con.execute(f"""
+        CREATE VIEW raw_speeds AS
+        SELECT *, {_rush_hour_sql()} AS rush_hour
+        FROM read_parquet(
+            '{pattern.replace("'", "''")}',
+            hive_partitioning = true,
+            hive_types = {{'feed_id': VARCHAR, 'route_id': VARCHAR, 'service_date': VARCHAR}}
+        )
+    """)
+
+    segments = load_segment_attributes(segments_dir)
+    if not segments.empty:
+        con.register("segment_attributes", segments)
+        con.execute("CREATE VIEW segments AS SELECT * FROM segment_attributes")
+    return con
+
+
+def _where(
+    route_ids: Optional[Iterable[str]] = None,
+    weekdays: Optional[Iterable[int]] = None,
+    hours: Optional[Iterable[int]] = None,
+    shape_ids: Optional[Iterable[str]] = None,
+    segments: Optional[Iterable[Tuple[int, int]]] = None,
+) -> Tuple[List[str], list]:
+    """Build parameterized WHERE clauses for the common filters."""
+    clauses, params = [], []
+    for column, values in (("route_id", route_ids), ("weekday", weekdays),
+                           ("hour", hours), ("shape_id", shape_ids)):
+        if values is not None:
+            values = list(values)
+            clauses.append(f"{column} IN ({', '.join(['?'] * len(values))})" if values else "FALSE")
+            params.extend(values)
+    if segments is not None:
+        segments = list(segments)
+        pairs = " OR ".join("(prev_stop_id = ? AND stop_id = ?)" for _ in segments)
+        clauses.append(f"({pairs})" if segments else "FALSE")
+        for prev_stop_id, stop_id in segments:
+            params.extend([prev_stop_id, stop_id])
+    return clauses, params
+
+
+def _check_columns(by: Sequence[str]) -> None:
+    unknown = [col for col in by if col not in GROUP_COLUMNS]
+    if unknown:
+        raise ValueError(f"Cannot group by {unknown}; choose from {GROUP_COLUMNS}")
+
+
+def average_speeds(
+    con: duckdb.DuckDBPyConnection,
+    start_date: str,
+    end_date: str,
+    by: Sequence[str] = ("route_id", "weekday", "hour"),
+    route_ids: Optional[Iterable[str]] = None,
+    weekdays: Optional[Iterable[int]] = None,
+    hours: Optional[Iterable[int]] = None,
+    shape_ids: Optional[Iterable[str]] = None,
+    segments: Optional[Iterable[Tuple[int, int]]] = None,
+) -> pd.DataFrame:
+    """
+    Average speed (total distance / total time) over a date window.
+
+    :param con: Connection from `connect`.
+    :param start_date: First processed date (YYYY-MM-DD).
+    :param end_date: Last processed date (YYYY-MM-DD).
+    :param by: Grouping columns, from GROUP_COLUMNS.
+    :param route_ids: (Optional) Routes to include.
+    :param weekdays: (Optional) Weekdays to include (0 = Monday).
+    :param hours: (Optional) Hours to include, e.g. `hour_band("evening_rush")`.
+    :param shape_ids: (Optional) Shapes to include, e.g. one direction of a route.
+    :param segments: (Optional) (prev_stop_id, stop_id) pairs to include.
+    :return: DataFrame with the grouping columns, avg_speed_mph and n_obs.
+    """
+    _check_columns(by)
+    clauses, params = _where(route_ids, weekdays, hours, shape_ids, segments)
+    clauses.insert(0, "service_date BETWEEN ? AND ?")
+    params = [start_date, end_date] + params
+    group = ", ".join(by)
+    sql = f"""
+        SELECT {group},
+               (sum(segment_length) / 5280) / (sum(time_elapsed) / 3600) AS avg_speed_mph,
+               count(*) AS n_obs
+        FROM raw_speeds
+        WHERE {' AND '.join(clauses)}
+        GROUP BY {group}
+        ORDER BY {group}
+    """
+    return con.execute(sql, params).df()
+
+
+def compare_periods(
+    con: duckdb.DuckDBPyConnection,
+    route_ids: Optional[Iterable[str]],
+    period_a: Tuple[str, str],
+    period_b: Tuple[str, str],
+    by: Sequence[str] = ("route_id", "weekday", "hour"),
+    weekdays: Optional[Iterable[int]] = None,
+    hours: Optional[Iterable[int]] = None,
+    shape_ids: Optional[Iterable[str]] = None,
+    segments: Optional[Iterable[Tuple[int, int]]] = None,
+) -> pd.DataFrame:
+    """
+    Compare average speeds between two date windows in a single scan.
+
+    :param con: Connection from `connect`.
+    :param route_ids: Routes to include (None for all).
+    :param period_a: Inclusive (start_date, end_date) of the first window, e.g. before an intervention.
+    :param period_b: Inclusive (start_date, end_date) of the second window.
+    :param by: Grouping columns, from GROUP_COLUMNS.
+    :param weekdays: (Optional) Weekdays to include (0 = Monday).
+    :param hours: (Optional) Hours to include, e.g. `hour_band("morning_rush")`.
+    :param shape_ids: (Optional) Shapes to include, e.g. one direction of a route.
+    :param segments: (Optional) (prev_stop_id, stop_id) pairs to include.
+    :return: DataFrame with the grouping columns, speed_a_mph, speed_b_mph,
+             speed_diff_mph (b minus a), n_a and n_b. Only groups observed in
+             both windows are returned.
+    """
+    _check_columns(by)
+    clauses, params = _where(route_ids, weekdays, hours, shape_ids, segments)
+    clauses.insert(0, "(service_date BETWEEN ? AND ? OR service_date BETWEEN ? AND ?)")
+    group = ", ".join(by)
+    sql = f"""
+        WITH labelled AS (
+            SELECT *,
+                   service_date BETWEEN ? AND ? AS in_a,
+                   service_date BETWEEN ? AND ? AS in_b
+            FROM raw_speeds
+            WHERE {' AND '.join(clauses)}
+        ),
+        totals AS (
+            SELECT {group},
+                   sum(segment_length) FILTER (WHERE in_a) AS distance_a,
+                   sum(time_elapsed) FILTER (WHERE in_a) AS time_a,
+                   count(*) FILTER (WHERE in_a) AS n_a,
+                   sum(segment_length) FILTER (WHERE in_b) AS distance_b,
+                   sum(time_elapsed) FILTER (WHERE in_b) AS time_b,
+                   count(*) FILTER (WHERE in_b) AS n_b
+            FROM labelled
+            GROUP BY {group}
+        )
+        SELECT {group},
+               (distance_a / 5280) / (time_a / 3600) AS speed_a_mph,
+               (distance_b / 5280) / (time_b / 3600) AS speed_b_mph,
+               speed_b_mph - speed_a_mph AS speed_diff_mph,
+               n_a, n_b
+        FROM totals
+        WHERE n_a > 0 AND n_b > 0
+        ORDER BY {group}
+    """
+    # Window bounds are bound twice: once to label rows, once to prune partitions
+    windows = [*period_a, *period_b]
+    return con.execute(sql, windows + windows + params).df()
+
+
+def segment_comparison(
+    con: duckdb.DuckDBPyConnection,
+    route_id: str,
+    period_a: Tuple[str, str],
+    period_b: Tuple[str, str],
+    weekdays: Optional[Iterable[int]] = None,
+    hours: Optional[Iterable[int]] = None,
+    shape_ids: Optional[Iterable[str]] = None,
+) -> pd.DataFrame:
+    """
+    Per-segment comparison of one route between two windows, joined with stop names
+    from the segment store when it is registered.
+    """
+    diff = compare_periods(con, [route_id], period_a, period_b, by=["route_id", "prev_stop_id", "stop_id"],
+                           weekdays=weekdays, hours=hours, shape_ids=shape_ids)
+    tables = con.execute("SELECT table_name FROM information_schema.tables").df()["table_name"]
+    if diff.empty or "segments" not in set(tables):
+        return diff
+    names = con.execute("""
+        SELECT DISTINCT prev_stop_id, stop_id, prev_stop_name, stop_name
+        FROM segments WHERE route_id = ?
+    """, [route_id]).df().drop_duplicates(["prev_stop_id", "stop_id"])
+    return diff.merge(names, on=["prev_stop_id", "stop_id"], how="left")
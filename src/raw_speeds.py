@@ -0,0 +1,266 @@
+"""
+Partitioned storage for the daily raw speed output of `SpeedCalculator`.
+
+Raw speeds are written as a hive-partitioned Parquet dataset:
+
+    data/raw-speeds/feed_id={feed_id}/route_id={route_id}/service_date={date}/part-0.parquet
+
+`service_date` is the date that was processed (the `date=` prefix of the
+realtime archive), which is what the old `bus_speeds_{date}.parquet` file names
+recorded. Each file is sorted by segment and hour and written with zstd
+compression, dictionary encoding and statistics, so that `read_speeds` can
+prune whole partitions by route/date and individual row groups by
+weekday/hour/segment.
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+RAW_SPEEDS_DIR = "data/raw-speeds"
+
+PARTITION_COLUMNS = ["feed_id", "route_id", "service_date"]
+PARTITIONING = ds.partitioning(
+    pa.schema([(col, pa.string()) for col in PARTITION_COLUMNS]),
+    flavor="hive"
+)
+
+# Segment first, then hour: a route/date file is scanned by segment for the map
+# and by hour for the chart, and both get usable row-group min/max statistics.
+SORT_COLUMNS = ["prev_stop_id", "stop_id", "hour"]
+DICTIONARY_COLUMNS = ["trip_id", "shape_id"]
+
+# One route-day is typically 10^4 - 10^5 rows. Small row groups keep the
+# statistics selective without making the footer dominate the file.
+ROW_GROUP_SIZE = 16_384
+COMPRESSION = "zstd"
+COMPRESSION_LEVEL = 3
+
+
+@contextmanager
+def atomic_output(path: str) -> Iterator[str]:
+    """
+    Yield a temporary path next to `path` and rename it to `path` once the block
+    succeeds, so readers never see a partially written file. Temporary files start
+    with a dot and are ignored by `list_partition_files`.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+def partition_path(base_dir: str, feed_id: str, route_id: str, service_date: str) -> str:
+    """Return the directory holding one feed/route/date partition."""
+    return os.path.join(
+        base_dir,
+        f"feed_id={feed_id}",
+        f"route_id={route_id}",
+        f"service_date={service_date}",
+    )
+
+
+def partition_exists(base_dir: str, feed_id: str, route_id: str, service_date: str) -> bool:
+    """Check whether a feed/route/date partition has already been written."""
+    return os.path.exists(
+        os.path.join(partition_path(base_dir, feed_id, route_id, service_date), "part-0.parquet")
+    )
+
+
+def remove_partition(base_dir: str, feed_id: str, route_id: str, service_date: str) -> bool:
+    """Delete the file of a feed/route/date partition, if any; returns whether one was deleted."""
+    path = os.path.join(partition_path(base_dir, feed_id, route_id, service_date), "part-0.parquet")
+    if not os.path.exists(path):
+        return False
+    os.unlink(path)
+    return True
+
+
+def write_partition(
+    table: pa.Table,
+    base_dir: str,
+    feed_id: str,
+    route_id: str,
+    service_date: str,
+    sort_columns: Optional[List[str]] = None,
+) -> str:
+    """
+    Write one feed/route/date partition of a hive-partitioned dataset.
+
+    Partition columns are dropped from the file itself; they are restored from
+    the directory names when the dataset is read.
+
+    :param table: Arrow table holding the partition's rows.
+    :param base_dir: Root directory of the dataset.
+    :param feed_id: Feed ID partition value.
+    :param route_id: Route ID partition value.
+    :param service_date: Processed date partition value (YYYY-MM-DD).
+    :param sort_columns: Columns to sort by before writing (default: segment, hour).
+    :return: Path of the written file.
+    """
+    sort_columns = SORT_COLUMNS if sort_columns is None else sort_columns
+    drop = [col for col in PARTITION_COLUMNS if col in table.column_names]
+    table = table.drop_columns(drop)
+    sort_keys = [(col, "ascending") for col in sort_columns if col in table.column_names]
+    if sort_keys:
+        table = table.sort_by(sort_keys)
+
+    out_path = os.path.join(partition_path(base_dir, feed_id, route_id, service_date), "part-0.parquet")
+    with atomic_output(out_path) as temp_path:
+        pq.write_table(
+            table,
+            temp_path,
+            compression=COMPRESSION,
+            compression_level=COMPRESSION_LEVEL,
+            use_dictionary=[col for col in DICTIONARY_COLUMNS if col in table.column_names],
+            row_group_size=ROW_GROUP_SIZE,
+            write_statistics=True,
+        )
+    return out_path
+
+
+def write_speeds(speeds: pd.DataFrame, feed_id: str, service_date: str,
+                 base_dir: str = RAW_SPEEDS_DIR) -> List[str]:
+    """
+    Write a processed daily speeds DataFrame as one partition per route.
+
+    :param speeds: Output of `SpeedCalculator._process_speeds_df`.
+    :param feed_id: Feed ID the speeds were calculated with.
+    :param service_date: Processed date (YYYY-MM-DD).
+    :param base_dir: Root directory of the raw speeds dataset.
+    :return: List of written file paths.
+    """
+    paths = []
+    for route_id, route_speeds in speeds.groupby("route_id", sort=True):
+        table = pa.Table.from_pandas(route_speeds, preserve_index=False)
+        paths.append(write_partition(table, base_dir, feed_id, str(route_id), service_date))
+    return paths
+
+
+def list_partition_files(base_dir: str = RAW_SPEEDS_DIR) -> List[str]:
+    """
+    List Parquet files under the `feed_id=` partitions of a dataset directory.
+    Legacy `{feed_id}/bus_speeds_{date}.parquet` folders are ignored.
+    """
+    if not os.path.isdir(base_dir):
+        return []
+    files = []
+    for entry in sorted(os.listdir(base_dir)):
+        if not entry.startswith("feed_id="):
+            continue
+        for root, dirs, filenames in os.walk(os.path.join(base_dir, entry)):
+            dirs.sort()
+            files.extend(
+                os.path.join(root, filename)
+                for filename in sorted(filenames)
+                if filename.endswith(".parquet") and not filename.startswith(".")
+            )
+    return files
+
+
+def speeds_dataset(base_dir: str = RAW_SPEEDS_DIR, files: Optional[List[str]] = None) -> ds.Dataset:
+    """Open the raw speeds directory as a hive-partitioned Arrow dataset."""
+    return ds.dataset(
+        list_partition_files(base_dir) if files is None else files,
+        format="parquet",
+        partitioning=PARTITIONING,
+        partition_base_dir=base_dir,
+    )
+
+
+def build_filter(
+    feed_ids: Optional[Iterable[str]] = None,
+    route_ids: Optional[Iterable[str]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    weekdays: Optional[Iterable[int]] = None,
+    hours: Optional[Iterable[int]] = None,
+) -> Optional[ds.Expression]:
+    """
+    Build a dataset filter expression. Feed/route/date predicates prune
+    partitions; weekday/hour predicates prune row groups using statistics.
+    Dates are inclusive and formatted as YYYY-MM-DD.
+    """
+    predicates = []
+    if feed_ids is not None:
+        predicates.append(ds.field("feed_id").isin(list(feed_ids)))
+    if route_ids is not None:
+        predicates.append(ds.field("route_id").isin(list(route_ids)))
+    if start_date is not None:
+        predicates.append(ds.field("service_date") >= start_date)
+    if end_date is not None:
+        predicates.append(ds.field("service_date") <= end_date)
+    if weekdays is not None:
+        predicates.append(ds.field("weekday").isin(list(weekdays)))
+    if hours is not None:
+        predicates.append(ds.field("hour").isin(list(hours)))
+
+    if not predicates:
+        return None
+    expression = predicates[0]
+    for predicate in predicates[1:]:
+        expression = expression & predicate
+    return expression
+
+
+def read_speeds(
+    base_dir: str = RAW_SPEEDS_DIR,
+    feed_ids: Optional[Iterable[str]] = None,
+    route_ids: Optional[Iterable[str]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    weekdays: Optional[Iterable[int]] = None,
+    hours: Optional[Iterable[int]] = None,
+    columns: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read raw speeds with predicates pushed down to the Parquet scan.
+
+    :param base_dir: Root directory of the raw speeds dataset.
+    :param feed_ids: (Optional) Feed IDs to keep.
+    :param route_ids: (Optional) Route IDs to keep.
+    :param start_date: (Optional) First processed date to keep (YYYY-MM-DD).
+    :param end_date: (Optional) Last processed date to keep (YYYY-MM-DD).
+    :param weekdays: (Optional) Weekdays to keep (0 = Monday).
+    :param hours: (Optional) Hours of day to keep (0-23).
+    :param columns: (Optional) Columns to read; partition columns are allowed.
+    :return: Pandas DataFrame of matching rows.
+    """
+    files = list_partition_files(base_dir)
+    if not files:
+        return pd.DataFrame()
+    dataset = speeds_dataset(base_dir, files)
+    expression = build_filter(feed_ids, route_ids, start_date, end_date, weekdays, hours)
+    table = dataset.to_table(columns=columns, filter=expression)
+    return table.to_pandas()
+
+
+def migrate_legacy_speeds(feed_dir: str, base_dir: str = RAW_SPEEDS_DIR) -> List[str]:
+    """
+    Convert a legacy `{feed_id}/bus_speeds_{date}.parquet` folder into partitions.
+
+    :param feed_dir: Legacy directory named after the feed ID.
+    :param base_dir: Root directory of the partitioned dataset.
+    :return: List of written file paths.
+    """
+    feed_id = os.path.basename(os.path.normpath(feed_dir))
+    paths = []
+    for filename in sorted(os.listdir(feed_dir)):
+        if not (filename.startswith("bus_speeds_") and filename.endswith(".parquet")):
+            continue
+        service_date = filename[len("bus_speeds_"):-len(".parquet")]
+        speeds = pd.read_parquet(os.path.join(feed_dir, filename))
+        paths.extend(write_speeds(speeds, feed_id, service_date, base_dir))
+    return paths
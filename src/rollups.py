@@ -0,0 +1,416 @@
+"""
+Additive daily rollups of the raw speeds dataset.
+
+For every processed feed/route/date partition we keep the partial sums that
+the chart and map averages are built from (total distance, total time and
+observation count). Averages for any period are then derived by summing the
+relevant days, without rescanning raw speeds:
+
+    data/rollups/route-hourly/feed_id={feed_id}/route_id={route_id}/service_date={date}/part-0.parquet
+    data/rollups/route-quarter-hourly/feed_id={feed_id}/route_id={route_id}/service_date={date}/part-0.parquet
+    data/rollups/segment-rush/feed_id={feed_id}/route_id={route_id}/service_date={date}/part-0.parquet
+    data/rollups/segment-hourly/feed_id={feed_id}/route_id={route_id}/service_date={date}/part-0.parquet
+    data/rollups/segment-hour-sketch/feed_id={feed_id}/route_id={route_id}/service_date={date}/part-0.parquet
+
+The sketch rollup holds a mergeable speed histogram per segment, weekday and
+hour (see `sketches.py`), so percentiles for any date range come from merging
+daily sketches. The segment-hourly rollup feeds the segment-hour store used by
+the dashboard drill-down (see `write_segment_hours`), and the 15-minute route
+rollup is the base level of the time cube (see `time_cube.py`).
+"""
+import glob
+import hashlib
+import os
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .raw_speeds import (
+    RAW_SPEEDS_DIR,
+    build_filter,
+    list_partition_files,
+    remove_partition,
+    speeds_dataset,
+    write_partition,
+)
+from .sketches import build_sketches, merge_sketches, quantiles
+
+ROLLUPS_DIR = "data/rollups"
+ROUTE_HOURLY = "route-hourly"
+ROUTE_QUARTER_HOURLY = "route-quarter-hourly"
+SEGMENT_RUSH = "segment-rush"
+SEGMENT_HOURLY = "segment-hourly"
+SEGMENT_HOUR_SKETCH = "segment-hour-sketch"
+ROLLUP_NAMES = [ROUTE_HOURLY, ROUTE_QUARTER_HOURLY, SEGMENT_RUSH, SEGMENT_HOURLY, SEGMENT_HOUR_SKETCH]
+
+SEGMENT_HOUR_KEYS = ["route_id", "prev_stop_id", "stop_id", "weekday", "hour"]
+
+SUM_COLUMNS = ["total_distance", "total_time", "n_obs"]
+
+# 15-minute bins of the time cube
+SLOTS_PER_HOUR = 4
+
+# Rush periods as [start, end) hours, matching the speed difference map
+RUSH_HOUR_RANGES = {
+    "morning_rush": (7, 10),
+    "evening_rush": (16, 19),
+}
+RUSH_PERIODS = ["morning_rush", "evening_rush", "non_rush"]
+
+
+def rush_hour_labels(hours) -> np.ndarray:
+    """Label each hour of day as morning_rush, evening_rush or non_rush."""
+    hours = np.asarray(hours)
+    labels = np.full(len(hours), "non_rush", dtype=object)
+    for period, (start, end) in RUSH_HOUR_RANGES.items():
+        labels[(hours >= start) & (hours < end)] = period
+    return labels
+
+
+def hourly_partial_sums(speeds: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduce raw speeds to additive sums per route, weekday and hour.
+
+    :param speeds: Raw speeds with route_id, weekday, hour, segment_length and time_elapsed.
+    :return: DataFrame with route_id, weekday, hour, total_distance (feet),
+             total_time (seconds) and n_obs.
+    """
+    return speeds.groupby(["route_id", "weekday", "hour"], as_index=False).agg(
+        total_distance=("segment_length", "sum"),
+        total_time=("time_elapsed", "sum"),
+        n_obs=("segment_length", "size"),
+    )
+
+
+def quarter_hourly_partial_sums(speeds: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduce raw speeds to additive sums per route, local date and 15-minute bin.
+
+    :param speeds: Raw speeds with route_id, datetime_nyc, segment_length and time_elapsed.
+    :return: DataFrame with route_id, date (local YYYY-MM-DD), slot (15-minute bin of
+             the day, 0-95), total_distance (feet), total_time (seconds) and n_obs.
+    """
+    local_time = pd.to_datetime(speeds["datetime_nyc"])
+    speeds = speeds.assign(
+        date=local_time.dt.strftime("%Y-%m-%d"),
+        slot=local_time.dt.hour * SLOTS_PER_HOUR + local_time.dt.minute // (60 // SLOTS_PER_HOUR),
+    )
+    return speeds.groupby(["route_id", "date", "slot"], as_index=False).agg(
+        total_distance=("segment_length", "sum"),
+        total_time=("time_elapsed", "sum"),
+        n_obs=("segment_length", "size"),
+    )
+
+
+def segment_partial_sums(speeds: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduce raw speeds to additive sums per segment, weekday and rush period.
+
+    :param speeds: Raw speeds with route_id, prev_stop_id, stop_id, weekday, hour,
+                   segment_length and time_elapsed.
+    :return: DataFrame with route_id, prev_stop_id, stop_id, weekday, rush_hour,
+             total_distance (feet), total_time (seconds) and n_obs.
+    """
+    speeds = speeds.assign(rush_hour=rush_hour_labels(speeds["hour"]))
+    return speeds.groupby(
+        ["route_id", "prev_stop_id", "stop_id", "weekday", "rush_hour"], as_index=False
+    ).agg(
+        total_distance=("segment_length", "sum"),
+        total_time=("time_elapsed", "sum"),
+        n_obs=("segment_length", "size"),
+    )
+
+
+def segment_hourly_partial_sums(speeds: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduce raw speeds to additive sums per segment, weekday and hour.
+
+    :param speeds: Raw speeds with route_id, prev_stop_id, stop_id, weekday, hour,
+                   segment_length and time_elapsed.
+    :return: DataFrame with route_id, prev_stop_id, stop_id, weekday, hour,
+             total_distance (feet), total_time (seconds) and n_obs.
+    """
+    return speeds.groupby(SEGMENT_HOUR_KEYS, as_index=False).agg(
+        total_distance=("segment_length", "sum"),
+        total_time=("time_elapsed", "sum"),
+        n_obs=("segment_length", "size"),
+    )
+
+
+def write_rollup(sums: pd.DataFrame, name: str, feed_id: str, service_date: str,
+                 base_dir: str = ROLLUPS_DIR, sort_columns: Optional[List[str]] = None) -> List[str]:
+    """
+    Write per-route partial sums for one processed date, replacing any previous
+    rollup for the same feed/route/date so that reprocessing a day is idempotent.
+
+    :param sums: Partial sums including a route_id column.
+    :param name: Rollup name, used as the dataset directory under base_dir.
+    :param feed_id: Feed ID the speeds were calculated with.
+    :param service_date: Processed date (YYYY-MM-DD).
+    :param base_dir: Root directory of the rollup store.
+    :param sort_columns: Columns to sort each partition by.
+    :return: List of written file paths.
+    """
+    paths = []
+    for route_id, route_sums in sums.groupby("route_id", sort=True):
+        table = pa.Table.from_pandas(route_sums, preserve_index=False)
+        paths.append(write_partition(
+            table, os.path.join(base_dir, name), feed_id, str(route_id), service_date,
+            sort_columns=sort_columns
+        ))
+    return paths
+
+
+def read_rollup_table(
+    name: str,
+    base_dir: str = ROLLUPS_DIR,
+    route_ids: Optional[Iterable[str]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    feed_ids: Optional[Iterable[str]] = None,
+) -> Optional[pa.Table]:
+    """
+    Read the daily rows of a rollup for a route/date selection as an Arrow table,
+    or None if the rollup has not been written. Dates are inclusive and
+    formatted as YYYY-MM-DD.
+    """
+    dataset_dir = os.path.join(base_dir, name)
+    files = list_partition_files(dataset_dir)
+    if not files:
+        return None
+    expression = build_filter(feed_ids, route_ids, start_date, end_date)
+    return speeds_dataset(dataset_dir, files).to_table(filter=expression)
+
+
+def read_rollup(
+    name: str,
+    base_dir: str = ROLLUPS_DIR,
+    route_ids: Optional[Iterable[str]] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    feed_ids: Optional[Iterable[str]] = None,
+) -> pd.DataFrame:
+    """
+    Read the daily partial sums of a rollup for a route/date selection.
+    Dates are inclusive and formatted as YYYY-MM-DD.
+    """
+    table = read_rollup_table(name, base_dir, route_ids, start_date, end_date, feed_ids)
+    return pd.DataFrame() if table is None else table.to_pandas()
+
+
+def rollup_version(name: str, route_id: str, base_dir: str = ROLLUPS_DIR) -> Optional[str]:
+    """
+    Version of a route's partitions of a rollup, from the path, size and
+    modification time of their files. It changes whenever a date of the route is
+    written, rewritten or removed, without reading any file.
+
+    :param name: Rollup name, e.g. SEGMENT_RUSH.
+    :param route_id: Route ID.
+    :param base_dir: Root directory of the rollup store.
+    :return: Short hash, or None if the route has no partitions of the rollup.
+    """
+    pattern = os.path.join(base_dir, name, "feed_id=*", f"route_id={route_id}", "service_date=*", "*.parquet")
+    digest = hashlib.sha256()
+    files = 0
+    for path in sorted(glob.glob(pattern)):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        digest.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+        files += 1
+    return digest.hexdigest()[:16] if files else None
+
+
+def update_rollups(speeds: pd.DataFrame, feed_id: str, service_date: str,
+                   base_dir: str = ROLLUPS_DIR) -> None:
+    """Update the rollup store with the processed speeds of one date."""
+    write_rollup(hourly_partial_sums(speeds), ROUTE_HOURLY, feed_id, service_date,
+                 base_dir, sort_columns=["weekday", "hour"])
+    if "datetime_nyc" in speeds.columns:
+        write_rollup(quarter_hourly_partial_sums(speeds), ROUTE_QUARTER_HOURLY, feed_id, service_date,
+                     base_dir, sort_columns=["date", "slot"])
+    write_rollup(segment_partial_sums(speeds), SEGMENT_RUSH, feed_id, service_date,
+                 base_dir, sort_columns=["prev_stop_id", "stop_id", "weekday"])
+    write_rollup(segment_hourly_partial_sums(speeds), SEGMENT_HOURLY, feed_id, service_date,
+                 base_dir, sort_columns=["prev_stop_id", "stop_id", "weekday", "hour"])
+    write_rollup(build_sketches(speeds, SEGMENT_HOUR_KEYS), SEGMENT_HOUR_SKETCH, feed_id,
+                 service_date, base_dir, sort_columns=["prev_stop_id", "stop_id", "weekday", "hour"])
+
+
+def remove_rollups(feed_id: str, route_id: str, service_date: str, base_dir: str = ROLLUPS_DIR) -> None:
+    """Delete every rollup of one feed/route/date, e.g. when a reprocessed route has no speeds left."""
+    for name in ROLLUP_NAMES:
+        remove_partition(os.path.join(base_dir, name), feed_id, route_id, service_date)
+
+
+def hourly_speeds(
+    start_date: str,
+    end_date: str,
+    route_ids: Optional[Iterable[str]] = None,
+    base_dir: str = ROLLUPS_DIR,
+) -> pd.DataFrame:
+    """
+    Average hourly speed per route and weekday over a date range, computed as
+    sum(distance) / sum(time) over the daily rollups.
+
+    :param start_date: First processed date (YYYY-MM-DD).
+    :param end_date: Last processed date (YYYY-MM-DD).
+    :param route_ids: (Optional) Routes to include.
+    :param base_dir: Root directory of the rollup store.
+    :return: DataFrame with route_id, weekday, hour and average_speed_mph, matching
+             the `data/chart-speeds/*.parquet` schema.
+    """
+    sums = read_rollup(ROUTE_HOURLY, base_dir, route_ids, start_date, end_date)
+    if sums.empty:
+        return pd.DataFrame(columns=["route_id", "weekday", "hour", "average_speed_mph"])
+
+    totals = sums.groupby(["route_id", "weekday", "hour"], as_index=False)[SUM_COLUMNS].sum()
+    totals["average_speed_mph"] = (
+        (totals["total_distance"] / 5280) /  # convert feet to miles
+        (totals["total_time"] / 3600)        # convert seconds to hours
+    ).round(2)
+    return totals[["route_id", "weekday", "hour", "average_speed_mph"]]
+
+
+def segment_hourly_speeds(
+    start_date: str,
+    end_date: str,
+    route_ids: Optional[Iterable[str]] = None,
+    base_dir: str = ROLLUPS_DIR,
+) -> pd.DataFrame:
+    """
+    Average speed per segment, weekday and hour over a date range, computed as
+    sum(distance) / sum(time) over the daily segment-hourly rollups.
+
+    :return: DataFrame with route_id, prev_stop_id, stop_id, weekday, hour,
+             average_speed_mph and n_obs.
+    """
+    sums = read_rollup(SEGMENT_HOURLY, base_dir, route_ids, start_date, end_date)
+    if sums.empty:
+        return pd.DataFrame(columns=SEGMENT_HOUR_KEYS + ["average_speed_mph", "n_obs"])
+
+    totals = sums.groupby(SEGMENT_HOUR_KEYS, as_index=False)[SUM_COLUMNS].sum()
+    totals["average_speed_mph"] = (
+        (totals["total_distance"] / 5280) /  # convert feet to miles
+        (totals["total_time"] / 3600)        # convert seconds to hours
+    ).round(2)
+    return totals[SEGMENT_HOUR_KEYS + ["average_speed_mph", "n_obs"]]
+
+
+def segment_percentiles(
+    start_date: str,
+    end_date: str,
+    route_ids: Optional[Iterable[str]] = None,
+    by: Optional[List[str]] = None,
+    percentiles: Sequence[int] = (50, 85, 95),
+    base_dir: str = ROLLUPS_DIR,
+) -> pd.DataFrame:
+    """
+    Speed percentiles and travel-time reliability per segment over a date range,
+    from merged daily sketches.
+
+    :param start_date: First processed date (YYYY-MM-DD).
+    :param end_date: Last processed date (YYYY-MM-DD).
+    :param route_ids: (Optional) Routes to include.
+    :param by: Grouping columns (default: route_id, prev_stop_id, stop_id, weekday, hour).
+               `rush_hour` may be used in place of `hour`.
+    :param percentiles: Speed percentiles to report, as integers.
+    :param base_dir: Root directory of the rollup store.
+    :return: DataFrame with the grouping columns, n_obs, `speed_p{N}_mph` for each
+             percentile, travel_time_p50_s, travel_time_p95_s and buffer_index
+             ((p95 - p50) / p50 travel time).
+    """
+    by = SEGMENT_HOUR_KEYS if by is None else by
+    sketches = read_rollup_table(SEGMENT_HOUR_SKETCH, base_dir, route_ids, start_date, end_date)
+    if sketches is None or sketches.num_rows == 0:
+        return pd.DataFrame(columns=by + ["n_obs"])
+
+    if "rush_hour" in by:
+        hours = sketches["hour"].to_numpy(zero_copy_only=False)
+        sketches = sketches.append_column("rush_hour", pa.array(rush_hour_labels(hours), pa.string()))
+
+    merged = merge_sketches(sketches, by)
+    counts = np.stack(merged["counts"].to_numpy())
+    out = merged[by].copy()
+    out["n_obs"] = counts.sum(axis=1)
+
+    speeds = quantiles(counts, [p / 100 for p in percentiles])
+    for j, p in enumerate(percentiles):
+        out[f"speed_p{p}_mph"] = speeds[:, j]
+
+    # Travel time over a fixed segment is inversely ordered with speed:
+    # the 95th percentile travel time is the 5th percentile speed.
+    slow, median = quantiles(counts, [0.05, 0.5]).T
+    feet_per_second = 5280 / 3600
+    out["travel_time_p50_s"] = merged["segment_length"] / (median * feet_per_second)
+    out["travel_time_p95_s"] = merged["segment_length"] / (slow * feet_per_second)
+    out["buffer_index"] = (out["travel_time_p95_s"] - out["travel_time_p50_s"]) / out["travel_time_p50_s"]
+    return out
+
+
+def write_chart_speeds(start_date: str, end_date: str, output_path: str,
+                       route_ids: Optional[Iterable[str]] = None,
+                       base_dir: str = ROLLUPS_DIR) -> pd.DataFrame:
+    """Derive a chart dataset (e.g. control_speeds.parquet) for a period from the rollups."""
+    speeds = hourly_speeds(start_date, end_date, route_ids, base_dir)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    speeds.to_parquet(output_path, index=False)
+    return speeds
+
+
+def write_segment_hours(control: Tuple[str, str], treatment: Tuple[str, str], output_path: str,
+                        route_ids: Optional[Iterable[str]] = None,
+                        base_dir: str = ROLLUPS_DIR) -> pd.DataFrame:
+    """
+    Write the segment-hour store: hourly speeds before and after of every segment
+    and weekday, sorted by (route_id, prev_stop_id, stop_id, weekday, hour) so the
+    dashboard can slice out one segment's profile without scanning the file.
+
+    :param control: Inclusive (start_date, end_date) of the control window.
+    :param treatment: Inclusive (start_date, end_date) of the treatment window.
+    :param output_path: Output parquet path.
+    :param route_ids: (Optional) Routes to include.
+    :param base_dir: Root directory of the rollup store.
+    :return: DataFrame with the key columns, before_speed_mph, after_speed_mph,
+             before_n_obs and after_n_obs.
+    """
+    before = segment_hourly_speeds(*control, route_ids, base_dir)
+    after = segment_hourly_speeds(*treatment, route_ids, base_dir)
+    store = before.merge(after, on=SEGMENT_HOUR_KEYS, how="outer", suffixes=("_before", "_after"))
+    store = store.rename(columns={
+        "average_speed_mph_before": "before_speed_mph",
+        "average_speed_mph_after": "after_speed_mph",
+        "n_obs_before": "before_n_obs",
+        "n_obs_after": "after_n_obs",
+    })
+    store[["before_n_obs", "after_n_obs"]] = store[["before_n_obs", "after_n_obs"]].fillna(0).astype(np.int64)
+    store = store.sort_values(SEGMENT_HOUR_KEYS).reset_index(drop=True)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    store.to_parquet(output_path, index=False)
+    return store
+
+
+def rebuild_rollups(raw_dir: str = RAW_SPEEDS_DIR, base_dir: str = ROLLUPS_DIR) -> int:
+    """
+    Backfill the rollup store from every partition already in the raw speeds
+    dataset, one partition at a time.
+
+    :return: Number of partitions rolled up.
+    """
+    count = 0
+    for path in list_partition_files(raw_dir):
+        parts = dict(
+            part.split("=", 1)
+            for part in os.path.relpath(os.path.dirname(path), raw_dir).split(os.sep)
+        )
+        speeds = pd.read_parquet(path)
+        speeds["route_id"] = parts["route_id"]
+        if speeds.empty:
+            continue
+        update_rollups(speeds, parts["feed_id"], parts["service_date"], base_dir)
+        count += 1
+    return count
@@ -0,0 +1,142 @@
+"""
+Route catalog and consolidated dashboard store.
+
+The dashboard originally read one speed difference file and one segment file
+per route. `build_route_store` collects the segment store, the map speeds and
+the rollups into a single file per dataset under `data/dashboard/`:
+
+- `routes.parquet`: one row per route with its display name, featured flag,
+  Mobility Database ID, feed IDs seen in the rollups, segment count, bounding
+  box, and whether chart and map data exist.
+- `map-speeds.parquet`: segment speed differences of all routes, sorted by route.
+- `segment-geometry.npz`: simplified WGS84 segment geometry of every feed.
+
+`DashboardData` loads each file once and indexes it by route, so the cost of a
+dashboard interaction does not depend on the number of routes.
+"""
+import glob
+import os
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from .dashboard_data import (CONTROL_SPEEDS_PATH, DASHBOARD_STORE_DIR, FEATURED_ROUTES, MAP_SEGMENTS_DIR,
+                             MAP_SPEEDS_DIR, MAP_SPEEDS_FILE, ROUTE_CATALOG_FILE, SEGMENT_GEOMETRY_FILE,
+                             TREATMENT_SPEEDS_PATH, file_hash)
+from .geometry_cache import RouteGeometry, load_route_geometry, save_segment_store
+from .map_render import gather_coordinates
+from .raw_speeds import list_partition_files
+from .rollups import ROLLUPS_DIR, ROUTE_HOURLY
+
+MAP_SPEEDS_COLUMNS = ["route_id", "prev_stop_id", "stop_id", "weekday", "rush_hour", "avg_speed_diff"]
+
+
+def _file_routes(directory: str, suffix: str) -> pd.DataFrame:
+    """Parse `{mdb_id}_{route_id}{suffix}` file names into mdb_id, route_id and path columns."""
+    rows = []
+    for path in sorted(glob.glob(os.path.join(directory, f"*{suffix}"))):
+        mdb_id, route_id = os.path.basename(path)[:-len(suffix)].split("_", 1)
+        rows.append({"mdb_id": mdb_id, "route_id": route_id, "path": path})
+    return pd.DataFrame(rows, columns=["mdb_id", "route_id", "path"])
+
+
+def rollup_route_feeds(base_dir: str = ROLLUPS_DIR) -> pd.DataFrame:
+    """Distinct (route_id, feed_id) pairs in the rollup store, read from the partition paths."""
+    pairs = set()
+    for path in list_partition_files(os.path.join(base_dir, ROUTE_HOURLY)):
+        parts = dict(part.split("=", 1) for part in path.split(os.sep) if "=" in part)
+        pairs.add((parts["route_id"], parts["feed_id"]))
+    return pd.DataFrame(sorted(pairs), columns=["route_id", "feed_id"])
+
+
+def _chart_routes(paths: List[str]) -> set:
+    routes = set()
+    for path in paths:
+        if os.path.exists(path):
+            routes.update(pd.read_parquet(path, columns=["route_id"])["route_id"].astype(str))
+    return routes
+
+
+def _bounding_box(geometry: Optional[RouteGeometry], speeds: pd.DataFrame) -> List[float]:
+    """(min_lon, min_lat, max_lon, max_lat) of the route's segments, NaN when unknown."""
+    if geometry is None or speeds.empty:
+        return [np.nan] * 4
+    rows = geometry.join(speeds[["prev_stop_id", "stop_id"]].drop_duplicates())["row"].to_numpy()
+    if len(rows) == 0:
+        return [np.nan] * 4
+    lons, lats, _ = gather_coordinates(geometry, rows)
+    return [np.nanmin(lons), np.nanmin(lats), np.nanmax(lons), np.nanmax(lats)]
+
+
+def build_route_store(
+    store_dir: str = DASHBOARD_STORE_DIR,
+    segments_dir: str = MAP_SEGMENTS_DIR,
+    speeds_dir: str = MAP_SPEEDS_DIR,
+    chart_paths: Optional[List[str]] = None,
+    rollup_dir: str = ROLLUPS_DIR,
+    names: Optional[Dict[str, str]] = None,
+) -> pd.DataFrame:
+    """
+    Build the route catalog and the consolidated map speeds and geometry files.
+
+    :param store_dir: Output directory.
+    :param segments_dir: Directory of `{mdb_id}_{route_id}_unique_segments.geojson` files.
+    :param speeds_dir: Directory of `{mdb_id}_{route_id}_speed_diff.parquet` files.
+    :param chart_paths: (Optional) Chart speed files (default: control and treatment speeds).
+    :param rollup_dir: Rollup store directory, used for feed IDs.
+    :param names: (Optional) Display names of featured routes, keyed by route ID
+                  (default: the featured dashboard routes).
+    :return: The route catalog.
+    """
+    chart_paths = chart_paths or [CONTROL_SPEEDS_PATH, TREATMENT_SPEEDS_PATH]
+    names = names or {route_id: name for name, route_id in FEATURED_ROUTES.items()}
+    os.makedirs(store_dir, exist_ok=True)
+
+    # Segment files hold the segments of a whole feed; keep one per feed
+    segment_files = _file_routes(segments_dir, "_unique_segments.geojson")
+    geometries = {
+        row.mdb_id: load_route_geometry(row.path, file_hash(row.path))
+        for row in segment_files.drop_duplicates("mdb_id").itertuples()
+    }
+    save_segment_store(geometries, os.path.join(store_dir, SEGMENT_GEOMETRY_FILE))
+
+    speed_files = _file_routes(speeds_dir, "_speed_diff.parquet")
+    frames = [pd.read_parquet(row.path).assign(route_id=row.route_id)[MAP_SPEEDS_COLUMNS]
+              for row in speed_files.itertuples()]
+    map_speeds = (pd.concat(frames, ignore_index=True) if frames
+                  else pd.DataFrame(columns=MAP_SPEEDS_COLUMNS))
+    map_speeds = map_speeds.sort_values(["route_id", "weekday", "rush_hour"]).reset_index(drop=True)
+    map_speeds.to_parquet(os.path.join(store_dir, MAP_SPEEDS_FILE), index=False)
+
+    feeds = rollup_route_feeds(rollup_dir)
+    route_mdb = dict(zip(speed_files["route_id"], speed_files["mdb_id"]))
+    route_mdb.update(zip(segment_files["route_id"], segment_files["mdb_id"]))
+    chart_routes = _chart_routes(chart_paths)
+    route_ids = set(route_mdb) | chart_routes | set(feeds["route_id"])
+
+    speeds_by_route = dict(tuple(map_speeds.groupby("route_id", sort=False)))
+    rows = []
+    for route_id in route_ids:
+        speeds = speeds_by_route.get(route_id, map_speeds.iloc[:0])
+        mdb_id = route_mdb.get(route_id)
+        min_lon, min_lat, max_lon, max_lat = _bounding_box(geometries.get(mdb_id), speeds)
+        rows.append({
+            "route_id": route_id,
+            "name": names.get(route_id, f"Route {route_id}"),
+            "featured": route_id in names,
+            "mdb_id": mdb_id,
+            "feed_ids": sorted(feeds.loc[feeds["route_id"] == route_id, "feed_id"]),
+            "n_segments": len(speeds[["prev_stop_id", "stop_id"]].drop_duplicates()),
+            "min_lon": min_lon, "min_lat": min_lat, "max_lon": max_lon, "max_lat": max_lat,
+            "has_chart": route_id in chart_routes,
+            "has_map": not speeds.empty and mdb_id in geometries,
+        })
+
+    catalog = pd.DataFrame(rows, columns=[
+        "route_id", "name", "featured", "mdb_id", "feed_ids", "n_segments",
+        "min_lon", "min_lat", "max_lon", "max_lat", "has_chart", "has_map",
+    ])
+    catalog = catalog.sort_values(["featured", "route_id"], ascending=[False, True]).reset_index(drop=True)
+    catalog.to_parquet(os.path.join(store_dir, ROUTE_CATALOG_FILE), index=False)
+    return catalog
@@ -1,9 +1,8 @@
 import re
-from typing import List, Optional
+from typing import List
 import boto3
 import pandas as pd
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
+from .storage import S3Storage, list_keys, load_parquet_files
 
 def get_s3_client():
     """
@@ -29,32 +28,7 @@ def list_files_in_bucket(bucket_name: str, prefix: str = "") -> List[str]:
     :param prefix: (Optional) Filter to keys beginning with this prefix.
     :return: A list of object keys.
     """
-    s3_client = get_s3_client()
-
-    files = []
-    continuation_token = None
-
-    while True:
-        if continuation_token:
-            response = s3_client.list_objects_v2(
-                Bucket=bucket_name, Prefix=prefix, ContinuationToken=continuation_token
-            )
-        else:
-            response = s3_client.list_objects_v2(
-                Bucket=bucket_name, Prefix=prefix
-            )
-
-        contents = response.get('Contents', [])
-        for obj in contents:
-            files.append(obj['Key'])
-
-        # Check if there's more data to retrieve
-        if response.get('IsTruncated'):
-            continuation_token = response.get('NextContinuationToken')
-        else:
-            break
-
-    return files
+    return list_keys(S3Storage(bucket_name, client=get_s3_client()), prefix)
 
 
 def filter_files_by_pattern(
@@ -84,17 +58,13 @@ def filter_files_by_pattern(
 def read_parquet_from_s3(bucket_name: str, key: str) -> pd.DataFrame:
     """
     Read a Parquet file from S3 directly into a Pandas DataFrame.
-    Requires 'pyarrow' or 'fastparquet' and 's3fs'.
+    Requires 'pyarrow'.
 
     :param bucket_name: S3 bucket name.
     :param key: Key (path) to the Parquet file in the bucket.
     :return: Pandas DataFrame.
     """
-    # Construct the S3 URL in the form s3://bucket-name/key
-    s3_path = f"s3://{bucket_name}/{key}"
-    # pandas can read directly from S3 if s3fs is installed
-    df = pd.read_parquet(s3_path)
-    return df
+    return S3Storage(bucket_name, client=get_s3_client()).read_parquet(key)[0]
 
 
 def upload_file_to_s3(local_file_path: str, bucket_name: str, s3_key: str) -> None:
@@ -134,21 +104,4 @@ def delete_file_in_s3(bucket_name: str, s3_key: str) -> None:
 
 def load_all_parquet_files(file_list, bucket, max_workers=4):
     """Load multiple parquet files from S3 with progress bar"""
-    dfs = []
-    total_files = len(file_list)
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(read_parquet_from_s3, bucket, key) for key in file_list]
-        
-        # Create progress bar
-        with tqdm(total=total_files, desc="Loading parquet files") as pbar:
-            for future in as_completed(futures):
-                try:
-                    dfs.append(future.result())
-                    pbar.update(1)
-                except Exception as e:
-                    print(f"Error reading a file: {e}")
-                    pbar.update(1)
-    
-    print(f"Read {len(dfs)} parquet files from s3")
-    return pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
\ No newline at end of file
+    return load_parquet_files(S3Storage(bucket, client=get_s3_client()), file_list, max_workers)
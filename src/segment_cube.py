@@ -0,0 +1,147 @@
+"""
+Prefix-sum cube over the daily segment rollups.
+
+The cube holds cumulative sums over processed dates of (distance, time,
+observations) for every segment, weekday and rush period of a set of routes.
+Totals for any date window are one subtraction of two cube slices, so average
+speeds and speed differences for arbitrary control/treatment windows are
+answered without touching raw speeds.
+"""
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .rollups import ROLLUPS_DIR, RUSH_PERIODS, SEGMENT_RUSH, SUM_COLUMNS, read_rollup
+
+SEGMENT_KEYS = ["route_id", "prev_stop_id", "stop_id"]
+DISTANCE, TIME, OBSERVATIONS = range(len(SUM_COLUMNS))
+
+
+class SegmentSpeedCube:
+    """
+    Cumulative (distance, time, observations) sums indexed by
+    [date, segment, weekday, rush period, metric].
+    """
+
+    def __init__(self, dates: np.ndarray, segments: pd.DataFrame, cumulative: np.ndarray):
+        """
+        Parameters:
+        dates (np.ndarray): Sorted processed dates (YYYY-MM-DD strings).
+        segments (pd.DataFrame): route_id, prev_stop_id, stop_id for each segment index.
+        cumulative (np.ndarray): Array of shape (len(dates) + 1, len(segments), 7, 3, 3)
+            whose first slice is zero and slice k holds the sums over dates[:k].
+        """
+        self.dates = dates
+        self.segments = segments.reset_index(drop=True)
+        self.cumulative = cumulative
+
+    @classmethod
+    def from_rollups(
+        cls,
+        route_ids: Optional[Iterable[str]] = None,
+        base_dir: str = ROLLUPS_DIR,
+        feed_ids: Optional[Iterable[str]] = None,
+    ) -> "SegmentSpeedCube":
+        """Build the cube from the segment-rush rollups of the selected routes."""
+        sums = read_rollup(SEGMENT_RUSH, base_dir, route_ids, feed_ids=feed_ids)
+        return cls.from_partial_sums(sums)
+
+    @classmethod
+    def from_partial_sums(cls, sums: pd.DataFrame) -> "SegmentSpeedCube":
+        """Build the cube from a DataFrame of daily segment partial sums."""
+        if sums.empty:
+            return cls(np.array([], dtype=object), pd.DataFrame(columns=SEGMENT_KEYS),
+                       np.zeros((1, 0, 7, len(RUSH_PERIODS), len(SUM_COLUMNS))))
+
+        dates = np.unique(sums["service_date"].to_numpy().astype(str))
+        segments = sums[SEGMENT_KEYS].drop_duplicates().sort_values(SEGMENT_KEYS)
+        segment_index = pd.MultiIndex.from_frame(segments)
+
+        date_idx = np.searchsorted(dates, sums["service_date"].to_numpy().astype(str))
+        segment_idx = segment_index.get_indexer(pd.MultiIndex.from_frame(sums[SEGMENT_KEYS]))
+        weekday_idx = sums["weekday"].to_numpy().astype(np.intp)
+        rush_idx = pd.Categorical(sums["rush_hour"], categories=RUSH_PERIODS).codes.astype(np.intp)
+
+        daily = np.zeros((len(dates), len(segments), 7, len(RUSH_PERIODS), len(SUM_COLUMNS)))
+        np.add.at(daily, (date_idx, segment_idx, weekday_idx, rush_idx),
+                  sums[SUM_COLUMNS].to_numpy(dtype=float))
+
+        cumulative = np.zeros((len(dates) + 1,) + daily.shape[1:])
+        np.cumsum(daily, axis=0, out=cumulative[1:])
+        return cls(dates, segments, cumulative)
+
+    def window_sums(self, start_date: str, end_date: str) -> np.ndarray:
+        """
+        Total (distance, time, observations) per segment, weekday and rush period
+        over the inclusive date window, shaped (n_segments, 7, 3, 3).
+        """
+        start = np.searchsorted(self.dates, start_date, side="left")
+        end = np.searchsorted(self.dates, end_date, side="right")
+        if end <= start:
+            return np.zeros(self.cumulative.shape[1:])
+        return self.cumulative[end] - self.cumulative[start]
+
+    @staticmethod
+    def _speeds_mph(sums: np.ndarray) -> np.ndarray:
+        """Convert (distance in feet, time in seconds) sums to mph, NaN where time is zero."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speeds = (sums[..., DISTANCE] / 5280) / (sums[..., TIME] / 3600)
+        return np.where(sums[..., TIME] > 0, speeds, np.nan)
+
+    def _to_frame(self, values: np.ndarray, name: str) -> pd.DataFrame:
+        """Flatten a (segment, weekday, rush period) array, dropping NaN cells."""
+        segment_idx, weekdays, rush_idx = np.nonzero(~np.isnan(values))
+        out = self.segments.iloc[segment_idx].reset_index(drop=True)
+        out["weekday"] = weekdays.astype(np.int32)
+        out["rush_hour"] = np.asarray(RUSH_PERIODS, dtype=object)[rush_idx]
+        out[name] = values[segment_idx, weekdays, rush_idx]
+        return out[["route_id", "stop_id", "prev_stop_id", "weekday", "rush_hour", name]]
+
+    def average_speeds(self, start_date: str, end_date: str) -> pd.DataFrame:
+        """
+        Average speed per segment, weekday and rush period over a date window.
+
+        Returns:
+        pd.DataFrame: route_id, stop_id, prev_stop_id, weekday, rush_hour, avg_speed_mph.
+        """
+        return self._to_frame(self._speeds_mph(self.window_sums(start_date, end_date)),
+                              "avg_speed_mph")
+
+    def speed_diff(self, control: Tuple[str, str], treatment: Tuple[str, str]) -> pd.DataFrame:
+        """
+        Speed difference (control minus treatment) per segment, weekday and rush
+        period, for segments observed in both windows. Matches the schema of
+        `data/map-speeds/*_speed_diff.parquet`.
+
+        Parameters:
+        control (tuple): Inclusive (start_date, end_date) of the control window.
+        treatment (tuple): Inclusive (start_date, end_date) of the treatment window.
+
+        Returns:
+        pd.DataFrame: route_id, stop_id, prev_stop_id, weekday, rush_hour, avg_speed_diff.
+        """
+        control_speeds = self._speeds_mph(self.window_sums(*control))
+        treatment_speeds = self._speeds_mph(self.window_sums(*treatment))
+        return self._to_frame(control_speeds - treatment_speeds, "avg_speed_diff")
+
+
+def segment_speed_diff(
+    route_id: str,
+    control: Tuple[str, str],
+    treatment: Tuple[str, str],
+    weekday: Optional[int] = None,
+    rush_hour: Optional[str] = None,
+    base_dir: str = ROLLUPS_DIR,
+) -> pd.DataFrame:
+    """
+    Speed differences for one route between two date windows, optionally filtered
+    to a weekday and rush period. Builds a one-route cube from the rollups; callers
+    that query repeatedly should keep a `SegmentSpeedCube` around instead.
+    """
+    diff = SegmentSpeedCube.from_rollups([route_id], base_dir).speed_diff(control, treatment)
+    if weekday is not None:
+        diff = diff[diff["weekday"] == weekday]
+    if rush_hour is not None:
+        diff = diff[diff["rush_hour"] == rush_hour]
+    return diff.reset_index(drop=True)
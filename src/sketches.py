@@ -0,0 +1,107 @@
+"""
+Mergeable speed-distribution sketches.
+
+A sketch is a fixed log-binned histogram of segment speeds. Bins are shared by
+every sketch, so merging daily sketches into a sketch for any date range is an
+element-wise sum of counts, and percentiles are read from the merged counts
+with a bounded relative error of half a bin width (about 4%).
+
+Sketches are stored sparsely as two list columns, `bins` (bin indices with a
+non-zero count) and `counts`.
+"""
+from typing import List, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+MIN_SPEED_MPH = 0.5
+MAX_SPEED_MPH = 70.0
+N_BINS = 64
+
+# Speeds below MIN_SPEED_MPH fall into the first bin, speeds above MAX_SPEED_MPH into the last
+BIN_EDGES = np.geomspace(MIN_SPEED_MPH, MAX_SPEED_MPH, N_BINS + 1)
+
+
+def speed_bins(speeds: np.ndarray) -> np.ndarray:
+    """Map speeds in mph to sketch bin indices."""
+    bins = np.searchsorted(BIN_EDGES, np.asarray(speeds, dtype=float), side="right") - 1
+    return np.clip(bins, 0, N_BINS - 1).astype(np.uint8)
+
+
+def build_sketches(speeds: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """
+    Build one sparse sketch of `speed_mph` per group of `keys`.
+
+    :param speeds: Raw speeds with the key columns, speed_mph and segment_length.
+    :param keys: Columns identifying a sketch.
+    :return: DataFrame with the key columns, segment_length, n_obs, and the
+             sparse `bins` (uint8) and `counts` (uint32) list columns.
+    """
+    binned = speeds[keys + ["segment_length"]].assign(bin=speed_bins(speeds["speed_mph"]))
+    counts = binned.groupby(keys + ["bin"], sort=True).size().rename("count").reset_index()
+
+    groups = counts.groupby(keys, sort=False)
+    sketches = groups.size().rename("n_bins").reset_index()
+    offsets = np.concatenate([[0], np.cumsum(sketches["n_bins"].to_numpy())])
+    bins = counts["bin"].to_numpy(dtype=np.uint8)
+    bin_counts = counts["count"].to_numpy(dtype=np.uint32)
+    sketches["bins"] = [bins[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+    sketches["counts"] = [bin_counts[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+    sketches["n_obs"] = groups["count"].sum().to_numpy()
+
+    lengths = binned.groupby(keys, sort=False)["segment_length"].mean().rename("segment_length")
+    sketches = sketches.merge(lengths.reset_index(), on=keys, how="left")
+    return sketches[keys + ["segment_length", "n_obs", "bins", "counts"]]
+
+
+def merge_sketches(sketches: pa.Table, keys: List[str]) -> pd.DataFrame:
+    """
+    Merge sparse sketches that share the same keys into dense count arrays.
+
+    :param sketches: Arrow table of sparse sketches (e.g. daily sketches read from the rollups).
+    :param keys: Columns to merge by.
+    :return: DataFrame with the key columns, segment_length and a `counts` column
+             holding one dense array of N_BINS counts per group.
+    """
+    frame = sketches.select(keys + ["segment_length"]).to_pandas()
+    grouped = frame.groupby(keys, sort=True)
+    group_idx = grouped.ngroup().to_numpy()
+    merged = grouped["segment_length"].mean().reset_index()
+
+    lengths = pc.list_value_length(sketches["bins"]).to_numpy(zero_copy_only=False)
+    flat_bins = pc.list_flatten(sketches["bins"]).to_numpy(zero_copy_only=False).astype(np.intp)
+    flat_counts = pc.list_flatten(sketches["counts"]).to_numpy(zero_copy_only=False)
+
+    dense = np.zeros((len(merged), N_BINS), dtype=np.int64)
+    np.add.at(dense, (np.repeat(group_idx, lengths), flat_bins), flat_counts)
+    merged["counts"] = list(dense)
+    return merged
+
+
+def quantiles(counts: np.ndarray, qs: Sequence[float]) -> np.ndarray:
+    """
+    Read quantiles from dense histogram counts, interpolating log-linearly
+    within the bin that contains each quantile.
+
+    :param counts: Array of shape (n_sketches, N_BINS).
+    :param qs: Quantiles in [0, 1].
+    :return: Array of shape (n_sketches, len(qs)) of speeds in mph, NaN for empty sketches.
+    """
+    counts = np.atleast_2d(np.asarray(counts, dtype=float))
+    cumulative = np.cumsum(counts, axis=1)
+    totals = cumulative[:, -1]
+    log_edges = np.log(BIN_EDGES)
+
+    out = np.full((counts.shape[0], len(qs)), np.nan)
+    rows = np.arange(counts.shape[0])
+    for j, q in enumerate(qs):
+        target = q * totals
+        idx = np.minimum((cumulative < target[:, None]).sum(axis=1), N_BINS - 1)
+        before = cumulative[rows, idx] - counts[rows, idx]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            frac = np.clip((target - before) / counts[rows, idx], 0.0, 1.0)
+        log_value = log_edges[idx] + np.nan_to_num(frac) * (log_edges[idx + 1] - log_edges[idx])
+        out[:, j] = np.where(totals > 0, np.exp(log_value), np.nan)
+    return out
@@ -1,10 +1,33 @@
+import os
+import threading
+import uuid
 import pandas as pd
 import pytz
-import os
-from typing import List, Dict
-from .s3 import list_files_in_bucket, load_all_parquet_files
+from typing import List, Dict, Optional
 from .speeds import BusSpeedCalculator
 from .logger import setup_logger
+from .metrics import metrics_context, reset_peak_rss, stage
+from .manifest import MANIFEST_DIR, Manifest, pipeline_version
+from .raw_speeds import RAW_SPEEDS_DIR, partition_path, remove_partition, write_speeds
+from .rollups import ROLLUPS_DIR, remove_rollups, update_rollups
+from .storage import S3Storage, Storage, list_keys, load_parquet_files
+from .gtfs_rt import load_vehicle_positions
+
+VEHICLE_FORMATS = ("parquet", "protobuf")
+
+
+def build_manifest(vehicle_format: str = "parquet", manifest_dir: str = MANIFEST_DIR) -> Manifest:
+    """Job manifest of the partitions, versioned by the code and the run configuration"""
+    return Manifest(pipeline_version({"vehicle_format": vehicle_format}), manifest_dir)
+
+
+def remove_outputs(manifest: Manifest, feed_id: str, route_id: str, service_date: str,
+                   output_dir: str = RAW_SPEEDS_DIR, rollup_dir: str = ROLLUPS_DIR) -> None:
+    """Delete the raw speeds, rollups and manifest record of one feed/route/date, e.g. when the date moves to another feed"""
+    remove_partition(output_dir, feed_id, route_id, service_date)
+    remove_rollups(feed_id, route_id, service_date, rollup_dir)
+    manifest.remove(feed_id, route_id, service_date)
+
 
 class SpeedCalculator:
     def __init__(
@@ -13,40 +36,65 @@ class SpeedCalculator:
         prefix: str,
         feed_id: str,
         gtfs_dict: Dict,
-        segment_df: pd.DataFrame
+        segment_df: pd.DataFrame,
+        output_dir: str = RAW_SPEEDS_DIR,
+        rollup_dir: str = ROLLUPS_DIR,
+        storage: Optional[Storage] = None,
+        vehicle_format: str = "parquet",
+        manifest_dir: str = MANIFEST_DIR
     ):
         self.bucket = bucket
         self.prefix = prefix
         self.feed_id = feed_id
         self.gtfs_dict = gtfs_dict
         self.segment_df = segment_df
+        self.output_dir = output_dir
+        self.rollup_dir = rollup_dir
+        # Vehicle positions are read from `{prefix}date={date}/` in the bucket, or in a local mirror of it
+        self.storage = storage if storage is not None else S3Storage(bucket)
+        # "parquet" (normalized positions) or "protobuf" (raw GTFS-rt snapshots)
+        if vehicle_format not in VEHICLE_FORMATS:
+            raise ValueError(f"Unknown vehicle format {vehicle_format}, expected one of {VEHICLE_FORMATS}")
+        self.vehicle_format = vehicle_format
+        # Completion records of the feed/route/date partitions
+        self.manifest = build_manifest(vehicle_format, manifest_dir)
         self.logger = setup_logger()
 
-    def process_date(self, date: str, route_list: List[str]) -> pd.DataFrame:
-        """Process vehicle positions for a single date"""
+    def process_date(self, date: str, route_list: List[str],
+                     cancel: Optional[threading.Event] = None) -> pd.DataFrame:
+        """
+        Process vehicle positions for a single date, recording per-stage metrics.
+        If `cancel` is set before the outputs are written, the date is left unwritten.
+        """
+        # Peak RSS of the stages is then the peak of this date and feed
+        reset_peak_rss()
+        with metrics_context(feed_id=self.feed_id, date=date, run_id=uuid.uuid4().hex[:12]):
+            with stage("calculator.process_date") as record:
+                speeds = self._process_date(date, route_list, cancel)
+                record["rows_out"] = 0 if speeds is None else len(speeds)
+        return speeds
+
+    def _process_date(self, date: str, route_list: List[str],
+                      cancel: Optional[threading.Event] = None) -> pd.DataFrame:
         self.logger.info(f"Processing Date: {date}")
 
-        # First check if data already exists
-        output_path = f"data/raw-speeds/{self.feed_id}/bus_speeds_{date}.parquet"
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        
-        if os.path.exists(output_path):
-            self.logger.info(f"Data already exists for {date}, skipping to next date")
+        # First check which routes are missing or stale in the manifest
+        pending_routes = self.manifest.pending_routes(self.feed_id, date, route_list)
+        if not pending_routes:
+            self.logger.info(f"Data already complete for {date}, skipping to next date")
             return None
+        route_list = pending_routes
 
-        # Load relevant realtime data from s3 bucket
-        daily_files = list_files_in_bucket(bucket_name=self.bucket, 
-                                         prefix=f"{self.prefix}date={date}/")
+        # Load relevant realtime data from the bucket (or its mirror)
         try:
-            vehicle_positions = load_all_parquet_files(file_list=daily_files, 
-                                                     bucket=self.bucket)
+            vehicle_positions = self._load_vehicle_positions(date)
         except Exception as e:
-            self.logger.error(f"Error loading parquets from s3 for {date}: {e}")
+            self.logger.error(f"Error loading parquets from {self.storage.scheme} for {date}: {e}")
             return None
         
        # ! Check if vehicle_positions is empty
         if vehicle_positions.empty:
-            self.logger.info(f"No vehicle positions found in s3 for {date}. Skipping to next date")
+            self.logger.info(f"No vehicle positions found in {self.storage.scheme} for {date}. Skipping to next date")
             return None
 
         # Filter vps by routes in route_list
@@ -58,6 +106,10 @@ class SpeedCalculator:
         missing_routes = set(route_list) - set(vehicle_positions['trip.route_id'].unique())
         if missing_routes:
             self.logger.warning(f"Missing routes in vehicle positions for {date}: {missing_routes}")
+        if vehicle_positions.empty:
+            # None of the routes ran on the date; record them so reruns do not reload it
+            self._record_complete(date, route_list, pd.DataFrame(columns=["route_id"]))
+            return None
 
 
         # Calculate speeds
@@ -76,13 +128,49 @@ class SpeedCalculator:
             return None
 
         # Process the speeds DataFrame
-        speeds = self._process_speeds_df(speeds)
+        with stage("calculator.process_speeds", rows_in=len(speeds)) as record:
+            speeds = self._process_speeds_df(speeds)
+            record["rows_out"] = len(speeds)
         
-        # Save results
-        speeds.to_parquet(output_path)
+        if cancel is not None and cancel.is_set():
+            self.logger.warning(f"Processing of {date} was cancelled, leaving its outputs unwritten")
+            return None
+
+        # Save results as one feed/route/date partition per route
+        with stage("calculator.write_speeds", rows_in=len(speeds)):
+            write_speeds(speeds, self.feed_id, date, self.output_dir)
         self.logger.info(f"Wrote daily data for {date}")
+
+        # Fold the day into the additive rollups used by the charts
+        with stage("calculator.update_rollups", rows_in=len(speeds)):
+            update_rollups(speeds, self.feed_id, date, self.rollup_dir)
+        self.logger.info(f"Updated rollups for {date}")
+
+        # Record completion last, so a crash before this point leaves the routes pending
+        self._record_complete(date, route_list, speeds)
         return speeds
 
+    def _record_complete(self, date: str, route_list: List[str], speeds: pd.DataFrame):
+        """Write the manifest records of the processed routes, including those without speeds"""
+        rows = speeds["route_id"].astype(str).value_counts()
+        for route in route_list:
+            n_rows = int(rows.get(route, 0))
+            if n_rows:
+                files = [os.path.join(partition_path(self.output_dir, self.feed_id, route, date), "part-0.parquet")]
+            else:
+                # Outputs of an earlier version would otherwise survive the reprocessing
+                remove_partition(self.output_dir, self.feed_id, route, date)
+                remove_rollups(self.feed_id, route, date, self.rollup_dir)
+                files = []
+            self.manifest.complete(self.feed_id, route, date, files, n_rows)
+
+    def _load_vehicle_positions(self, date: str) -> pd.DataFrame:
+        """Load every vehicle position parquet (or GTFS-rt snapshot) of a date from the storage"""
+        if self.vehicle_format == "protobuf":
+            return load_vehicle_positions(self.storage, f"{self.prefix}date={date}/", date)
+        daily_files = list_keys(self.storage, prefix=f"{self.prefix}date={date}/")
+        return load_parquet_files(self.storage, daily_files)
+
     def _process_speeds_df(self, speeds: pd.DataFrame) -> pd.DataFrame:
         """Process the speeds DataFrame - exactly matching notebook logic"""
         # Drop cols that are not needed
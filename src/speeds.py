@@ -5,6 +5,8 @@ from shapely.ops import linemerge
 import bisect
 from tqdm import tqdm
 import logging
+from .metrics import stage
+from .profiling import profiled
 
 class BusSpeedCalculator:
     """
@@ -36,6 +38,12 @@ class BusSpeedCalculator:
         Returns:
         gpd.GeoDataFrame: Prepared buses GeoDataFrame.
         """
+        with stage("speeds.prep_buses", rows_in=len(self.buses_raw)) as record:
+            buses = self._prep_buses()
+            record["rows_out"] = len(buses)
+        return buses
+
+    def _prep_buses(self):
         buses = self.buses_raw.copy()
         
         # Create geometry
@@ -89,9 +97,11 @@ class BusSpeedCalculator:
         dict: Dictionary mapping shape_id to merged LineString geometry.
         """
         # Group by 'shape_id' and merge LineStrings
-        full_strings = self.GTFS_segments.groupby("shape_id")["geometry"].apply(
-            lambda x: linemerge(list(x.dropna()))
-        )
+        with stage("speeds.full_strings", rows_in=len(self.GTFS_segments)) as record:
+            full_strings = self.GTFS_segments.groupby("shape_id")["geometry"].apply(
+                lambda x: linemerge(list(x.dropna()))
+            )
+            record["rows_out"] = len(full_strings)
         return full_strings.to_dict()
 
     def add_position_on_route(self, buses, full_strings_dict):
@@ -112,11 +122,13 @@ class BusSpeedCalculator:
         positions.fill(np.nan)
 
         # Loop over buses
-        for i, (point, shape_id) in enumerate(zip(buses['geometry'], buses['shape_id'])):
-            if pd.notnull(point) and shape_id in full_strings_dict:
-                line = full_strings_dict[shape_id]
-                distances[i] = point.distance(line)
-                positions[i] = line.project(point)
+        with stage("speeds.projection", rows_in=len(buses)) as record:
+            for i, (point, shape_id) in enumerate(zip(buses['geometry'], buses['shape_id'])):
+                if pd.notnull(point) and shape_id in full_strings_dict:
+                    line = full_strings_dict[shape_id]
+                    distances[i] = point.distance(line)
+                    positions[i] = line.project(point)
+            record["rows_out"] = int(np.isfinite(positions).sum())
 
         # Assign to DataFrame
         buses['distance_to_line'] = distances
@@ -179,6 +191,13 @@ class BusSpeedCalculator:
         buses = self.prep_buses()
         buses_with_speeds = self.add_position_on_route(buses, full_strings)
 
+        with stage("speeds.trip_loop", rows_in=len(buses_with_speeds)) as record:
+            trip_speeds = self._trip_speeds(buses_with_speeds)
+            record["rows_out"] = len(trip_speeds)
+        return trip_speeds
+
+    def _trip_speeds(self, buses_with_speeds):
+        """Interpolate segment crossing times and speeds trip by trip."""
         trip_ids = buses_with_speeds["unique_trip_id"].drop_duplicates()
         buses_with_speeds = buses_with_speeds.set_index("unique_trip_id")
         trip_speeds = {}
@@ -195,28 +214,30 @@ class BusSpeedCalculator:
             route_id = trip_df['route_id'].iloc[0]
             
             trip_df = trip_df.sort_values(by="timestamp")
-            trip_df = self._longest_increasing_subsequence(trip_df)
+            with profiled("speeds.lis"):
+                trip_df = self._longest_increasing_subsequence(trip_df)
             trip_df["epoch_timestamp"] = trip_df["timestamp"].astype(int)
 
             shape_id = trip_df["shape_id"].iloc[0]
             trip_segments = self.GTFS_segments[self.GTFS_segments["shape_id"] == shape_id].copy()
             trip_segments = trip_segments.sort_values("projected_position")
 
-            trip_segments["interpolated_time"] = pd.to_datetime(
-                np.round(
-                    np.interp(
-                        trip_segments["projected_position"],
-                        trip_df["position_on_line"],
-                        trip_df["epoch_timestamp"]
-                    )
-                ),
-                unit='s'
-            )
-
-            trip_segments["time_elapsed"] = trip_segments["interpolated_time"].diff().dt.total_seconds()
-            trip_segments["speed_mph"] = (
-                (trip_segments["segment_length"] / trip_segments["time_elapsed"]) * 0.681818
-            )
+            with profiled("speeds.interpolation"):
+                trip_segments["interpolated_time"] = pd.to_datetime(
+                    np.round(
+                        np.interp(
+                            trip_segments["projected_position"],
+                            trip_df["position_on_line"],
+                            trip_df["epoch_timestamp"]
+                        )
+                    ),
+                    unit='s'
+                )
+
+                trip_segments["time_elapsed"] = trip_segments["interpolated_time"].diff().dt.total_seconds()
+                trip_segments["speed_mph"] = (
+                    (trip_segments["segment_length"] / trip_segments["time_elapsed"]) * 0.681818
+                )
             trip_segments["unique_trip_id"] = trip_id
             # Add route_id to trip_segments
             trip_segments["route_id"] = route_id
@@ -0,0 +1,177 @@
+"""
+Static export of the dashboard for hosting on object storage or a CDN.
+
+Every route is rendered in its own worker process into one compact JSON
+bundle holding, for each weekday and rush period:
+- the interpolated hourly chart speeds before and after,
+- the displayed speed change and colour class of each map segment.
+
+The geometry of the segments a route uses is stored once per route as
+encoded polylines. A manifest lists the routes, days, rush periods and
+colour palettes, and the static viewer (`static_viewer.html`, copied as
+`index.html`) reproduces the chart, map and legend in the browser,
+including the colour-blind and dark modes.
+
+Output layout:
+    {output_dir}/index.html
+    {output_dir}/manifest.json
+    {output_dir}/routes/{route_id}.json
+"""
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .dashboard_app import DAY_OPTIONS, RUSH_HOURS
+from .dashboard_data import CONTROL_PERIOD, TREATMENT_PERIOD, DashboardData
+from .geometry_cache import encode_polyline
+from .map_render import COLOR_LEVELS, color_classes, speed_diff_classes
+from .rollups import ROLLUPS_DIR
+from .segment_cube import SegmentSpeedCube
+
+VIEWER_TEMPLATE = os.path.join(os.path.dirname(__file__), "static_viewer.html")
+STATIC_EXPORT_DIR = "site"
+
+# (decrease, increase) colours of the dashboard for each colour mode
+COLORS = {
+    "default": ("#FF6347", "#4169E1"),
+    "color_blind": ("#D55E00", "#0072B2"),
+}
+
+
+def _json_floats(values: np.ndarray, decimals: int = 2) -> List[Optional[float]]:
+    """Round floats for JSON, mapping NaN to null."""
+    return [None if np.isnan(v) else v for v in np.round(np.asarray(values, dtype=float), decimals).tolist()]
+
+
+def route_speed_diffs(data: DashboardData, route_id: str, rollup_dir: str = ROLLUPS_DIR) -> Optional[pd.DataFrame]:
+    """
+    Segment speed differences of a route for every weekday and rush period,
+    from the rollup cube when available and from `data/map-speeds/` otherwise.
+    """
+    cube = SegmentSpeedCube.from_rollups([route_id], rollup_dir)
+    if len(cube.dates):
+        return cube.speed_diff(CONTROL_PERIOD, TREATMENT_PERIOD)
+    frames = []
+    for weekday in range(len(DAY_OPTIONS)):
+        for rush_hour in RUSH_HOURS.values():
+            diff = data.speed_diff(route_id, weekday, rush_hour)
+            if diff is not None:
+                frames.append(diff.assign(weekday=weekday, rush_hour=rush_hour))
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+def route_bundle(route_name: str, route_id: str, rollup_dir: str = ROLLUPS_DIR) -> dict:
+    """
+    Build the viewer bundle of one route.
+
+    :param route_name: Display name of the route.
+    :param route_id: Route ID.
+    :param rollup_dir: Rollup store directory.
+    :return: JSON-serializable dict with hourly chart speeds, segment geometry and map colours.
+    """
+    data = DashboardData()
+    bundle = {"id": route_id, "name": route_name, "hourly": {}, "segments": None, "maps": {}}
+
+    for weekday in range(len(DAY_OPTIONS)):
+        before, after = data.hourly_speeds(route_id, weekday)
+        bundle["hourly"][str(weekday)] = {
+            "before": _json_floats(pd.Series(before).interpolate(method="linear")),
+            "after": _json_floats(pd.Series(after).interpolate(method="linear")),
+        }
+
+    geometry = data.route_geometry(route_id)
+    speed_diffs = route_speed_diffs(data, route_id, rollup_dir)
+    if geometry is None or speed_diffs is None:
+        return bundle
+
+    # Segment files cover a whole feed; keep only the segments this route uses
+    merged = geometry.join(speed_diffs)
+    used_rows = np.unique(merged["row"].to_numpy())
+    offsets = geometry.offsets
+    bundle["segments"] = {
+        "prev_stop_name": geometry.segments["prev_stop_name"].iloc[used_rows].astype(str).tolist(),
+        "stop_name": geometry.segments["stop_name"].iloc[used_rows].astype(str).tolist(),
+        "polyline": [
+            encode_polyline(geometry.lats[offsets[row]:offsets[row + 1]], geometry.lons[offsets[row]:offsets[row + 1]])
+            for row in used_rows
+        ],
+    }
+
+    merged["row"] = np.searchsorted(used_rows, merged["row"].to_numpy())
+    for (weekday, rush_hour), group in merged.groupby(["weekday", "rush_hour"], sort=True):
+        if rush_hour not in RUSH_HOURS.values():
+            continue
+        max_abs_diff = float(np.ceil(group["avg_speed_diff"].abs().max()))
+        displayed = -group["avg_speed_diff"].to_numpy()
+        bundle["maps"][f"{int(weekday)}-{rush_hour}"] = {
+            "rows": group["row"].tolist(),
+            "speed_diffs": _json_floats(displayed),
+            "classes": speed_diff_classes(displayed, max_abs_diff).tolist(),
+            "max_abs_diff": max_abs_diff,
+        }
+    return bundle
+
+
+def _export_route(task: Tuple[str, str, str, str]) -> Tuple[str, int]:
+    """Worker: write one route bundle and return (route_id, number of maps)."""
+    route_name, route_id, output_dir, rollup_dir = task
+    bundle = route_bundle(route_name, route_id, rollup_dir)
+    path = os.path.join(output_dir, "routes", f"{route_id}.json")
+    with open(path, "w") as f:
+        json.dump(bundle, f, separators=(",", ":"))
+    return route_id, len(bundle["maps"])
+
+
+def manifest(route_names: Dict[str, str]) -> dict:
+    """Viewer manifest: routes, selector options and colour palettes."""
+    return {
+        "routes": [{"name": name, "id": route_id} for name, route_id in route_names.items()],
+        "days": DAY_OPTIONS,
+        "rush_hours": RUSH_HOURS,
+        "control_period": CONTROL_PERIOD,
+        "treatment_period": TREATMENT_PERIOD,
+        "colors": {
+            mode: {
+                "decrease": decrease,
+                "increase": increase,
+                "classes": color_classes(decrease, increase, COLOR_LEVELS),
+            }
+            for mode, (decrease, increase) in COLORS.items()
+        },
+    }
+
+
+def export_static(
+    output_dir: str = STATIC_EXPORT_DIR,
+    route_ids: Optional[Sequence[str]] = None,
+    workers: Optional[int] = None,
+    rollup_dir: str = ROLLUPS_DIR,
+) -> Dict[str, int]:
+    """
+    Render the dashboard into a static site.
+
+    :param output_dir: Directory to write the site to.
+    :param route_ids: (Optional) Routes to export (default: all dashboard routes).
+    :param workers: (Optional) Number of worker processes (default: one per CPU).
+    :param rollup_dir: Rollup store directory.
+    :return: Number of exported maps per route ID.
+    """
+    route_names = {
+        name: route_id for name, route_id in DashboardData().routes().items()
+        if route_ids is None or route_id in route_ids
+    }
+    os.makedirs(os.path.join(output_dir, "routes"), exist_ok=True)
+
+    tasks = [(name, route_id, output_dir, rollup_dir) for name, route_id in route_names.items()]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        exported = dict(executor.map(_export_route, tasks))
+
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest(route_names), f, separators=(",", ":"))
+    shutil.copyfile(VIEWER_TEMPLATE, os.path.join(output_dir, "index.html"))
+    return exported
@@ -0,0 +1,314 @@
+"""
+Storage backends for the input data: S3, HTTP(S) and local directories.
+
+Every backend exposes the same small interface over keys relative to its root:
+
+    list(prefix)             keys under a prefix
+    stat(key)                size and modification time
+    read(key, start, length) bytes of a whole object or a byte range
+    open(key)                a binary stream, for sequential reads of large objects
+    open_arrow(key)          a pyarrow random-access file (memory-mapped for local files)
+
+`open_storage` builds a backend from a URI: `s3://bucket/prefix`,
+`https://host/path` or a local directory. Since `mirror` copies a bucket prefix
+to a local directory with the same layout, the pipeline reads the mirror with
+`LocalStorage` exactly as it reads the bucket, e.g.
+`runner.py --storage data/mirror` after `mirror_bucket.py --dest data/mirror`.
+"""
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import BinaryIO, Iterable, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+from tqdm import tqdm
+
+from .metrics import stage
+
+COPY_CHUNK_SIZE = 2 ** 20
+# Normalized vehicle positions, partitioned as `{VEHICLES_PREFIX}date=YYYY-MM-DD/`
+VEHICLES_URI = "s3://dataclinic-gtfs-rt"
+VEHICLES_PREFIX = "norm/bus-mta-vp/vehicles/"
+
+
+class ObjectInfo(NamedTuple):
+    key: str
+    size: int
+    modified: Optional[datetime]
+
+
+class Storage:
+    """Base class of the storage backends; keys are '/'-separated and relative to the root."""
+
+    scheme = ""
+
+    def list(self, prefix: str = "") -> List[str]:
+        raise NotImplementedError(f"{type(self).__name__} cannot list keys")
+
+    def stat(self, key: str) -> ObjectInfo:
+        raise NotImplementedError
+
+    def read(self, key: str, start: int = 0, length: Optional[int] = None) -> bytes:
+        raise NotImplementedError
+
+    def open(self, key: str) -> BinaryIO:
+        raise NotImplementedError
+
+    def open_arrow(self, key: str):
+        import pyarrow as pa
+        return pa.BufferReader(self.read(key))
+
+    def read_parquet(self, key: str, columns: Optional[List[str]] = None) -> Tuple[pd.DataFrame, int]:
+        """Read a Parquet object into a DataFrame; also returns the number of bytes read."""
+        import pyarrow.parquet as pq
+        with self.open_arrow(key) as source:
+            table = pq.read_table(source, columns=columns)
+            size = source.size()
+        return table.to_pandas(), size
+
+
+class LocalStorage(Storage):
+    """A local directory, e.g. a mirror of the bucket."""
+
+    scheme = "local"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def list(self, prefix: str = "") -> List[str]:
+        # Walk only the directory part of the prefix, then filter on the rest
+        directory = prefix.rsplit("/", 1)[0] if "/" in prefix else ""
+        keys = []
+        for root, _, files in os.walk(self._path(directory)):
+            relative = os.path.relpath(root, self.root).replace(os.sep, "/")
+            for name in files:
+                key = name if relative == "." else f"{relative}/{name}"
+                if key.startswith(prefix) and not name.startswith("."):
+                    keys.append(key)
+        return sorted(keys)
+
+    def stat(self, key: str) -> ObjectInfo:
+        info = os.stat(self._path(key))
+        return ObjectInfo(key, info.st_size, datetime.fromtimestamp(info.st_mtime, timezone.utc))
+
+    def read(self, key: str, start: int = 0, length: Optional[int] = None) -> bytes:
+        with open(self._path(key), "rb") as f:
+            f.seek(start)
+            return f.read() if length is None else f.read(length)
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self._path(key), "rb")
+
+    def open_arrow(self, key: str):
+        import pyarrow as pa
+        return pa.memory_map(self._path(key))
+
+    def write(self, key: str, stream: BinaryIO) -> int:
+        """Write a stream to a key atomically (temporary file, then rename); returns the bytes written."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                shutil.copyfileobj(stream, f, COPY_CHUNK_SIZE)
+                size = f.tell()
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return size
+
+
+class S3Storage(Storage):
+    """An S3 bucket, optionally below a root prefix. Credentials come from the standard AWS configuration."""
+
+    scheme = "s3"
+
+    def __init__(self, bucket: str, root: str = "", client=None):
+        self.bucket = bucket
+        self.root = root.strip("/") + "/" if root.strip("/") else ""
+        self._client = client
+
+    def __getstate__(self):
+        # boto3 clients cannot be pickled; worker processes create their own
+        return {**self.__dict__, "_client": None}
+
+    @property
+    def client(self):
+        if self._client is None:
+            import boto3
+            self._client = boto3.client("s3")
+        return self._client
+
+    def list(self, prefix: str = "") -> List[str]:
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.root + prefix):
+            keys.extend(obj["Key"][len(self.root):] for obj in page.get("Contents", []))
+        return keys
+
+    def stat(self, key: str) -> ObjectInfo:
+        head = self.client.head_object(Bucket=self.bucket, Key=self.root + key)
+        return ObjectInfo(key, head["ContentLength"], head.get("LastModified"))
+
+    def _get(self, key: str, start: int = 0, length: Optional[int] = None):
+        kwargs = {}
+        if start or length is not None:
+            end = "" if length is None else start + length - 1
+            kwargs["Range"] = f"bytes={start}-{end}"
+        return self.client.get_object(Bucket=self.bucket, Key=self.root + key, **kwargs)["Body"]
+
+    def read(self, key: str, start: int = 0, length: Optional[int] = None) -> bytes:
+        return self._get(key, start, length).read()
+
+    def open(self, key: str) -> BinaryIO:
+        return self._get(key)
+
+
+class HTTPStorage(Storage):
+    """Files under a base URL. HTTP has no listing, so keys must be known."""
+
+    scheme = "http"
+
+    def __init__(self, base_url: str, timeout: float = 60):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def _url(self, key: str) -> str:
+        return f"{self.base_url}/{key}" if key else self.base_url
+
+    def stat(self, key: str) -> ObjectInfo:
+        import requests
+        response = requests.head(self._url(key), allow_redirects=True, timeout=self.timeout)
+        response.raise_for_status()
+        modified = response.headers.get("Last-Modified")
+        return ObjectInfo(key, int(response.headers.get("Content-Length", -1)),
+                          parsedate_to_datetime(modified) if modified else None)
+
+    def read(self, key: str, start: int = 0, length: Optional[int] = None) -> bytes:
+        import requests
+        headers = {}
+        if start or length is not None:
+            end = "" if length is None else start + length - 1
+            headers["Range"] = f"bytes={start}-{end}"
+        response = requests.get(self._url(key), headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+        if headers and response.status_code != 206:
+            # The server ignored the range and sent the whole file
+            return response.content[start:None if length is None else start + length]
+        return response.content
+
+    def open(self, key: str) -> BinaryIO:
+        import requests
+        response = requests.get(self._url(key), stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        response.raw.decode_content = True
+        return response.raw
+
+
+def open_storage(uri: str) -> Storage:
+    """
+    Build a storage backend from a URI.
+
+    :param uri: `s3://bucket[/prefix]`, `http(s)://host[/path]` or a local directory.
+    """
+    if uri.startswith("s3://"):
+        bucket, _, root = uri[len("s3://"):].partition("/")
+        return S3Storage(bucket, root)
+    if uri.startswith(("http://", "https://")):
+        return HTTPStorage(uri)
+    return LocalStorage(uri)
+
+
+def split_uri(uri: str) -> Tuple[Storage, str]:
+    """Split the URI of a single object into the storage of its parent and its key."""
+    if uri.startswith("s3://"):
+        bucket, _, key = uri[len("s3://"):].partition("/")
+        return S3Storage(bucket), key
+    if uri.startswith(("http://", "https://")):
+        parent, _, key = uri.rpartition("/")
+        return HTTPStorage(parent), key
+    directory, name = os.path.split(uri)
+    return LocalStorage(directory or "."), name
+
+
+def list_keys(storage: Storage, prefix: str = "") -> List[str]:
+    """List the keys under a prefix, recording a `{scheme}.list` metrics stage."""
+    with stage(f"{storage.scheme}.list") as record:
+        keys = storage.list(prefix)
+        record["rows_out"] = len(keys)
+    return keys
+
+
+def load_parquet_files(storage: Storage, keys: List[str], max_workers: int = 4) -> pd.DataFrame:
+    """
+    Read Parquet objects in parallel into one DataFrame, recording a `{scheme}.load`
+    metrics stage. Objects that fail to read are reported and skipped.
+    """
+    dfs = []
+    bytes_read = 0
+    with stage(f"{storage.scheme}.load", rows_in=len(keys)) as record:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(storage.read_parquet, key) for key in keys]
+            with tqdm(total=len(keys), desc="Loading parquet files") as pbar:
+                for future in as_completed(futures):
+                    try:
+                        df, size = future.result()
+                        dfs.append(df)
+                        bytes_read += size
+                    except Exception as e:
+                        print(f"Error reading a file: {e}")
+                    pbar.update(1)
+
+        print(f"Read {len(dfs)} parquet files from {storage.scheme}")
+        data = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()
+        record["rows_out"] = len(data)
+        record["bytes_read"] = bytes_read
+    return data
+
+
+def mirror(source: Storage, target: LocalStorage, prefixes: Iterable[str], max_workers: int = 8) -> dict:
+    """
+    Copy every object under the prefixes to a local directory with the same layout.
+    Objects already mirrored with the same size are skipped, and each copy is written
+    to a temporary file and renamed, so an interrupted mirror can simply be rerun.
+
+    :return: Counts of copied, skipped and failed objects and the bytes copied.
+    """
+    keys = [key for prefix in prefixes for key in list_keys(source, prefix)]
+    counts = {"copied": 0, "skipped": 0, "failed": 0, "bytes": 0}
+
+    def copy(key: str) -> Optional[int]:
+        try:
+            if target.stat(key).size == source.stat(key).size:
+                return None
+        except FileNotFoundError:
+            pass
+        stream = source.open(key)
+        try:
+            return target.write(key, stream)
+        finally:
+            stream.close()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(copy, key): key for key in keys}
+        with tqdm(total=len(keys), desc="Mirroring") as pbar:
+            for future in as_completed(futures):
+                try:
+                    size = future.result()
+                    if size is None:
+                        counts["skipped"] += 1
+                    else:
+                        counts["copied"] += 1
+                        counts["bytes"] += size
+                except Exception as e:
+                    print(f"Error mirroring {futures[future]}: {e}")
+                    counts["failed"] += 1
+                pbar.update(1)
+    return counts
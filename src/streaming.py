@@ -0,0 +1,215 @@
+"""
+Incremental segment speeds from a live or replayed vehicle-position feed.
+
+`BusSpeedCalculator` needs a whole day of pings before it computes any trip.
+`StreamingSpeedCalculator` instead consumes batches of pings in timestamp order
+(e.g. one GTFS-rt snapshot every 30 seconds) and emits a segment's speed as soon
+as a bus crosses the stop that ends it.
+
+Per trip it keeps a few numbers: the last accepted position along the shape and
+its time (the tail of the increasing subsequence), the index of the next stop
+boundary and the time the previous boundary was crossed. Like the batch LIS, a
+ping is accepted only if it moves forward along the shape. As the stream cannot
+look ahead, a forward jump faster than `max_speed_mph` is rejected as a GPS
+outlier instead of being outvoted by later pings. Boundary crossing times are
+interpolated linearly between accepted pings, as `np.interp` does in the batch
+calculator, and the emitted rows have the same columns as
+`BusSpeedCalculator.create_trip_speeds`.
+
+Trips that have not reported for `ttl` seconds of feed time are evicted.
+"""
+import bisect
+from collections import OrderedDict
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
+
+from .speeds import BusSpeedCalculator
+
+FEET_PER_SECOND_TO_MPH = 0.681818
+MAX_SPEED_MPH = 70.0
+TRIP_TTL = 30 * 60
+
+
+class _TripState:
+    __slots__ = ("shape", "route_id", "seen", "position", "time", "next_boundary", "crossed_time")
+
+    def __init__(self, shape: int, route_id: str):
+        self.shape = shape
+        self.route_id = route_id
+        self.seen = None
+        self.position = None
+        self.time = None
+        self.next_boundary = 0
+        self.crossed_time = None
+
+
+class StreamingSpeedCalculator:
+    """Segment speeds computed incrementally from batches of vehicle positions."""
+
+    def __init__(self, GTFS_dict, GTFS_segments, in_crs=4326, out_crs=2263,
+                 ttl: float = TRIP_TTL, max_speed_mph: float = MAX_SPEED_MPH):
+        """
+        Parameters:
+        GTFS_dict (dict): GTFS static feed files as DataFrames.
+        GTFS_segments (gpd.GeoDataFrame): Segments of the feed, from `GTFS_shape_processor.process_shapes`.
+        in_crs (int): CRS of the ping coordinates. Default is 4326.
+        out_crs (int): CRS of the segments, in feet. Default is 2263.
+        ttl (float): Seconds of feed time after which a silent trip is evicted.
+        max_speed_mph (float): Faster forward jumps between accepted pings are rejected.
+        """
+        from pyproj import Transformer
+
+        self.transformer = Transformer.from_crs(in_crs, out_crs, always_xy=True)
+        self.ttl = ttl
+        self.max_speed = max_speed_mph / FEET_PER_SECOND_TO_MPH
+        full_strings = BusSpeedCalculator(None, GTFS_dict, GTFS_segments).prep_full_strings()
+
+        # One table of segments sorted by shape and position; a shape is a slice of it
+        segments = GTFS_segments.drop(columns="geometry")
+        segments = segments[segments["shape_id"].isin(full_strings.keys())]
+        self.segments = segments.sort_values(["shape_id", "projected_position"], kind="stable", ignore_index=True)
+        self.shape_ids = list(self.segments["shape_id"].drop_duplicates())
+        self.shape_index = {shape_id: i for i, shape_id in enumerate(self.shape_ids)}
+        self.lines = [full_strings[shape_id] for shape_id in self.shape_ids]
+        starts = self.segments.groupby("shape_id", sort=False).indices
+        self.offsets = [int(starts[shape_id][0]) for shape_id in self.shape_ids]
+        positions = self.segments["projected_position"].to_numpy()
+        self.boundaries = [positions[starts[shape_id]].tolist() for shape_id in self.shape_ids]
+        self.lengths = self.segments["segment_length"].to_numpy()
+        self._segment_columns = {name: self.segments[name].to_numpy() for name in self.segments.columns}
+
+        trips = GTFS_dict["trips.txt"][["trip_id", "shape_id"]].drop_duplicates("trip_id")
+        self.trip_shapes = {trip_id: self.shape_index[shape_id]
+                            for trip_id, shape_id in zip(trips["trip_id"].astype(str), trips["shape_id"])
+                            if shape_id in self.shape_index}
+
+        self.trips: "OrderedDict[str, _TripState]" = OrderedDict()
+        self.watermark = None
+        self.stats = dict.fromkeys(["pings", "accepted", "unknown_trip", "emitted", "evicted"], 0)
+
+    def _project(self, longitudes: np.ndarray, latitudes: np.ndarray, shapes: np.ndarray) -> np.ndarray:
+        """Position of every ping along its trip's shape, in feet."""
+        import shapely
+
+        points = shapely.points(*self.transformer.transform(longitudes, latitudes))
+        positions = np.empty(len(points))
+        for shape in np.unique(shapes):
+            rows = np.flatnonzero(shapes == shape)
+            positions[rows] = shapely.line_locate_point(self.lines[shape], points[rows])
+        return positions
+
+    def process(self, pings: pd.DataFrame) -> pd.DataFrame:
+        """
+        Consume a batch of vehicle positions and return the segment speeds it completed.
+
+        Parameters:
+        pings (pd.DataFrame): Vehicle positions with the columns of the normalized
+            vehicle-position parquet. Pings older than a trip's last accepted ping are ignored.
+
+        Returns:
+        pd.DataFrame: One row per completed segment, with the columns of
+            `BusSpeedCalculator.create_trip_speeds`.
+        """
+        self.stats["pings"] += len(pings)
+        # Plain arrays: a feed batch is small, and pandas overhead would dominate
+        trip_ids = pings["trip.trip_id"].astype(str).to_numpy()
+        shapes = np.array([self.trip_shapes.get(trip_id, -1) for trip_id in trip_ids], dtype=int)
+        known = shapes >= 0
+        self.stats["unknown_trip"] += int((~known).sum())
+        if not known.any():
+            return self._emit([], [], [], [], [])
+        timestamps = pings["timestamp"].to_numpy()[known]
+        order = np.argsort(timestamps, kind="stable")
+        rows_in = np.flatnonzero(known)[order]
+        timestamps, shapes, trip_ids = timestamps[order], shapes[rows_in], trip_ids[rows_in]
+        vehicles = pings["vehicle.id"].astype(str).to_numpy()[rows_in]
+        start_dates = pings["trip.start_date"].astype(str).to_numpy()[rows_in]
+        route_ids = pings["trip.route_id"].to_numpy()[rows_in]
+        positions = self._project(pings["position.longitude"].to_numpy()[rows_in],
+                                  pings["position.latitude"].to_numpy()[rows_in], shapes)
+
+        rows, emitted_trips, emitted_routes, times, elapsed = [], [], [], [], []
+        for trip_id, vehicle, start_date, shape, route_id, position, time in zip(
+                trip_ids, vehicles, start_dates, shapes.tolist(), route_ids, positions.tolist(), timestamps.tolist()):
+            trip_key = trip_id + vehicle + start_date
+            state = self.trips.get(trip_key)
+            if state is None:
+                state = self.trips[trip_key] = _TripState(shape, route_id)
+                state.seen = time
+            elif time >= state.seen:
+                # Late pings leave the trip in place, so `evict` can rely on the order by last ping
+                self.trips.move_to_end(trip_key)
+                state.seen = time
+            if position != position:
+                # NaN: the point could not be projected
+                continue
+            if state.time is None:
+                state.next_boundary = bisect.bisect_right(self.boundaries[shape], position)
+            else:
+                # Keep the sequence increasing in time and position, and skip implausible jumps
+                if time <= state.time or position <= state.position:
+                    continue
+                if position - state.position > self.max_speed * (time - state.time):
+                    continue
+                boundaries = self.boundaries[shape]
+                i = state.next_boundary
+                while i < len(boundaries) and boundaries[i] <= position:
+                    crossed = state.time + (boundaries[i] - state.position) / (position - state.position) \
+                        * (time - state.time)
+                    if state.crossed_time is not None and crossed > state.crossed_time:
+                        rows.append(self.offsets[shape] + i)
+                        emitted_trips.append(trip_key)
+                        emitted_routes.append(route_id)
+                        times.append(crossed)
+                        elapsed.append(crossed - state.crossed_time)
+                    state.crossed_time = crossed
+                    i += 1
+                state.next_boundary = i
+            state.position, state.time = position, time
+            self.stats["accepted"] += 1
+
+        latest = timestamps[-1].item()
+        self.watermark = latest if self.watermark is None else max(self.watermark, latest)
+        self.evict(self.watermark - self.ttl)
+        return self._emit(rows, emitted_trips, emitted_routes, times, elapsed)
+
+    def _emit(self, rows: List[int], trip_ids: List[str], route_ids: List[str],
+              times: List[float], elapsed: List[float]) -> pd.DataFrame:
+        elapsed = np.asarray(elapsed, dtype=float)
+        columns = {name: values[rows] for name, values in self._segment_columns.items()}
+        columns["interpolated_time"] = pd.to_datetime(np.round(np.asarray(times, dtype=float)), unit="s")
+        columns["time_elapsed"] = elapsed
+        columns["speed_mph"] = self.lengths[rows] / elapsed * FEET_PER_SECOND_TO_MPH
+        columns["unique_trip_id"] = np.asarray(trip_ids, dtype=object)
+        columns["route_id"] = np.asarray(route_ids, dtype=object)
+        self.stats["emitted"] += len(rows)
+        return pd.DataFrame(columns)
+
+    def evict(self, before: float) -> int:
+        """Drop the trips whose last ping is older than `before` (epoch seconds); returns how many."""
+        evicted = 0
+        # Trips are kept in the order they last reported
+        while self.trips:
+            state = next(iter(self.trips.values()))
+            if state.seen >= before:
+                break
+            self.trips.popitem(last=False)
+            evicted += 1
+        self.stats["evicted"] += evicted
+        return evicted
+
+
+def replay_batches(positions: pd.DataFrame, batch_seconds: float = 30.0) -> Iterator[pd.DataFrame]:
+    """
+    Replay archived vehicle positions as a feed: one batch per `batch_seconds` of
+    ping timestamps, in timestamp order.
+    """
+    if positions.empty:
+        return
+    positions = positions.sort_values("timestamp", kind="stable", ignore_index=True)
+    windows = (positions["timestamp"] // batch_seconds).to_numpy()
+    bounds = np.flatnonzero(np.diff(windows)) + 1
+    for start, end in zip(np.concatenate([[0], bounds]), np.concatenate([bounds, [len(positions)]])):
+        yield positions.iloc[start:end]
@@ -0,0 +1,165 @@
+"""
+Multi-resolution time cube over the daily route rollups.
+
+The base level holds, for every route and local date, the (distance, time,
+observations) sums of each 15-minute bin of the day. Every coarser level is
+derived from the one below it by summing, never from raw speeds:
+
+    15-minute bins -> hours -> rush periods        (within a day)
+    dates -> weekday / day type / month            (across days)
+
+Average speeds are computed only at the end, as sum(distance) / sum(time), so
+every level is exact rather than an average of averages.
+"""
+from typing import Iterable, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .rollups import (ROLLUPS_DIR, ROUTE_QUARTER_HOURLY, RUSH_PERIODS, SLOTS_PER_HOUR, SUM_COLUMNS,
+                      read_rollup, rush_hour_labels)
+
+SLOTS = 24 * SLOTS_PER_HOUR
+DISTANCE, TIME, OBSERVATIONS = range(len(SUM_COLUMNS))
+
+# Resolutions and their number of bins per day
+RESOLUTIONS = {"quarter": SLOTS, "hour": 24, "rush": len(RUSH_PERIODS)}
+DAY_TYPES = {
+    "weekday": (0, 1, 2, 3, 4),
+    "weekend": (5, 6),
+}
+
+# Day selection: a weekday number (0 = Monday), a day type, or None for every day
+Days = Union[int, str, None]
+
+
+class TimeCube:
+    """Daily sums in 15-minute bins, indexed by [route, date, slot, metric]."""
+
+    def __init__(self, routes: np.ndarray, dates: np.ndarray, sums: np.ndarray):
+        """
+        Parameters:
+        routes (np.ndarray): Route IDs for each route index.
+        dates (np.ndarray): Sorted local dates (YYYY-MM-DD strings).
+        sums (np.ndarray): Array of shape (len(routes), len(dates), 96, 3).
+        """
+        self.routes = routes
+        self.dates = dates
+        self.sums = sums
+        self.weekdays = pd.to_datetime(pd.Series(dates, dtype=object)).dt.dayofweek.to_numpy()
+        self.months = np.array([date[:7] for date in dates], dtype=object)
+        self._route_index = {route_id: i for i, route_id in enumerate(routes)}
+
+    @classmethod
+    def from_rollups(
+        cls,
+        route_ids: Optional[Iterable[str]] = None,
+        base_dir: str = ROLLUPS_DIR,
+        feed_ids: Optional[Iterable[str]] = None,
+    ) -> "TimeCube":
+        """Build the cube from the 15-minute rollups of the selected routes."""
+        return cls.from_partial_sums(read_rollup(ROUTE_QUARTER_HOURLY, base_dir, route_ids, feed_ids=feed_ids))
+
+    @classmethod
+    def from_partial_sums(cls, sums: pd.DataFrame) -> "TimeCube":
+        """Build the cube from a DataFrame of daily 15-minute partial sums."""
+        if sums.empty:
+            return cls(np.array([], dtype=object), np.array([], dtype=object),
+                       np.zeros((0, 0, SLOTS, len(SUM_COLUMNS))))
+
+        route_ids = sums["route_id"].astype(str).to_numpy()
+        local_dates = sums["date"].astype(str).to_numpy()
+        routes = np.unique(route_ids)
+        dates = np.unique(local_dates)
+
+        cube = np.zeros((len(routes), len(dates), SLOTS, len(SUM_COLUMNS)))
+        np.add.at(cube, (np.searchsorted(routes, route_ids), np.searchsorted(dates, local_dates),
+                         sums["slot"].to_numpy().astype(np.intp)),
+                  sums[SUM_COLUMNS].to_numpy(dtype=float))
+        return cls(routes, dates, cube)
+
+    def __contains__(self, route_id: str) -> bool:
+        return route_id in self._route_index
+
+    def _date_mask(self, start_date: Optional[str], end_date: Optional[str], days: Days) -> np.ndarray:
+        """Dates inside the inclusive window that match the day selection."""
+        mask = np.ones(len(self.dates), dtype=bool)
+        if start_date is not None:
+            mask &= self.dates >= start_date
+        if end_date is not None:
+            mask &= self.dates <= end_date
+        if isinstance(days, str):
+            mask &= np.isin(self.weekdays, DAY_TYPES[days])
+        elif days is not None:
+            mask &= self.weekdays == days
+        return mask
+
+    @staticmethod
+    def to_hours(quarter_sums: np.ndarray) -> np.ndarray:
+        """Roll (..., 96, metric) 15-minute sums up to (..., 24, metric) hourly sums."""
+        return quarter_sums.reshape(quarter_sums.shape[:-2] + (24, SLOTS_PER_HOUR, quarter_sums.shape[-1])).sum(axis=-2)
+
+    @staticmethod
+    def to_rush_periods(hour_sums: np.ndarray) -> np.ndarray:
+        """Roll (..., 24, metric) hourly sums up to (..., 3, metric) sums per rush period."""
+        period = pd.Categorical(rush_hour_labels(np.arange(24)), categories=RUSH_PERIODS).codes
+        out = np.zeros(hour_sums.shape[:-2] + (len(RUSH_PERIODS), hour_sums.shape[-1]))
+        for i in range(len(RUSH_PERIODS)):
+            out[..., i, :] = hour_sums[..., period == i, :].sum(axis=-2)
+        return out
+
+    @classmethod
+    def roll_up(cls, quarter_sums: np.ndarray, resolution: str) -> np.ndarray:
+        """Roll 15-minute sums up to the requested resolution."""
+        if resolution == "quarter":
+            return quarter_sums
+        hours = cls.to_hours(quarter_sums)
+        if resolution == "hour":
+            return hours
+        if resolution == "rush":
+            return cls.to_rush_periods(hours)
+        raise ValueError(f"Unknown resolution {resolution}, expected one of {list(RESOLUTIONS)}")
+
+    @staticmethod
+    def speeds_mph(sums: np.ndarray) -> np.ndarray:
+        """Convert (distance in feet, time in seconds) sums to mph, NaN where time is zero."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speeds = (sums[..., DISTANCE] / 5280) / (sums[..., TIME] / 3600)
+        return np.where(sums[..., TIME] > 0, speeds, np.nan)
+
+    def window_sums(self, route_id: str, start_date: Optional[str], end_date: Optional[str],
+                    days: Days = None, resolution: str = "hour") -> np.ndarray:
+        """
+        Sums per time bin over the dates of a window that match the day selection.
+
+        :param route_id: Route ID.
+        :param start_date: First local date (YYYY-MM-DD), or None for no bound.
+        :param end_date: Last local date (YYYY-MM-DD), or None for no bound.
+        :param days: Weekday number, "weekday", "weekend" or None for every day.
+        :param resolution: "quarter" (96 bins), "hour" (24) or "rush" (morning, evening, non-rush).
+        :return: Array of shape (bins, 3).
+        """
+        if route_id not in self._route_index:
+            return self.roll_up(np.zeros((SLOTS, len(SUM_COLUMNS))), resolution)
+        daily = self.sums[self._route_index[route_id], self._date_mask(start_date, end_date, days)]
+        return self.roll_up(daily.sum(axis=0), resolution)
+
+    def speeds(self, route_id: str, start_date: Optional[str], end_date: Optional[str],
+               days: Days = None, resolution: str = "hour") -> np.ndarray:
+        """Average speed per time bin over a window; see `window_sums`."""
+        return self.speeds_mph(self.window_sums(route_id, start_date, end_date, days, resolution))
+
+    def monthly_speeds(self, route_id: str, days: Days = None,
+                       resolution: str = "rush") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Average speed per month and time bin.
+
+        :return: (months as YYYY-MM strings, array of shape (len(months), bins)).
+        """
+        if route_id not in self._route_index:
+            return np.array([], dtype=object), np.zeros((0, RESOLUTIONS[resolution]))
+        mask = self._date_mask(None, None, days)
+        months, month_index = np.unique(self.months[mask], return_inverse=True)
+        monthly = np.zeros((len(months), SLOTS, len(SUM_COLUMNS)))
+        np.add.at(monthly, month_index, self.sums[self._route_index[route_id], mask])
+        return months, self.speeds_mph(self.roll_up(monthly, resolution))
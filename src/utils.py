@@ -1,50 +1,76 @@
-import requests
-import gzip
 import pandas as pd
-import tempfile
-import shutil
-import os
-import geopandas as gpd
-import numpy as np
 import tarfile
-import traceback
+from .storage import COPY_CHUNK_SIZE, split_uri
 
-def read_parquet_from_tar_gz(url):
+def iter_parquet_from_tar_gz(url, columns=None, filter=None, batch_size=65536, errors=None):
     """
-    Downloads a .tar.gz file from the given URL, extracts its contents which are 
-    expected to be Parquet files, and reads them into a single Pandas DataFrame.
+    Streams a .tar.gz file of Parquet files from the given URL and yields their
+    rows as Arrow record batches. The archive is downloaded in chunks and its
+    members are read straight from the gzip stream, so nothing is written to
+    disk and only one member is held in memory at a time.
 
     Parameters:
-    url (str): URL to the .tar.gz file.
+    url (str): URL (http(s):// or s3://) or local path of the .tar.gz file.
+    columns (list): (Optional) Columns to read.
+    filter (pyarrow.dataset.Expression): (Optional) Row filter, e.g. ds.field("trip.route_id") == "M50".
+        Its columns need not be among `columns`.
+    batch_size (int): Maximum number of rows per batch.
+    errors (list): (Optional) Receives a (member name, error message) tuple for every
+        Parquet member that could not be decoded.
 
-    Returns:
-    pd.DataFrame: DataFrame containing the data from the Parquet files.
+    Yields:
+    pa.RecordBatch: Batches of the decoded members, in archive order.
     """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
 
-    # Create a temporary directory
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Download the .tar.gz file
-        response = requests.get(url)
-        tar_gz_path = os.path.join(temp_dir, 'data.tar.gz')
-        with open(tar_gz_path, 'wb') as f:
-            f.write(response.content)
-
-        # Extract the .tar.gz file
-        with tarfile.open(tar_gz_path, 'r:gz') as tar:
-            tar.extractall(path=temp_dir)
-
-        # Read all Parquet files in the temp directory into DataFrames
-        df_list = []
-        
-        for root, dirs, files in os.walk(temp_dir):
-            for file in files:
-                try: 
-                    file_path = os.path.join(root, file)
-                    df_list.append(pd.read_parquet(file_path))
-                except:  # Catch the exception
+    parquet_format = ds.ParquetFileFormat()
+    storage, key = split_uri(url)
+    stream = storage.open(key)
+    try:
+        with tarfile.open(fileobj=stream, mode='r|gz', bufsize=COPY_CHUNK_SIZE) as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                data = tar.extractfile(member).read()
+                if data[:4] != b'PAR1':
+                    # Not a Parquet file (e.g. a README or macOS metadata)
                     continue
+                try:
+                    fragment = parquet_format.make_fragment(pa.BufferReader(data))
+                    # Decode the whole member before yielding, so a corrupt one yields nothing
+                    batches = list(fragment.to_batches(columns=columns, filter=filter, batch_size=batch_size))
+                except (pa.ArrowException, OSError) as e:
+                    print(f"Error decoding {member.name} in {url}: {e}")
+                    if errors is not None:
+                        errors.append((member.name, str(e)))
+                    continue
+                yield from batches
+    finally:
+        stream.close()
+
+
+def read_parquet_from_tar_gz(url, columns=None, filter=None):
+    """
+    Reads the Parquet files of a .tar.gz file from the given URL into a single
+    Pandas DataFrame, streaming the archive with `iter_parquet_from_tar_gz`.
+
+    Parameters:
+    url (str): URL (http(s):// or s3://) or local path of the .tar.gz file.
+    columns (list): (Optional) Columns to read.
+    filter (pyarrow.dataset.Expression): (Optional) Row filter.
 
-        # Concatenate all DataFrames
-        df = pd.concat(df_list, ignore_index=True)
+    Returns:
+    pd.DataFrame: DataFrame containing the data from the Parquet files.
+    """
+    import pyarrow as pa
 
-    return df
\ No newline at end of file
+    errors = []
+    batches = iter_parquet_from_tar_gz(url, columns, filter, errors=errors)
+    tables = [pa.Table.from_batches([batch]) for batch in batches]
+    if not tables:
+        if errors:
+            raise ValueError(f"No Parquet file in {url} could be decoded ({len(errors)} failed)")
+        return pd.DataFrame()
+    # Members written at different times may differ slightly in schema
+    return pa.concat_tables(tables, promote_options='default').to_pandas()
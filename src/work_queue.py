@@ -0,0 +1,358 @@
+"""
+Lease-based work queue for backfills split across processes and nodes.
+
+A coordinator enqueues one task per (feed, date, shard of routes) in a SQLite
+file that every node can reach (e.g. on a shared filesystem), and any number of
+`runner.py --role worker` processes claim tasks from it:
+
+    pending --claim--> leased --complete--> done
+                         |  \\--fail / lease expired--> pending (retried), or failed after MAX_ATTEMPTS
+
+A claim is a short `BEGIN IMMEDIATE` transaction that leases the task for
+`lease_seconds`. While it processes the task, a worker renews the lease from a
+heartbeat thread. A worker that dies stops renewing, and once the lease expires
+the task is handed to the next worker that asks; if the first worker was only
+stalled, its heartbeat finds the lease taken over and it abandons the task
+before writing outputs. A task is done only when the job manifest records all
+its routes as complete, so failed loads or computations are retried. Retries are
+safe because `SpeedCalculator` skips the partitions that the manifest already
+records as complete. Tasks are independent and claims are rare (one per task, i.e. per
+several minutes of processing), so adding workers scales the backfill until the
+vehicle-position storage becomes the bottleneck.
+
+Workers prefer tasks of the feed they processed last, so each loads a GTFS feed
+once rather than once per task.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
+
+LEASE_SECONDS = 10 * 60
+MAX_ATTEMPTS = 3
+POLL_SECONDS = 30
+THROUGHPUT_WINDOW = 15 * 60
+TASK_STATES = ("pending", "leased", "done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    feed_id TEXT NOT NULL,
+    gtfs_url TEXT NOT NULL,
+    date TEXT NOT NULL,
+    routes TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_expires REAL,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    rows INTEGER,
+    error TEXT,
+    UNIQUE (feed_id, date, routes)
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, feed_id, date);
+"""
+
+
+class LeaseLost(Exception):
+    """Raised when a worker finds that another worker has taken over its task."""
+
+
+class Task(NamedTuple):
+    id: int
+    feed_id: str
+    gtfs_url: str
+    date: str
+    routes: List[str]
+    attempts: int
+
+
+def default_worker_id() -> str:
+    """Host name and process ID, unique across the nodes of a backfill."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def shard_routes(routes: List[str], shard_size: int) -> List[List[str]]:
+    """Split a route list into shards of at most `shard_size` routes."""
+    return [routes[i:i + shard_size] for i in range(0, len(routes), max(shard_size, 1))]
+
+
+class WorkQueue:
+    """Tasks of a backfill in a SQLite file, claimed by workers with renewable leases."""
+
+    def __init__(self, path: str, lease_seconds: float = LEASE_SECONDS, max_attempts: int = MAX_ATTEMPTS):
+        """
+        Parameters:
+        path (str): SQLite file of the queue, created if needed.
+        lease_seconds (float): Lease granted by a claim or a heartbeat.
+        max_attempts (int): Claims of a task before it is marked failed.
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # One short-lived connection per operation, so the heartbeat thread needs no sharing
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connect() as conn:
+            # Take the write lock up front, so two workers cannot claim the same task
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, feed_id: str, gtfs_url: str, shards: Dict[str, List[List[str]]]) -> int:
+        """
+        Add the tasks of a feed. A task already queued for the same feed, date and routes
+        is left alone if pending or leased, and queued again if done or failed.
+
+        Parameters:
+        feed_id (str): Feed ID of the tasks.
+        gtfs_url (str): URL (or path) of the feed's GTFS zip, loaded by the workers.
+        shards (Dict[str, List[List[str]]]): Route shards per date (YYYY-MM-DD).
+
+        Returns:
+        int: Number of tasks added or queued again.
+        """
+        now = time.time()
+        rows = [(feed_id, gtfs_url, date, ",".join(routes), now)
+                for date, date_shards in shards.items() for routes in date_shards if routes]
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                """
+                INSERT INTO tasks (feed_id, gtfs_url, date, routes, enqueued_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (feed_id, date, routes) DO UPDATE SET
+                    status = 'pending', attempts = 0, worker = NULL, lease_expires = NULL,
+                    gtfs_url = excluded.gtfs_url, enqueued_at = excluded.enqueued_at,
+                    started_at = NULL, finished_at = NULL, rows = NULL, error = NULL
+                WHERE status IN ('done', 'failed')
+                """,
+                rows,
+            )
+            return conn.total_changes - before
+
+    def claim(self, worker: str, prefer_feed: Optional[str] = None) -> Optional[Task]:
+        """
+        Lease the next pending (or expired) task, preferring `prefer_feed`, then by date.
+
+        Returns:
+        Optional[Task]: The claimed task, or None if no task is available now.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'failed', error = coalesce(error, 'lease expired') "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            )
+            row = conn.execute(
+                """
+                SELECT id, feed_id, gtfs_url, date, routes, attempts FROM tasks
+                WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)
+                ORDER BY feed_id = ? DESC, date, id
+                LIMIT 1
+                """,
+                (now, prefer_feed),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                "started_at = ?, finished_at = NULL WHERE id = ?",
+                (worker, now + self.lease_seconds, now, row[0]),
+            )
+        task_id, feed_id, gtfs_url, date, routes, attempts = row
+        return Task(task_id, feed_id, gtfs_url, date, routes.split(","), attempts + 1)
+
+    def heartbeat(self, task_id: int, worker: str) -> bool:
+        """Renew a lease; returns False if the worker no longer holds it."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (time.time() + self.lease_seconds, task_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, task_id: int, worker: str, rows: int = 0) -> bool:
+        """Mark a leased task done; returns False if the lease was lost to another worker."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = 'done', lease_expires = NULL, finished_at = ?, rows = ?, error = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'leased'",
+                (time.time(), int(rows), task_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, task_id: int, worker: str, error: str) -> bool:
+        """Release a leased task after an error: pending again, or failed after `max_attempts`."""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "lease_expires = NULL, finished_at = ?, error = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                (self.max_attempts, time.time(), error, task_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def has_unfinished(self) -> bool:
+        """Whether any task is pending or leased (and may still need a worker)."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT 1 FROM tasks WHERE status IN ('pending', 'leased') LIMIT 1"
+            ).fetchone() is not None
+
+    def progress(self, window: float = THROUGHPUT_WINDOW) -> dict:
+        """
+        Progress and throughput of the backfill.
+
+        Parameters:
+        window (float): Seconds over which the recent throughput and the ETA are measured.
+
+        Returns:
+        dict: Tasks per state, expired leases, partitions (dates x routes) and rows done,
+            active workers, overall and recent tasks per hour, and the ETA in seconds.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            counts = dict.fromkeys(TASK_STATES, 0)
+            counts.update(conn.execute("SELECT status, count(*) FROM tasks GROUP BY status").fetchall())
+            expired, workers = conn.execute(
+                "SELECT sum(lease_expires < ?), count(DISTINCT CASE WHEN lease_expires >= ? THEN worker END) "
+                "FROM tasks WHERE status = 'leased'",
+                (now, now),
+            ).fetchone()
+            first_start, last_finish, partitions, rows = conn.execute(
+                "SELECT min(started_at), max(finished_at), "
+                "sum(length(routes) - length(replace(routes, ',', '')) + 1), sum(rows) "
+                "FROM tasks WHERE status = 'done'"
+            ).fetchone()
+            recent = conn.execute(
+                "SELECT count(*) FROM tasks WHERE status = 'done' AND finished_at >= ?", (now - window,)
+            ).fetchone()[0]
+
+        remaining = counts["pending"] + counts["leased"]
+        elapsed = (last_finish - first_start) if counts["done"] and last_finish > first_start else None
+        recent_per_hour = recent / max(min(window, now - first_start), 1) * 3600 if recent else 0.0
+        return {
+            **counts,
+            "expired": expired or 0,
+            "active_workers": workers,
+            "partitions_done": partitions or 0,
+            "rows_done": rows or 0,
+            "tasks_per_hour": round(counts["done"] / elapsed * 3600, 1) if elapsed else None,
+            "recent_tasks_per_hour": round(recent_per_hour, 1),
+            "eta_s": round(remaining / recent_per_hour * 3600) if recent_per_hour else None,
+        }
+
+
+def format_progress(progress: dict) -> str:
+    """One-line summary of `WorkQueue.progress`."""
+    total = sum(progress[state] for state in TASK_STATES)
+    eta = progress["eta_s"]
+    return (
+        f"{progress['done']}/{total} tasks done ({progress['partitions_done']} partitions, "
+        f"{progress['rows_done']:,} rows), {progress['leased']} leased ({progress['expired']} expired), "
+        f"{progress['pending']} pending, {progress['failed']} failed | {progress['active_workers']} workers, "
+        f"{progress['recent_tasks_per_hour']} tasks/h recent, {progress['tasks_per_hour'] or 0} tasks/h overall"
+        + (f", ETA {eta // 3600}:{eta % 3600 // 60:02d}" if eta is not None else "")
+    )
+
+
+class Heartbeat:
+    """Renews a task's lease from a background thread while the task is processed."""
+
+    def __init__(self, queue: WorkQueue, task_id: int, worker: str, interval: Optional[float] = None):
+        self.queue = queue
+        self.task_id = task_id
+        self.worker = worker
+        # A third of the lease leaves room for two missed beats (e.g. a busy shared filesystem)
+        self.interval = queue.lease_seconds / 3 if interval is None else interval
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{task_id}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.queue.heartbeat(self.task_id, self.worker):
+                    self.lost.set()
+                    return
+            except sqlite3.Error as e:
+                print(f"Heartbeat of task {self.task_id} failed: {e}")
+
+    def __enter__(self) -> "Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_worker(queue: WorkQueue, process: Callable[[Task, threading.Event], int], worker: Optional[str] = None,
+               poll_seconds: float = POLL_SECONDS, max_tasks: Optional[int] = None) -> int:
+    """
+    Claim and process tasks until the queue is drained.
+
+    While other workers hold leases the worker keeps polling, since their tasks come
+    back to the queue if they die. Errors are recorded on the task, which is retried.
+    A task whose lease is lost is abandoned: it is neither completed nor failed, as
+    another worker now holds it.
+
+    :param queue: The work queue.
+    :param process: Processes a task and returns the number of rows written. It is
+                    passed an event set when the lease is lost, and should then stop
+                    before writing any output (raising `LeaseLost`).
+    :param worker: (Optional) Worker ID (default: host name and process ID).
+    :param poll_seconds: Wait between claims when no task is available.
+    :param max_tasks: (Optional) Stop after this many tasks.
+    :return: Number of tasks completed.
+    """
+    worker = worker or default_worker_id()
+    completed = 0
+    feed_id = None
+    while max_tasks is None or completed < max_tasks:
+        task = queue.claim(worker, prefer_feed=feed_id)
+        if task is None:
+            if not queue.has_unfinished():
+                break
+            time.sleep(poll_seconds)
+            continue
+        feed_id = task.feed_id
+        print(f"{worker}: task {task.id} ({task.feed_id} {task.date} {','.join(task.routes)}), "
+              f"attempt {task.attempts}")
+        with Heartbeat(queue, task.id, worker) as heartbeat:
+            try:
+                rows = process(task, heartbeat.lost)
+            except LeaseLost:
+                print(f"{worker}: lease of task {task.id} was lost; abandoned it to its new worker")
+                continue
+            except Exception as e:
+                print(f"{worker}: task {task.id} failed: {e}")
+                queue.fail(task.id, worker, f"{type(e).__name__}: {e}")
+                continue
+        if queue.complete(task.id, worker, rows):
+            completed += 1
+        else:
+            print(f"{worker}: lease of task {task.id} was lost; its result is kept in the manifest")
+    return completed